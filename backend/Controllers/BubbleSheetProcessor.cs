@@ -3,11 +3,13 @@ using System;
 using System.Collections.Generic;
 using System.IO;
 using System.Linq;
+using System.Threading;
 using System.Threading.Tasks;
 using Microsoft.AspNetCore.Hosting;
 using Microsoft.Extensions.Logging;
 using System.Diagnostics;
 using Graduation_proj.Models;
+using Graduation_proj.Services;
 using Microsoft.EntityFrameworkCore;
 
 namespace Graduation_proj.Controllers
@@ -18,18 +20,20 @@ namespace Graduation_proj.Controllers
     {
         private readonly ApplicationDbContext _context;
         private readonly ILogger<BubbleSheetProcessor> _logger;
+        private readonly PythonWorker _pythonWorker;
         private readonly string _uploadsFolder;
 
-        public BubbleSheetProcessor(ApplicationDbContext context, IWebHostEnvironment hostEnvironment, ILogger<BubbleSheetProcessor> logger)
+        public BubbleSheetProcessor(ApplicationDbContext context, IWebHostEnvironment hostEnvironment, ILogger<BubbleSheetProcessor> logger, PythonWorker pythonWorker)
         {
             _context = context ?? throw new ArgumentNullException(nameof(context));
             _logger = logger ?? throw new ArgumentNullException(nameof(logger));
+            _pythonWorker = pythonWorker ?? throw new ArgumentNullException(nameof(pythonWorker));
             _uploadsFolder = Path.Combine(hostEnvironment.WebRootPath, "Uploads");
             Directory.CreateDirectory(_uploadsFolder);
         }
 
         [HttpPost("CorrectBubbleSheets")]
-        public async Task<IActionResult> CorrectBubbleSheets([FromForm] CorrectBubbleSheetsDto dto)
+        public async Task<IActionResult> CorrectBubbleSheets([FromForm] CorrectBubbleSheetsDto dto, CancellationToken cancellationToken)
         {
             try
             {
@@ -82,41 +86,29 @@ namespace Graduation_proj.Controllers
                 // Prepare output path for grades.xlsx
                 var outputPath = Path.Combine(_uploadsFolder, "Temp", $"grades_{Guid.NewGuid()}.xlsx");
 
-                // Call Correct.py
-                string pythonPath = @"C:\Users\Eng.Ahmed\AppData\Local\Programs\Python\Python312\python.exe"; // Replace with your Python path
-                string scriptPath = @"D:\Eng\Graduation_proj\python\Correct.py"; // Replace with your Correct.py path
-
-                var arguments = new[]
-                {
-                       $"\"{scriptPath}\"",
-                       "--input", $"\"{inputPath}\"",
-                       "--excel", $"\"{excelFilePath}\"",
-                       "--output", $"\"{outputPath}\""
-                   };
-
-                ProcessStartInfo start = new ProcessStartInfo
+                // Grade through the persistent Python worker (Correct.py)
+                var result = await _pythonWorker.RunJobAsync("grade", new
                 {
-                    FileName = pythonPath,
-                    Arguments = string.Join(" ", arguments),
-                    UseShellExecute = false,
-                    RedirectStandardOutput = true,
-                    RedirectStandardError = true,
-                    CreateNoWindow = true
-                };
-
-                using (Process process = Process.Start(start))
+                    input = inputPath,
+                    excel = excelFilePath,
+                    output = outputPath,
+                    // Keyed by file content, so re-uploading the same sheets after a failure resumes the grading
+                    checkpoint_dir = Path.Combine(_uploadsFolder, "Temp", "Checkpoints")
+                }, progress =>
                 {
-                    string output = await process.StandardOutput.ReadToEndAsync();
-                    string error = await process.StandardError.ReadToEndAsync();
-                    await process.WaitForExitAsync();
-
-                    if (process.ExitCode != 0 || !string.IsNullOrEmpty(error))
+                    if (progress.TryGetProperty("stage", out var stage) && stage.GetString() == "read")
                     {
-                        _logger.LogError("Python script error: {Error}", error);
-                        return StatusCode(500, new { success = false, message = $"Failed to correct bubble sheets: {error}" });
+                        _logger.LogInformation("Read bubble sheet {Done}/{Total}.", progress.GetProperty("done").GetInt32(), progress.GetProperty("total").GetInt32());
                     }
-                    _logger.LogInformation("Python script output: {Output}", output);
+                }, cancellationToken);
+
+                if (!result.GetProperty("success").GetBoolean())
+                {
+                    var error = result.TryGetProperty("message", out var message) ? message.GetString() : "Unknown error";
+                    _logger.LogError("Python worker error: {Error}", error);
+                    return StatusCode(500, new { success = false, message = $"Failed to correct bubble sheets: {error}" });
                 }
+                _logger.LogInformation("Python worker graded {Students} bubble sheets in {Seconds}s.", result.GetProperty("students").GetInt32(), result.GetProperty("seconds").GetDouble());
 
                 // Read and return the output Excel file
                 if (!System.IO.File.Exists(outputPath))
@@ -142,6 +134,16 @@ namespace Graduation_proj.Controllers
 
                 return File(outputBytes, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "grades.xlsx");
             }
+            catch (TimeoutException ex)
+            {
+                _logger.LogError(ex, "Correcting bubble sheets timed out.");
+                return StatusCode(504, new { success = false, message = $"Error correcting bubble sheets: {ex.Message}" });
+            }
+            catch (OperationCanceledException) when (cancellationToken.IsCancellationRequested)
+            {
+                _logger.LogInformation("Correcting bubble sheets was cancelled by the client.");
+                return new EmptyResult();
+            }
             catch (Exception ex)
             {
                 _logger.LogError(ex, "Error correcting bubble sheets.");
@@ -14,6 +14,7 @@ using System.Threading.Tasks;
 using Microsoft.AspNetCore.Hosting;
 using Microsoft.Extensions.Logging;
 using Graduation_proj.Models;
+using Graduation_proj.Services;
 using System.ComponentModel.DataAnnotations;
 using System.Diagnostics;
 
@@ -25,12 +26,14 @@ namespace Graduation_proj.Controllers
     {
         private readonly ApplicationDbContext _context;
         private readonly ILogger<ExamFilesGenerator> _logger;
+        private readonly PythonWorker _pythonWorker;
         private readonly string _uploadsFolder;
 
-        public ExamFilesGenerator(ApplicationDbContext context, IWebHostEnvironment hostEnvironment, ILogger<ExamFilesGenerator> logger)
+        public ExamFilesGenerator(ApplicationDbContext context, IWebHostEnvironment hostEnvironment, ILogger<ExamFilesGenerator> logger, PythonWorker pythonWorker)
         {
             _context = context ?? throw new ArgumentNullException(nameof(context));
             _logger = logger ?? throw new ArgumentNullException(nameof(logger));
+            _pythonWorker = pythonWorker ?? throw new ArgumentNullException(nameof(pythonWorker));
             _uploadsFolder = Path.Combine(hostEnvironment.WebRootPath, "Uploads");
             Directory.CreateDirectory(_uploadsFolder);
         }
@@ -448,8 +451,6 @@ namespace Graduation_proj.Controllers
         {
             try
             {
-                string pythonPath = @"C:\Users\Eng.Ahmed\AppData\Local\Programs\Python\Python312\python.exe"; // Replace with your Python path
-                string scriptPath = @"D:\Eng\Graduation_proj\python\Bubble.py"; // Replace with your Bubble.py path
                 string outputDir = Path.Combine(_uploadsFolder, "BubbleSheets", Guid.NewGuid().ToString());
                 Directory.CreateDirectory(outputDir);
 
@@ -457,51 +458,34 @@ namespace Graduation_proj.Controllers
                 string models = string.Join(",", Enumerable.Range(0, numberOfModels).Select(i => ((char)('A' + i)).ToString()));
                 string term = material.Term == 1 ? "First Term" : "Second Term";
 
-                var arguments = new[]
+                // Generate through the persistent Python worker (Bubble.py)
+                var result = await _pythonWorker.RunJobAsync("generate", new
                 {
-                    $"\"{scriptPath}\"",
-                    "--title", $"\"{firstExam.ExamName}\"",
-                    "--course_name", $"\"{material.MaterialName ?? "N/A"}\"",
-                    "--course_code", $"\"{material.MaterialCode ?? "N/A"}\"",
-                    "--course_level", $"\"{material.Level ?? "N/A"}\"",
-                    "--term", $"\"{term}\"",
-                    "--num_questions", totalQuestions.ToString(),
-                    "--exam_date", $"\"{firstExam.ExamDate:dd/MM/yyyy}\"",
-                    "--full_mark", $"\"{firstExam.MainDegree}\"",
-                    "--exam_time", $"\"{(firstExam.ExamDuration / 60.0):0.#} Hours\"",
-                    "--department", $"\"{material.Department ?? "N/A"}\"",
-                    "--college_name", $"\"{firstExam.CollegeName ?? "N/A"}\"",
-                    "--university_name", $"\"{firstExam.UniversityName ?? "N/A"}\"",
-                    "--models", $"\"{models}\"",
-                    "--output_dir", $"\"{outputDir}\""
-                };
-
-                ProcessStartInfo start = new ProcessStartInfo
-                {
-                    FileName = pythonPath,
-                    Arguments = string.Join(" ", arguments),
-                    UseShellExecute = false,
-                    RedirectStandardOutput = true,
-                    RedirectStandardError = true,
-                    CreateNoWindow = true
-                };
-
-                using (Process process = Process.Start(start))
+                    title = firstExam.ExamName,
+                    course_name = material.MaterialName ?? "N/A",
+                    course_code = material.MaterialCode ?? "N/A",
+                    course_level = material.Level ?? "N/A",
+                    term,
+                    num_questions_val = totalQuestions,
+                    exam_date = $"{firstExam.ExamDate:dd/MM/yyyy}",
+                    full_mark = $"{firstExam.MainDegree}",
+                    exam_time = $"{(firstExam.ExamDuration / 60.0):0.#} Hours",
+                    department = material.Department ?? "N/A",
+                    college_name = firstExam.CollegeName ?? "N/A",
+                    university_name = firstExam.UniversityName ?? "N/A",
+                    models,
+                    output_dir = outputDir
+                }, cancellationToken: HttpContext.RequestAborted);
+
+                if (!result.GetProperty("success").GetBoolean())
                 {
-                    string output = await process.StandardOutput.ReadToEndAsync();
-                    string error = await process.StandardError.ReadToEndAsync();
-                    await process.WaitForExitAsync();
-
-                    if (process.ExitCode != 0 || !string.IsNullOrEmpty(error))
-                    {
-                        _logger.LogError("Python script error: {Error}", error);
-                        throw new Exception($"Failed to generate bubble sheets: {error}");
-                    }
-
-                    _logger.LogInformation("Python script output: {Output}", output);
+                    var error = result.TryGetProperty("message", out var message) ? message.GetString() : "Unknown error";
+                    _logger.LogError("Python worker error: {Error}", error);
+                    throw new Exception($"Failed to generate bubble sheets: {error}");
                 }
 
-                return Directory.GetFiles(outputDir, "*.png").ToList();
+                _logger.LogInformation("Python worker generated {Count} bubble sheets in {Seconds}s.", numberOfModels, result.GetProperty("seconds").GetDouble());
+                return result.GetProperty("paths").EnumerateArray().Select(p => p.GetString()!).ToList();
             }
             catch (Exception ex)
             {
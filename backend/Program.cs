@@ -1,5 +1,6 @@
 using OfficeOpenXml;
 using Graduation_proj.Models;
+using Graduation_proj.Services;
 using Microsoft.AspNetCore.Authentication.JwtBearer;
 using Microsoft.EntityFrameworkCore;
 using Microsoft.IdentityModel.Tokens;
@@ -38,6 +39,9 @@ builder.Services.AddSwaggerGen(options =>
     });
 });
 
+// Keep one warm Python process for grading and bubble sheet generation
+builder.Services.AddSingleton<PythonWorker>();
+
 // Add DbContext
 builder.Services.AddDbContext<ApplicationDbContext>(options =>
     options.UseSqlServer(builder.Configuration.GetConnectionString("DefaultConnection")));
@@ -0,0 +1,213 @@
+﻿using System;
+using System.Collections.Concurrent;
+using System.Diagnostics;
+using System.IO;
+using System.Linq;
+using System.Text.Json;
+using System.Threading;
+using System.Threading.Tasks;
+using Microsoft.Extensions.Configuration;
+using Microsoft.Extensions.Logging;
+
+namespace Graduation_proj.Services
+{
+    /// <summary>
+    /// Keeps a small pool of python/server.py processes alive and sends them grading and sheet
+    /// generation jobs as JSON lines, so requests no longer pay for a cold interpreter and library
+    /// imports. PythonWorker:PoolSize sets how many jobs run at once (default 1) and
+    /// PythonWorker:JobTimeoutSeconds how long one job may take (default 600).
+    /// </summary>
+    public class PythonWorker : IDisposable
+    {
+        private readonly ILogger<PythonWorker> _logger;
+        private readonly string _pythonPath;
+        private readonly string _serverScriptPath;
+        private readonly TimeSpan _jobTimeout;
+        private readonly WorkerProcess[] _workers;
+        private readonly ConcurrentBag<WorkerProcess> _idle;
+        private readonly SemaphoreSlim _available;
+
+        // One server.py process; null until its first job and after it has been stopped
+        private sealed class WorkerProcess
+        {
+            public Process? Process;
+        }
+
+        public PythonWorker(IConfiguration configuration, ILogger<PythonWorker> logger)
+        {
+            _logger = logger ?? throw new ArgumentNullException(nameof(logger));
+            _pythonPath = configuration["PythonWorker:PythonPath"]
+                          ?? throw new InvalidOperationException("PythonWorker:PythonPath is not configured");
+            _serverScriptPath = configuration["PythonWorker:ServerScriptPath"]
+                                ?? throw new InvalidOperationException("PythonWorker:ServerScriptPath is not configured");
+            var poolSize = int.TryParse(configuration["PythonWorker:PoolSize"], out var size) && size > 0 ? size : 1;
+            var timeoutSeconds = int.TryParse(configuration["PythonWorker:JobTimeoutSeconds"], out var seconds) && seconds > 0 ? seconds : 600;
+            _jobTimeout = TimeSpan.FromSeconds(timeoutSeconds);
+            _workers = Enumerable.Range(0, poolSize).Select(_ => new WorkerProcess()).ToArray();
+            _idle = new ConcurrentBag<WorkerProcess>(_workers);
+            _available = new SemaphoreSlim(poolSize, poolSize);
+        }
+
+        /// <summary>
+        /// Runs a job ("grade" or "generate") on the next free worker and returns its JSON response.
+        /// Progress events the job sends before its response are passed to onEvent. A job that runs
+        /// past the timeout fails with a TimeoutException and a cancelled one with an
+        /// OperationCanceledException; either way its worker is killed and restarted on its next
+        /// job, so jobs on the other workers are not affected.
+        /// </summary>
+        public async Task<JsonElement> RunJobAsync(string type, object args, Action<JsonElement>? onEvent = null,
+                                                   CancellationToken cancellationToken = default)
+        {
+            await _available.WaitAsync(cancellationToken);
+            // Every free slot in _available has an idle worker behind it
+            _idle.TryTake(out var worker);
+            using var job = CancellationTokenSource.CreateLinkedTokenSource(cancellationToken);
+            job.CancelAfter(_jobTimeout);
+            try
+            {
+                var process = await EnsureStartedAsync(worker!, job.Token);
+                var id = Guid.NewGuid().ToString();
+                var request = JsonSerializer.Serialize(new { id, type, args });
+
+                await process.StandardInput.WriteLineAsync(request.AsMemory(), job.Token);
+                await process.StandardInput.FlushAsync(job.Token);
+
+                var response = await ReadMessageAsync(process, id, onEvent, job.Token);
+                if (response == null)
+                {
+                    StopProcess(worker!);
+                    throw new Exception("Python worker exited before finishing the job.");
+                }
+                return response.Value;
+            }
+            catch (OperationCanceledException) when (job.IsCancellationRequested)
+            {
+                // The worker is still busy with the abandoned job, so it is replaced
+                StopProcess(worker!);
+                if (cancellationToken.IsCancellationRequested)
+                {
+                    _logger.LogInformation("Python job {Type} was cancelled; its worker was stopped.", type);
+                    throw;
+                }
+                _logger.LogWarning("Python job {Type} timed out after {Seconds}s; its worker was stopped.", type, _jobTimeout.TotalSeconds);
+                throw new TimeoutException($"Python job {type} did not finish within {_jobTimeout.TotalSeconds:0}s.");
+            }
+            finally
+            {
+                _idle.Add(worker!);
+                _available.Release();
+            }
+        }
+
+        private async Task<Process> EnsureStartedAsync(WorkerProcess worker, CancellationToken cancellationToken)
+        {
+            if (worker.Process != null && !worker.Process.HasExited)
+            {
+                return worker.Process;
+            }
+            StopProcess(worker);
+
+            var start = new ProcessStartInfo
+            {
+                FileName = _pythonPath,
+                Arguments = $"\"{_serverScriptPath}\"",
+                WorkingDirectory = Path.GetDirectoryName(_serverScriptPath),
+                UseShellExecute = false,
+                RedirectStandardInput = true,
+                RedirectStandardOutput = true,
+                RedirectStandardError = true,
+                CreateNoWindow = true
+            };
+
+            var process = new Process { StartInfo = start };
+            process.ErrorDataReceived += (sender, e) =>
+            {
+                if (!string.IsNullOrEmpty(e.Data))
+                {
+                    _logger.LogInformation("Python worker: {Output}", e.Data);
+                }
+            };
+            process.Start();
+            process.BeginErrorReadLine();
+            worker.Process = process;
+
+            if (await ReadMessageAsync(process, null, null, cancellationToken) == null)
+            {
+                StopProcess(worker);
+                throw new Exception("Python worker failed to start.");
+            }
+            _logger.LogInformation("Python worker started (PID {Pid}).", process.Id);
+            return process;
+        }
+
+        // Returns the first stdout message whose "id" matches, or null if the worker exits first.
+        // Events tagged with the job's id ({"job": id, "event": ...}) go to onEvent; other lines
+        // that are not protocol messages are logged and skipped.
+        private async Task<JsonElement?> ReadMessageAsync(Process process, string? id, Action<JsonElement>? onEvent,
+                                                          CancellationToken cancellationToken)
+        {
+            while (true)
+            {
+                // WaitAsync returns as soon as the token fires even if the pipe read does not observe it;
+                // the caller then kills the process, which ends the pending read
+                var line = await process.StandardOutput.ReadLineAsync(cancellationToken).AsTask().WaitAsync(cancellationToken);
+                if (line == null)
+                {
+                    return null;
+                }
+
+                try
+                {
+                    using var document = JsonDocument.Parse(line);
+                    var root = document.RootElement;
+                    if (root.ValueKind == JsonValueKind.Object && root.TryGetProperty("id", out var messageId)
+                        && (id == null ? messageId.ValueKind == JsonValueKind.Null : messageId.ValueKind == JsonValueKind.String && messageId.GetString() == id))
+                    {
+                        return root.Clone();
+                    }
+                    if (onEvent != null && id != null && root.ValueKind == JsonValueKind.Object
+                        && root.TryGetProperty("job", out var jobId) && jobId.ValueKind == JsonValueKind.String && jobId.GetString() == id)
+                    {
+                        onEvent(root.Clone());
+                        continue;
+                    }
+                }
+                catch (JsonException)
+                {
+                }
+                _logger.LogInformation("Python worker: {Output}", line);
+            }
+        }
+
+        private void StopProcess(WorkerProcess worker)
+        {
+            var process = worker.Process;
+            if (process == null)
+            {
+                return;
+            }
+            try
+            {
+                if (!process.HasExited)
+                {
+                    process.Kill(true);
+                }
+            }
+            catch (Exception ex)
+            {
+                _logger.LogWarning("Failed to stop Python worker: {Error}", ex.Message);
+            }
+            process.Dispose();
+            worker.Process = null;
+        }
+
+        public void Dispose()
+        {
+            foreach (var worker in _workers)
+            {
+                StopProcess(worker);
+            }
+            _available.Dispose();
+        }
+    }
+}
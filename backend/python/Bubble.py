@@ -1,13 +1,137 @@
 import cv2
 import numpy as np
 import os
+import json
+import hashlib
+import io
 import argparse
+import csv
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+LAYOUT_VERSION = 1
+SHEET_PAPER_SIZE = (2336, 3308)
+
+# ذاكرة مؤقتة للقوالب: الجزء الثابت من الورقة يُرسم مرة واحدة لكل امتحان ويُنسخ لكل نموذج
+template_cache = {}
+template_cache_size = 4
+sprite_cache = {}
 
 def create_blank_sheet(paper_size=(2480, 2806)):
-    """إنشاء ورقة بيضاء فارغة."""
-    return np.ones((paper_size[1], paper_size[0], 3), dtype=np.uint8) * 255
+    """إنشاء ورقة بيضاء فارغة بقناة رمادية واحدة، فالمحتوى كله أسود على أبيض."""
+    return np.full((paper_size[1], paper_size[0]), 255, dtype=np.uint8)
+
+def registration_marks(paper_size=(2480, 2806)):
+    """مواضع علامات التسجيل المربعة في أركان الورقة وطول ضلعها."""
+    # الهامشان الأيمن والسفلي أكبر لأن الورقة تتسع قليلاً عند إدراجها في صفحة A4 بملف Word فتخرج حافتاها عن الصفحة
+    mark_size = 40
+    left, right = 40, paper_size[0] - 100
+    top, bottom = 40, paper_size[1] - 180
+    return [(left, top), (right, top), (left, bottom), (right, bottom)], mark_size
+
+def bubble_sprite(label, radius, font_scale, filled=False):
+    """فقاعة وحرفها مرسومان مرة واحدة على خلفية بيضاء لتُطبع بعد ذلك بالنسخ."""
+    key = (label, radius, font_scale, filled)
+    if key not in sprite_cache:
+        half = radius + 3
+        sprite = np.full((2 * half + 1, 2 * half + 1), 255, dtype=np.uint8)
+        if filled:
+            cv2.circle(sprite, (half, half), radius, (0, 0, 0), cv2.FILLED, cv2.LINE_AA)
+        else:
+            cv2.circle(sprite, (half, half), radius, (0, 0, 0), 2, cv2.LINE_AA)
+            text_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 2)[0]
+            cv2.putText(sprite, label, (half - text_size[0] // 2, half + text_size[1] // 2),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 2, cv2.LINE_AA)
+        sprite_cache[key] = sprite
+    return sprite_cache[key]
+
+def stamp_sprite(image, sprite, center):
+    """طباعة الفقاعة الجاهزة حول المركز مع قص ما يخرج عن حدود الورقة."""
+    half = sprite.shape[0] // 2
+    x0, y0 = center[0] - half, center[1] - half
+    top, left = max(y0, 0), max(x0, 0)
+    bottom, right = min(y0 + sprite.shape[0], image.shape[0]), min(x0 + sprite.shape[1], image.shape[1])
+    if bottom <= top or right <= left:
+        return
+    region = image[top:bottom, left:right]
+    # الحد الأدنى يحافظ على أي حبر مرسوم مسبقاً تحت الخلفية البيضاء للفقاعة
+    np.minimum(region, sprite[top - y0:bottom - y0, left - x0:right - x0], out=region)
+
+# ========== عناصر الرسم ==========
+# كل دوال الرسم تستقبل إما صورة (مصفوفة numpy) فترسم عليها مباشرة، أو قائمة فتُضاف إليها العناصر
+# بنفس الإحداثيات لتُكتب لاحقاً كملف SVG أو PDF متجهي.
+
+def put_text(image, text, origin, font_scale):
+    if isinstance(image, list):
+        image.append(("text", str(text), origin, font_scale))
+    else:
+        cv2.putText(image, str(text), origin, cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 2, cv2.LINE_AA)
+
+def put_bubble(image, center, radius, label, font_scale, filled=False):
+    if isinstance(image, list):
+        image.append(("bubble", center, radius, label, font_scale, filled))
+    else:
+        stamp_sprite(image, bubble_sprite(label, radius, font_scale, filled), center)
+
+def put_line(image, start, end):
+    if isinstance(image, list):
+        image.append(("line", start, end))
+    else:
+        cv2.line(image, start, end, (0, 0, 0), 2)
+
+def put_rectangle(image, top_left, bottom_right):
+    if isinstance(image, list):
+        image.append(("rect", top_left, bottom_right))
+    else:
+        cv2.rectangle(image, top_left, bottom_right, (0, 0, 0), cv2.FILLED)
 
-def draw_header(image, title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no=None, paper_size=(2480, 2806)):
+def draw_registration_marks(image, paper_size=(2480, 2806)):
+    """رسم علامات التسجيل التي يستخدمها التصحيح لمعرفة موضع الورقة في الصورة الممسوحة."""
+    marks, mark_size = registration_marks(paper_size)
+    half = mark_size // 2
+    for x, y in marks:
+        put_rectangle(image, (x - half, y - half), (x + half - 1, y + half - 1))
+
+def header_geometry(paper_size=(2480, 2806), num_property_rows=11, with_model=True):
+    """حساب مواضع فقاعات رقم الجلوس والنموذج ونهاية رأس الصفحة."""
+    y_content_start = 50
+    row_height_left = 70
+    divider_x = paper_size[0] // 2
+    col_x_right_content_start = divider_x + 40
+
+    current_y_after_name = y_content_start + 70
+    text_size_seat = cv2.getTextSize("Seat Num:", cv2.FONT_HERSHEY_SIMPLEX, 1.0, 2)[0]
+    radius_bubble = 25
+    gap_x_bubble = 60
+    num_id_digits = 4
+    seat_start_x = col_x_right_content_start + 230
+    start_y_seat = current_y_after_name + text_size_seat[1] + 50
+    seat_rows = [[(seat_start_x + i * gap_x_bubble, start_y_seat + digit_pos * (radius_bubble * 2 + 20)) for i in range(10)]
+                 for digit_pos in range(num_id_digits)]
+    final_y_seat = start_y_seat + num_id_digits * (radius_bubble * 2 + 20)
+
+    # فقاعات النموذج أسفل رقم الجلوس مباشرة
+    model_label_y = final_y_seat + 40
+    model_y = model_label_y + 30
+    model_radius = 25
+    model_centers = [(seat_start_x + i * 60, model_y) for i in range(6)]
+    final_y_model = model_y + model_radius * 2 + 15 if with_model else final_y_seat
+
+    final_y_left = y_content_start + num_property_rows * row_height_left
+    # اسم الطالب يُكتب بعد عنوان "Name:" على السطر نفسه (في الأوراق المخصصة)
+    name_label_width = cv2.getTextSize("Name:", cv2.FONT_HERSHEY_SIMPLEX, 1.0, 2)[0][0]
+    return {
+        "name_origin": (col_x_right_content_start + name_label_width + 20, y_content_start + 5),
+        "seat_rows": seat_rows,
+        "seat_radius": radius_bubble,
+        "model_label_y": model_label_y,
+        "model_centers": model_centers if with_model else [],
+        "model_radius": model_radius,
+        "bottom": max(final_y_model, final_y_left) + 40,
+    }
+
+def draw_header(image, title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no=None, paper_size=(2480, 2806), stamp_model=True):
     """رسم قسم رأس الصفحة مقسمًا إلى عمودين."""
     center_x = paper_size[0] // 2
     y_content_start = 50  # تقليل المسافة العلوية
@@ -38,89 +162,55 @@ def draw_header(image, title, course_name, course_code, course_level, term, num_
     
     for i, (label, value) in enumerate(properties):
         current_row_y_left = current_y_left_col_content_start + i * row_height_right 
-        cv2.putText(image, label, (col_x_left_content_start, current_row_y_left), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2, cv2.LINE_AA) 
-        cv2.putText(image, str(value), (col_x_left_content_start + label_col_width_right + 20, current_row_y_left + 5), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 0), 2, cv2.LINE_AA) 
+        put_text(image, label, (col_x_left_content_start, current_row_y_left), 1.0)
+        put_text(image, value, (col_x_left_content_start + label_col_width_right + 20, current_row_y_left + 5), 0.9)
     
-    final_y_left_col_content = current_y_left_col_content_start + len(properties) * row_height_right
-
     current_y_right_col_content_start = y_content_start 
     col_x_right_content_start = divider_x + 40 
+    geometry = header_geometry(paper_size, len(properties), with_model=bool(model_no))
 
     name_text = "Name:"
-    cv2.putText(image, name_text, (col_x_right_content_start, current_y_right_col_content_start), 
-                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2, cv2.LINE_AA)
+    put_text(image, name_text, (col_x_right_content_start, current_y_right_col_content_start), 1.0)
     
     current_y_after_name = current_y_right_col_content_start + 70 
     seat_num_label = "Seat Num:"
-    text_size_seat = cv2.getTextSize(seat_num_label, cv2.FONT_HERSHEY_SIMPLEX, 1.0, 2)[0] 
-    cv2.putText(image, seat_num_label, (col_x_right_content_start, current_y_after_name), 
-                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2, cv2.LINE_AA)
+    put_text(image, seat_num_label, (col_x_right_content_start, current_y_after_name), 1.0)
         
-    radius_bubble = 25 
-    gap_x_bubble = 60 
-    seat_bubbles_common_start_x_new_right_col = col_x_right_content_start + 230 
-    num_id_digits = 4 
+    radius_bubble = geometry["seat_radius"] 
     digit_labels = ["Units:", "Tens:", "Hundreds:", "Thousands:"] 
-    start_y_actual_seat_bubbles = current_y_after_name + text_size_seat[1] + 50 
     label_x_offset_new_right_col = col_x_right_content_start + 20 
 
-    for digit_pos in range(num_id_digits): 
-        row_y_bubble = start_y_actual_seat_bubbles + digit_pos * (radius_bubble * 2 + 20) 
+    for digit_pos, row_centers in enumerate(geometry["seat_rows"]): 
+        row_y_bubble = row_centers[0][1] 
         label_text = digit_labels[digit_pos]
-        cv2.putText(image, label_text, (label_x_offset_new_right_col, row_y_bubble + cv2.getTextSize(label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.9, 2)[0][1] // 2), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 0), 2, cv2.LINE_AA)
-
-        for i in range(10): 
-            center_x_bubble = seat_bubbles_common_start_x_new_right_col + i * gap_x_bubble 
-            center_y_bubble = row_y_bubble
-            number_text = str(i) 
-            text_size_num_in_bubble = cv2.getTextSize(number_text, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0]
-            text_x_num_in_bubble = center_x_bubble - text_size_num_in_bubble[0] // 2
-            text_y_num_in_bubble = center_y_bubble + text_size_num_in_bubble[1] // 2
-            cv2.circle(image, (center_x_bubble, center_y_bubble), radius_bubble, (0, 0, 0), 2, cv2.LINE_AA)
-            cv2.putText(image, number_text, (text_x_num_in_bubble, text_y_num_in_bubble),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2, cv2.LINE_AA)
-
-    final_y_seat_num_section = start_y_actual_seat_bubbles + num_id_digits * (radius_bubble * 2 + 20) 
+        put_text(image, label_text, (label_x_offset_new_right_col, row_y_bubble + cv2.getTextSize(label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.9, 2)[0][1] // 2), 0.9)
+
+        for i, center in enumerate(row_centers): 
+            put_bubble(image, center, radius_bubble, str(i), 0.8)
 
     if model_no:
         model_no_label = "Model No.:"
-        current_y_model_no_section = final_y_seat_num_section + 40 
-        cv2.putText(image, model_no_label, (col_x_right_content_start, current_y_model_no_section), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2, cv2.LINE_AA) 
-        
-        num_choices_model_no = 6 
-        model_bubble_radius = 25 
-        model_bubble_gap_x = 60 
-        model_bubbles_start_x = seat_bubbles_common_start_x_new_right_col 
-        start_y_model_bubbles_base = current_y_model_no_section + 30 
-        
-        shade_model_index = ord(model_no.upper()) - ord('A') if model_no and isinstance(model_no, str) and model_no.isalpha() and len(model_no) == 1 and 'A' <= model_no.upper() <= chr(ord('A') + num_choices_model_no - 1) else -1
-
-        for i in range(num_choices_model_no):
-            char_to_display = chr(65 + i) 
-            center_x_model_bubble = model_bubbles_start_x + i * model_bubble_gap_x
-            center_y_model_bubble = start_y_model_bubbles_base
-            if i == shade_model_index:
-                cv2.circle(image, (center_x_model_bubble, center_y_model_bubble), model_bubble_radius, (0, 0, 0), cv2.FILLED, cv2.LINE_AA) 
-            else:
-                cv2.circle(image, (center_x_model_bubble, center_y_model_bubble), model_bubble_radius, (0, 0, 0), 2, cv2.LINE_AA) 
-                cv2.putText(image, char_to_display, (center_x_model_bubble - cv2.getTextSize(char_to_display, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0][0] // 2, center_y_model_bubble + cv2.getTextSize(char_to_display, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0][1] // 2),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2, cv2.LINE_AA) 
-        
-        final_y_model_no_section_content = start_y_model_bubbles_base + (model_bubble_radius * 2) + 15 
-    else:
-        final_y_model_no_section_content = final_y_seat_num_section 
+        put_text(image, model_no_label, (col_x_right_content_start, geometry["model_label_y"]), 1.0)
+        if stamp_model:
+            draw_model_bubbles(image, model_no, geometry)
 
-    final_y_after_header_section = max(final_y_model_no_section_content, final_y_left_col_content) + 40 
-    cv2.line(image, (80, final_y_after_header_section), (paper_size[0] - 80, final_y_after_header_section), (0, 0, 0), 2)
-    cv2.line(image, (divider_x, y_content_start - 25), (divider_x, final_y_after_header_section), (0, 0, 0), 2)
+    final_y_after_header_section = geometry["bottom"] 
+    put_line(image, (80, final_y_after_header_section), (paper_size[0] - 80, final_y_after_header_section))
+    put_line(image, (divider_x, y_content_start - 25), (divider_x, final_y_after_header_section))
     return final_y_after_header_section
 
-def add_answer_bubbles(image, num_questions, choices=4, student_info_y=400, paper_size=(2480, 2806)):
-    """إضافة فقاعات الإجابة."""
+def draw_model_bubbles(image, model_no, geometry):
+    """رسم فقاعات النموذج مع تظليل فقاعة النموذج المطلوب، وهو الجزء الوحيد الذي يختلف بين النماذج."""
+    num_choices_model_no = len(geometry["model_centers"]) 
+    model_bubble_radius = geometry["model_radius"] 
+    
+    shade_model_index = ord(model_no.upper()) - ord('A') if model_no and isinstance(model_no, str) and model_no.isalpha() and len(model_no) == 1 and 'A' <= model_no.upper() <= chr(ord('A') + num_choices_model_no - 1) else -1
+
+    for i, center in enumerate(geometry["model_centers"]):
+        put_bubble(image, center, model_bubble_radius, chr(65 + i), 0.8, filled=(i == shade_model_index))
+
+def answer_geometry(num_questions, choices=4, student_info_y=400, paper_size=(2480, 2806)):
+    """حساب مواضع أرقام الأسئلة وفقاعات الإجابة."""
     start_y = student_info_y + 80
     bubble_radius = 28 
     question_to_bubble_gap = 50 
@@ -156,6 +246,7 @@ def add_answer_bubbles(image, num_questions, choices=4, student_info_y=400, pape
         questions_in_col3 = remaining_questions_after_col1 - questions_in_col2 
         column_question_counts = [questions_in_col1, questions_in_col2, questions_in_col3]
     
+    questions = []
     current_question_offset = 0 
 
     for col_idx in range(num_columns):
@@ -169,70 +260,544 @@ def add_answer_bubbles(image, num_questions, choices=4, student_info_y=400, pape
             question_num_x = col_start_x + question_offset_from_col_start
             bubbles_start_current_x = col_start_x + bubble_offset_from_question
 
-            cv2.putText(image, f"{question_number:02d}.", (int(question_num_x), int(question_y)),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2, cv2.LINE_AA)
-
-            for choice in range(choices):
-                center_x = int(bubbles_start_current_x + bubble_inner_spacing * choice)
-                center_y = int(question_y - 5) 
-                letter = chr(65 + choice)
-                text_font_scale = 1.0 if num_columns == 2 else 0.8
-                cv2.circle(image, (center_x, center_y), bubble_radius, (0, 0, 0), 2, cv2.LINE_AA)
-                text_size = cv2.getTextSize(letter, cv2.FONT_HERSHEY_SIMPLEX, text_font_scale, 2)[0]
-                text_x = center_x - text_size[0] // 2
-                text_y = center_y + text_size[1] // 2
-                cv2.putText(image, letter, (text_x, text_y),
-                            cv2.FONT_HERSHEY_SIMPLEX, text_font_scale, (0, 0, 0), 2, cv2.LINE_AA)
-            
+            questions.append({
+                "number": question_number,
+                "label": (int(question_num_x), int(question_y)),
+                "centers": [(int(bubbles_start_current_x + bubble_inner_spacing * choice), int(question_y - 5))
+                            for choice in range(choices)],
+            })
             current_question_offset += 1 
 
     max_questions_in_any_column = max(column_question_counts) if column_question_counts else 0
-    return start_y + (max_questions_in_any_column * row_spacing) + 120
+    return {
+        "questions": questions,
+        "radius": bubble_radius,
+        "font_scale": 1.0 if num_columns == 2 else 0.8,
+        "bottom": start_y + (max_questions_in_any_column * row_spacing) + 120,
+    }
+
+def add_answer_bubbles(image, num_questions, choices=4, student_info_y=400, paper_size=(2480, 2806)):
+    """إضافة فقاعات الإجابة."""
+    geometry = answer_geometry(num_questions, choices, student_info_y, paper_size)
+    bubble_radius = geometry["radius"]
+    text_font_scale = geometry["font_scale"]
+
+    for question in geometry["questions"]:
+        put_text(image, f"{question['number']:02d}.", question["label"], 1.0)
+
+        for choice, center in enumerate(question["centers"]):
+            put_bubble(image, center, bubble_radius, chr(65 + choice), text_font_scale)
+
+    return geometry["bottom"]
+
+def build_layout_manifest(num_questions, choices=4, paper_size=SHEET_PAPER_SIZE):
+    """وصف هندسة الورقة (مركز ونصف قطر كل فقاعة) مع بصمة تميز التخطيط."""
+    header = header_geometry(paper_size, with_model=True)
+    answers = answer_geometry(num_questions, choices, header["bottom"], paper_size)
+    marks, mark_size = registration_marks(paper_size)
+    manifest = {
+        "version": LAYOUT_VERSION,
+        "paper_size": list(paper_size),
+        "num_questions": num_questions,
+        "choices": choices,
+        # صفوف رقم الجلوس بترتيب الرسم: الآحاد ثم العشرات ثم المئات ثم الآلاف
+        "seat": {"radius": header["seat_radius"], "place_values": [1, 10, 100, 1000],
+                 "rows": [[list(c) for c in row] for row in header["seat_rows"]]},
+        "model": {"radius": header["model_radius"], "centers": [list(c) for c in header["model_centers"]]},
+        "answers": {"radius": answers["radius"],
+                    "questions": [[list(c) for c in q["centers"]] for q in answers["questions"]]},
+        "marks": {"size": mark_size, "centers": [list(c) for c in marks]},
+    }
+    manifest["layout_hash"] = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:16]
+    return manifest
+
+def write_layout_manifest(manifest, output_dir):
+    """حفظ وصف التخطيط بجوار الأوراق باسم البصمة."""
+    manifest_path = os.path.join(output_dir, f"layout_{manifest['layout_hash']}.json")
+    if not os.path.exists(manifest_path):
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+    return manifest_path
+
+def sheet_template(header_fields, num_questions_val, model_no, manifest, paper_size=SHEET_PAPER_SIZE):
+    """الجزء الثابت من الورقة (كل شيء عدا فقاعات النموذج)، يُرسم مرة واحدة لكل رأس وعدد أسئلة وتخطيط."""
+    key = (header_fields, num_questions_val, bool(model_no), manifest["layout_hash"])
+    if key in template_cache:
+        template_cache[key] = template_cache.pop(key)  # الأحدث استخداماً في نهاية الترتيب
+        return template_cache[key]
+
+    title, course_name, course_code, course_level, term, exam_date, full_mark, exam_time, department, college_name, university_name = header_fields
+    sheet = create_blank_sheet(paper_size)
+    draw_registration_marks(sheet, paper_size)
+    info_y = draw_header(sheet, title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no, paper_size, stamp_model=False)
+    add_answer_bubbles(sheet, num_questions_val, choices=manifest["choices"], student_info_y=info_y, paper_size=paper_size)
+
+    sheet.flags.writeable = False  # القالب مشترك بين النماذج فلا يُعدل إلا عبر نسخة
+    template_cache[key] = sheet
+    while len(template_cache) > template_cache_size:
+        template_cache.pop(next(iter(template_cache)))
+    return sheet
+
+# ========== إخراج متجهي (SVG / PDF) ==========
+# نفس عناصر الورقة الخطية تُكتب كأشكال ونصوص بإحداثيات البكسل نفسها، فيبقى وصف التخطيط صالحاً للتصحيح.
+# حجم الخط يطابق ارتفاع الحروف الكبيرة في خط Hershey (21 بكسل عند المقياس 1) مع نسبة 0.718 لخط Helvetica، والخط العريض يقارب سُمك الخط 2 في OpenCV.
+vector_font_px = 29.3
+A4_WIDTH_PT = 595.276
+
+def sheet_to_svg(elements, paper_size=SHEET_PAPER_SIZE):
+    """كتابة عناصر الورقة كملف SVG بعرض صفحة A4."""
+    from html import escape
+    width, height = paper_size
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="210mm" height="{210 * height / width:.1f}mm" viewBox="0 0 {width} {height}">',
+             f'<rect width="{width}" height="{height}" fill="white"/>',
+             '<g font-family="Helvetica, Arial, sans-serif" font-weight="bold" stroke-width="2">']
+    for kind, *params in elements:
+        if kind == "text":
+            text, (x, y), font_scale = params
+            parts.append(f'<text x="{x}" y="{y}" font-size="{vector_font_px * font_scale:.1f}">{escape(text)}</text>')
+        elif kind == "bubble":
+            (cx, cy), radius, label, font_scale, filled = params
+            if filled:
+                parts.append(f'<circle cx="{cx}" cy="{cy}" r="{radius}"/>')
+                continue
+            parts.append(f'<circle cx="{cx}" cy="{cy}" r="{radius}" fill="none" stroke="black"/>')
+            text_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 2)[0]
+            parts.append(f'<text x="{cx - text_size[0] // 2}" y="{cy + text_size[1] // 2}" font-size="{vector_font_px * font_scale:.1f}">{escape(label)}</text>')
+        elif kind == "line":
+            (x1, y1), (x2, y2) = params
+            parts.append(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" stroke="black"/>')
+        elif kind == "rect":
+            (x1, y1), (x2, y2) = params
+            parts.append(f'<rect x="{x1}" y="{y1}" width="{x2 - x1 + 1}" height="{y2 - y1 + 1}"/>')
+    parts.append('</g></svg>')
+    return "\n".join(parts).encode("utf-8")
+
+def pdf_string(text):
+    # خط Helvetica المدمج في قارئات PDF لا يدعم إلا Latin-1، وما عداه يظهر "?" كما في الصورة النقطية
+    encoded = text.encode("latin-1", "replace").decode("latin-1")
+    return "(" + encoded.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+def pdf_circle(cx, cy, r):
+    # دائرة من أربعة منحنيات بيزيه
+    k = 0.5523 * r
+    return (f"{cx + r} {cy} m {cx + r} {cy + k:.2f} {cx + k:.2f} {cy + r} {cx} {cy + r} c "
+            f"{cx - k:.2f} {cy + r} {cx - r} {cy + k:.2f} {cx - r} {cy} c "
+            f"{cx - r} {cy - k:.2f} {cx - k:.2f} {cy - r} {cx} {cy - r} c "
+            f"{cx + k:.2f} {cy - r} {cx + r} {cy - k:.2f} {cx + r} {cy} c")
+
+def pdf_page_transform(paper_size=SHEET_PAPER_SIZE):
+    # قلب المحور الرأسي ليعمل المحتوى بإحداثيات البكسل نفسها (الأصل أعلى اليسار)
+    width, height = paper_size
+    scale = A4_WIDTH_PT / width
+    return f"{scale:.6f} 0 0 {-scale:.6f} 0 {height * scale:.3f} cm"
+
+def pdf_media_box(paper_size=SHEET_PAPER_SIZE):
+    width, height = paper_size
+    scale = A4_WIDTH_PT / width
+    return f"[0 0 {width * scale:.3f} {height * scale:.3f}]"
+
+def pdf_operators(elements):
+    """أوامر رسم عناصر الورقة بإحداثيات البكسل."""
+    ops = []
+    for kind, *params in elements:
+        if kind == "text":
+            text, (x, y), font_scale = params
+            ops.append(f"BT /F1 {vector_font_px * font_scale:.1f} Tf 1 0 0 -1 {x} {y} Tm {pdf_string(text)} Tj ET")
+        elif kind == "bubble":
+            (cx, cy), radius, label, font_scale, filled = params
+            ops.append(pdf_circle(cx, cy, radius) + (" f" if filled else " S"))
+            if not filled:
+                text_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 2)[0]
+                ops.append(f"BT /F1 {vector_font_px * font_scale:.1f} Tf 1 0 0 -1 {cx - text_size[0] // 2} {cy + text_size[1] // 2} Tm {pdf_string(label)} Tj ET")
+        elif kind == "line":
+            (x1, y1), (x2, y2) = params
+            ops.append(f"{x1} {y1} m {x2} {y2} l S")
+        elif kind == "rect":
+            (x1, y1), (x2, y2) = params
+            ops.append(f"{x1} {y1} {x2 - x1 + 1} {y2 - y1 + 1} re f")
+    return ops
+
+pdf_font = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>"
+
+def pdf_stream(ops, entries=""):
+    content = "\n".join(ops).encode("latin-1")
+    return f"<< {entries}/Length {len(content)} >>\nstream\n".encode("latin-1") + content + b"\nendstream"
+
+def sheet_to_pdf(elements, paper_size=SHEET_PAPER_SIZE):
+    """كتابة عناصر الورقة كصفحة PDF واحدة بعرض A4 دون مكتبات إضافية."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        f"<< /Type /Page /Parent 2 0 R /MediaBox {pdf_media_box(paper_size)} "
+        f"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>".encode("latin-1"),
+        pdf_font,
+        pdf_stream([pdf_page_transform(paper_size), "2 w"] + pdf_operators(elements)),
+    ]
+    return pdf_document(objects)
+
+def pdf_document(objects):
+    """تجميع كائنات PDF مرقمة من 1 بترتيبها مع جدول المواضع."""
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(pdf)
+
+vector_writers = {"svg": sheet_to_svg, "pdf": sheet_to_pdf}
+
+# ========== إخراج نقطي ==========
+# png: رمادي 8 بت بحواف ناعمة. png-bilevel وtiff-g4: بت واحد لكل بكسل لطباعة الدفعات الكبيرة.
+SHEET_DPI = 282.5  # عرض الورقة 2336 بكسل على عرض A4 البالغ 8.27 بوصة
+
+def bilevel(sheet):
+    return cv2.threshold(sheet, 127, 255, cv2.THRESH_BINARY)[1]
+
+def write_png(output_path, sheet):
+    cv2.imwrite(output_path, sheet)
+
+def write_bilevel_png(output_path, sheet):
+    cv2.imwrite(output_path, bilevel(sheet), [cv2.IMWRITE_PNG_BILEVEL, 1])
+
+def write_g4_tiff(output_path, sheet):
+    # ترميز CCITT Group 4 غير متاح في OpenCV، وPillow مثبتة أصلاً مع pdf2image
+    from PIL import Image
+    Image.fromarray(sheet >= 128).save(output_path, compression="group4", dpi=(SHEET_DPI, SHEET_DPI))
+
+raster_writers = {"png": write_png, "png-bilevel": write_bilevel_png, "tiff-g4": write_g4_tiff}
+sheet_extensions = {"png": "png", "png-bilevel": "png", "tiff-g4": "tif", "svg": "svg", "pdf": "pdf"}
+SHEET_FORMATS = list(raster_writers) + list(vector_writers)
+
+def sheet_elements(title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no, manifest, paper_size=SHEET_PAPER_SIZE):
+    """عناصر ورقة نموذج كاملة كقائمة أشكال ونصوص للإخراج المتجهي."""
+    elements = []
+    draw_registration_marks(elements, paper_size)
+    info_y = draw_header(elements, title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no, paper_size)
+    add_answer_bubbles(elements, num_questions_val, choices=manifest["choices"], student_info_y=info_y, paper_size=paper_size)
+    return elements
+
+def render_bubble_sheet(title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no, output_format="png"):
+    """رسم ورقة نموذج واحد في الذاكرة وإرجاعها مع وصف تخطيطها.
+
+    الصيغة png تُرجع صورة numpy، وsvg وpdf تُرجعان محتوى الملف كبايتات.
+    """
+    paper_size = SHEET_PAPER_SIZE
+    manifest = build_layout_manifest(num_questions_val, choices=4, paper_size=paper_size)
+    if output_format in vector_writers:
+        elements = sheet_elements(title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no, manifest)
+        return vector_writers[output_format](elements, paper_size), manifest
+
+    header_fields = (title, course_name, course_code, course_level, term, exam_date, full_mark, exam_time, department, college_name, university_name)
+    sheet = sheet_template(header_fields, num_questions_val, model_no, manifest, paper_size).copy()
+    if model_no:
+        draw_model_bubbles(sheet, model_no, header_geometry(paper_size, with_model=True))
+    return sheet, manifest
+
+def sheet_output_path(output_dir, model_no, num_questions_val, output_format="png"):
+    return os.path.join(output_dir, f"bubble_sheet_model_{model_no}_{num_questions_val}_Q.{sheet_extensions[output_format]}")
 
 def generate_bubble_sheet(title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no, output_dir):
     """إنشاء ورقة بابل شيت كاملة."""
     os.makedirs(output_dir, exist_ok=True)
-    paper_size = (2336, 3308)
-    sheet = create_blank_sheet(paper_size)
-    info_y = draw_header(sheet, title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no, paper_size)
-    add_answer_bubbles(sheet, num_questions_val, choices=4, student_info_y=info_y, paper_size=paper_size)
-    output_path = os.path.join(output_dir, f"bubble_sheet_model_{model_no}_{num_questions_val}_Q.png")
+    sheet, manifest = render_bubble_sheet(title, course_name, course_code, course_level, term, num_questions_val, exam_date, full_mark, exam_time, department, college_name, university_name, model_no)
+    output_path = sheet_output_path(output_dir, model_no, num_questions_val)
     cv2.imwrite(output_path, sheet)
+    write_layout_manifest(manifest, output_dir)
     return output_path
 
+def write_sheet_image(output_path, sheet, output_format="png"):
+    """ترميز الورقة وحفظها، وتُستدعى في خيط منفصل لأن OpenCV يحرر قفل المفسر أثناء الترميز."""
+    started = time.perf_counter()
+    if isinstance(sheet, bytes):
+        with open(output_path, "wb") as f:
+            f.write(sheet)
+    else:
+        raster_writers[output_format](output_path, sheet)
+    return time.perf_counter() - started
+
+def generate_exam_sheets(models, output_dir, output_format="png", png_encoders=2, **sheet_args):
+    """إنشاء أوراق نماذج امتحان واحد؛ ترميز PNG لكل ورقة يجري بينما تُرسم الورقة التالية.
+
+    تُرجع سجلاً لكل ورقة فيه المسار وزمن الرسم وزمن الترميز.
+    """
+    if isinstance(models, str):
+        models = models.split(',')
+    os.makedirs(output_dir, exist_ok=True)
+
+    pending = []
+    with ThreadPoolExecutor(max_workers=png_encoders) as encoder:
+        for model in models:
+            model_no = model.strip()
+            started = time.perf_counter()
+            sheet, manifest = render_bubble_sheet(model_no=model_no, output_format=output_format, **sheet_args)
+            render_seconds = time.perf_counter() - started
+            output_path = sheet_output_path(output_dir, model_no, sheet_args["num_questions_val"], output_format)
+            pending.append((model_no, output_path, render_seconds, encoder.submit(write_sheet_image, output_path, sheet, output_format)))
+        if pending:
+            write_layout_manifest(manifest, output_dir)
+
+        return [{"model": model_no, "path": output_path, "render_seconds": round(render_seconds, 3),
+                 "encode_seconds": round(encoding.result(), 3)}
+                for model_no, output_path, render_seconds, encoding in pending]
+
+def generate_bubble_sheets(models, **sheet_args):
+    """إنشاء ورقة لكل نموذج من النماذج المطلوبة."""
+    return [sheet["path"] for sheet in generate_exam_sheets(models, **sheet_args)]
+
+# ========== إنشاء دفعة امتحانات ==========
+# ملف الدفعة قائمة JSON بامتحانات، لكل امتحان نفس خيارات سطر الأوامر:
+#   [{"title": ..., "course_name": ..., "num_questions": 48, "models": "A,B", "output_dir": ..., ...}, ...]
+
+def load_batch_manifest(batch_path):
+    """قراءة ملف الدفعة وتحويل كل امتحان إلى معاملات generate_exam_sheets."""
+    with open(batch_path, encoding="utf-8") as f:
+        exams = json.load(f)
+    return [exam_sheet_args(exam) for exam in exams]
+
+def exam_sheet_args(exam):
+    args = dict(exam)
+    if "num_questions" in args:
+        args["num_questions_val"] = int(args.pop("num_questions"))
+    if "format" in args:
+        args["output_format"] = args.pop("format")
+    return args
+
+def run_exam(exam):
+    return generate_exam_sheets(**exam)
+
+def generate_batch(exams, workers=1):
+    """إنشاء أوراق عدة امتحانات، كل امتحان في عملية مستقلة حتى يُرسم قالبه مرة واحدة داخلها."""
+    workers = (os.cpu_count() or 1) if workers <= 0 else workers
+    started = time.perf_counter()
+    if workers == 1 or len(exams) <= 1:
+        results = [run_exam(exam) for exam in exams]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(exams))) as pool:
+            results = list(pool.map(run_exam, exams))
+
+    sheets = [sheet for exam_sheets in results for sheet in exam_sheets]
+    for sheet in sheets:
+        print(f"{sheet['path']}: render {sheet['render_seconds']:.3f}s, write {sheet['encode_seconds']:.3f}s")
+    print(f"Generated {len(sheets)} sheets for {len(exams)} exams in {time.perf_counter() - started:.2f}s")
+    return sheets
+
+# ========== أوراق مخصصة من قائمة الطلاب ==========
+# ملف القائمة CSV فيه عمود seat وأعمدة اختيارية name وroom وmodel:
+#   seat,name,room,model
+#   1001,Ahmed Ali,Hall 1,A
+# يُرسم قالب كل نموذج مرة واحدة، ثم تُطبع لكل طالب فقاعات أرقام جلوسه مظللة واسمه فقط، وتُكتب أوراق كل قاعة
+# في ملف واحد متعدد الصفحات: tiff-g4 (بت واحد لكل بكسل) أو pdf يُعرَّف فيه قالب النموذج مرة واحدة وتعيد كل صفحة استخدامه.
+# الطلاب بلا نموذج في القائمة توزع عليهم النماذج المطلوبة بالتناوب حسب ترتيبهم.
+ROSTER_FORMATS = ["tiff-g4", "pdf"]
+
+def read_roster(roster_path, num_seat_digits=4):
+    """قراءة قائمة الطلاب والتحقق من أن رقم الجلوس يطابق فقاعات الورقة."""
+    with open(roster_path, encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    students = []
+    for line, row in enumerate(rows, start=2):
+        row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+        seat = row.get("seat", row.get("seat_number", ""))
+        if not seat.isdigit() or len(seat) > num_seat_digits:
+            raise ValueError(f"{roster_path}, line {line}: seat number must have 1 to {num_seat_digits} digits, got {seat!r}")
+        students.append({"seat": seat.zfill(num_seat_digits), "name": row.get("name", ""),
+                         "room": row.get("room", ""), "model": row.get("model", "").upper()})
+    return students
+
+def assign_models(students, models):
+    models = [model.strip().upper() for model in models.split(",")] if isinstance(models, str) else list(models or [])
+    for index, student in enumerate(students):
+        if not student["model"]:
+            if not models:
+                raise ValueError(f"Seat {student['seat']} has no model and no --models were given")
+            student["model"] = models[index % len(models)]
+    return students
+
+def name_drawable(name, output_format):
+    """هل يرسم خط الصيغة الاسم كاملاً؟ خط Helvetica في PDF يغطي Latin-1 فقط، وخطوط Hershey في OpenCV 4
+    تغطي ASCII فقط (OpenCV 5 يرسم بخط Unicode)؛ وما لا يغطيه الخط يظهر "?"."""
+    if output_format == "pdf":
+        return name == name.encode("latin-1", "replace").decode("latin-1")
+    return name.isascii() or int(cv2.__version__.split(".")[0]) >= 5
+
+def draw_student(image, student, geometry):
+    """تظليل فقاعة كل رقم من أرقام الجلوس (الآحاد أولاً) وكتابة اسم الطالب."""
+    for digit_pos, row_centers in enumerate(geometry["seat_rows"]):
+        digit = int(student["seat"][-1 - digit_pos])
+        put_bubble(image, row_centers[digit], geometry["seat_radius"], str(digit), 0.8, filled=True)
+    if student["name"]:
+        put_text(image, student["name"], geometry["name_origin"], 0.9)
+
+def room_output_path(output_dir, room, num_questions_val, output_format):
+    label = re.sub(r"[^\w-]+", "_", room).strip("_") or "all"
+    return os.path.join(output_dir, f"roster_{label}_{num_questions_val}_Q.{sheet_extensions[output_format]}")
+
+def tiff_strips(image, rows_per_strip):
+    """ترميز صورة ثنائية بـ Group 4 وإرجاع شرائحها؛ كل شريحة تُرمَّز مستقلة فيمكن إعادة استخدامها في صفحات أخرى."""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="TIFF", compression="group4", strip_size=(image.shape[1] + 7) // 8 * rows_per_strip)
+    data = buffer.getvalue()
+    tags = Image.open(io.BytesIO(data)).tag_v2
+    return [data[offset:offset + count] for offset, count in zip(tags[273], tags[279])]
+
+def tiff_frame(width, height, rows_per_strip, strips):
+    """صفحة TIFF كاملة من شرائح مرمّزة مسبقًا: الترويسة ثم الـ IFD ثم بيانات الشرائح."""
+    from PIL import TiffImagePlugin
+    ifd = TiffImagePlugin.ImageFileDirectory_v2()
+    ifd[256], ifd[257], ifd[258], ifd[259], ifd[262], ifd[278] = width, height, 1, 4, 1, rows_per_strip
+    # إزاحات الشرائح نسبية هنا، وtobytes تضيف إليها نهاية الـ IFD
+    ifd[273] = tuple(np.cumsum([0] + [len(strip) for strip in strips[:-1]]).tolist())
+    ifd[279] = tuple(len(strip) for strip in strips)
+    ifd.tagtype[273] = ifd.tagtype[279] = 4
+    ifd[282], ifd[283], ifd[296] = SHEET_DPI, SHEET_DPI, 2
+    return b"II*\x00" + (8).to_bytes(4, "little") + ifd.tobytes(8) + b"".join(strips)
+
+def write_roster_tiff(output_path, students, sheet_args):
+    """صفحات القاعة كملف TIFF متعدد الصفحات يُكتب صفحةً صفحة.
+
+    شرائح قالب كل نموذج تُرمَّز مرة واحدة، ولكل طالب تُرمَّز فقط الشريحة العليا التي
+    تحمل اسمه ورقم جلوسه، فلا تبقى في الذاكرة إلا صفحة واحدة مهما كبرت القاعة.
+    """
+    from PIL import TiffImagePlugin
+    geometry = header_geometry(SHEET_PAPER_SIZE, with_model=True)
+    # الشريحة العليا تغطي الاسم وفقاعات رقم الجلوس
+    band_rows = -(-(geometry["seat_rows"][-1][0][1] + geometry["seat_radius"] + 16) // 64) * 64
+    bases, templates = {}, {}
+    for model in dict.fromkeys(student["model"] for student in students):
+        sheet = render_bubble_sheet(model_no=model, **sheet_args)[0]
+        bases[model] = sheet[:band_rows].copy()
+        templates[model] = tiff_strips(sheet >= 128, band_rows)[1:]
+    height, width = sheet.shape
+    band = np.empty_like(bases[model])
+    with TiffImagePlugin.AppendingTiffWriter(output_path, True) as tf:
+        for student in students:
+            np.copyto(band, bases[student["model"]])
+            draw_student(band, student, geometry)
+            tf.write(tiff_frame(width, height, band_rows, tiff_strips(band >= 128, band_rows) + templates[student["model"]]))
+            tf.newFrame()
+
+def write_roster_pdf(output_path, students, sheet_args):
+    """صفحات القاعة كملف PDF؛ قالب كل نموذج كائن Form واحد ترسمه كل صفحة ثم تضيف بيانات الطالب."""
+    geometry = header_geometry(SHEET_PAPER_SIZE, with_model=True)
+    manifest = build_layout_manifest(sheet_args["num_questions_val"], choices=4)
+    models = list(dict.fromkeys(student["model"] for student in students))
+    # 1 الفهرس، 2 شجرة الصفحات، 3 الخط، ثم قالب لكل نموذج، ثم صفحة ومحتواها لكل طالب
+    first_page = 4 + len(models)
+    width, height = SHEET_PAPER_SIZE
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{first_page + 2 * i} 0 R' for i in range(len(students)))}] "
+        f"/Count {len(students)} >>".encode("latin-1"),
+        pdf_font,
+    ]
+    for model in models:
+        elements = sheet_elements(model_no=model, manifest=manifest, **sheet_args)
+        objects.append(pdf_stream(["2 w"] + pdf_operators(elements),
+                                  f"/Type /XObject /Subtype /Form /BBox [0 0 {width} {height}] /Resources << /Font << /F1 3 0 R >> >> "))
+    templates = " ".join(f"/M{i} {4 + i} 0 R" for i in range(len(models)))
+    for index, student in enumerate(students):
+        stamps = []
+        draw_student(stamps, student, geometry)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox {pdf_media_box()} "
+                       f"/Resources << /Font << /F1 3 0 R >> /XObject << {templates} >> >> "
+                       f"/Contents {first_page + 2 * index + 1} 0 R >>".encode("latin-1"))
+        objects.append(pdf_stream([pdf_page_transform(), f"/M{models.index(student['model'])} Do", "2 w"] + pdf_operators(stamps)))
+    with open(output_path, "wb") as f:
+        f.write(pdf_document(objects))
+
+roster_writers = {"tiff-g4": write_roster_tiff, "pdf": write_roster_pdf}
+
+def run_room(task):
+    room, students, output_path, output_format, sheet_args = task
+    started = time.perf_counter()
+    roster_writers[output_format](output_path, students, sheet_args)
+    return {"room": room, "path": output_path, "sheets": len(students), "seconds": round(time.perf_counter() - started, 3)}
+
+def generate_roster(roster_path, models, output_dir, output_format="tiff-g4", workers=1, **sheet_args):
+    """إنشاء أوراق مخصصة لكل طلاب القائمة، ملف واحد لكل قاعة، والقاعات موزعة على العمليات."""
+    if output_format not in roster_writers:
+        raise ValueError(f"Roster sheets are written as {' or '.join(ROSTER_FORMATS)}, not {output_format}")
+    started = time.perf_counter()
+    students = assign_models(read_roster(roster_path), models)
+    model_count = len(header_geometry(SHEET_PAPER_SIZE)["model_centers"])
+    for student in students:
+        if len(student["model"]) != 1 or not 'A' <= student["model"] <= chr(ord('A') + model_count - 1):
+            raise ValueError(f"Seat {student['seat']}: unknown model {student['model']!r}")
+    undrawable = [student["seat"] for student in students if not name_drawable(student["name"], output_format)]
+    if undrawable:
+        print(f"Warning: {len(undrawable)} name(s) have characters {output_format} sheets cannot draw and will "
+              f"print as '?' (seats {', '.join(undrawable[:5])}{', ...' if len(undrawable) > 5 else ''})")
+
+    rooms = {}
+    for student in students:
+        rooms.setdefault(student["room"], []).append(student)
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(room, room_students, room_output_path(output_dir, room, sheet_args["num_questions_val"], output_format), output_format, sheet_args)
+             for room, room_students in rooms.items()]
+    workers = (os.cpu_count() or 1) if workers <= 0 else workers
+    if workers == 1 or len(tasks) <= 1:
+        results = [run_room(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(run_room, tasks))
+    write_layout_manifest(build_layout_manifest(sheet_args["num_questions_val"], choices=4), output_dir)
+
+    seconds = time.perf_counter() - started
+    for result in results:
+        print(f"{result['path']}: {result['sheets']} sheets in {result['seconds']:.2f}s")
+    print(f"Generated {len(students)} personalized sheets for {len(results)} rooms in {seconds:.2f}s "
+          f"({len(students) / seconds * 60:.0f} sheets/min)")
+    return results
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate bubble sheets for exams.")
-    parser.add_argument("--title", required=True, help="Exam title")
-    parser.add_argument("--course_name", required=True, help="Course name")
-    parser.add_argument("--course_code", required=True, help="Course code")
-    parser.add_argument("--course_level", required=True, help="Course level")
-    parser.add_argument("--term", required=True, help="Term (e.g., First Term)")
-    parser.add_argument("--num_questions", type=int, required=True, help="Number of questions")
-    parser.add_argument("--exam_date", required=True, help="Exam date (e.g., DD/MM/YYYY)")
-    parser.add_argument("--full_mark", required=True, help="Full mark")
-    parser.add_argument("--exam_time", required=True, help="Exam duration (e.g., 3 Hours)")
-    parser.add_argument("--department", required=True, help="Department")
-    parser.add_argument("--college_name", required=True, help="College name")
-    parser.add_argument("--university_name", required=True, help="University name")
-    parser.add_argument("--models", required=True, help="Comma-separated list of model IDs (e.g., A,B,C)")
-    parser.add_argument("--output_dir", required=True, help="Output directory for bubble sheets")
+    parser.add_argument("--title", help="Exam title")
+    parser.add_argument("--course_name", help="Course name")
+    parser.add_argument("--course_code", help="Course code")
+    parser.add_argument("--course_level", help="Course level")
+    parser.add_argument("--term", help="Term (e.g., First Term)")
+    parser.add_argument("--num_questions", type=int, help="Number of questions")
+    parser.add_argument("--exam_date", help="Exam date (e.g., DD/MM/YYYY)")
+    parser.add_argument("--full_mark", help="Full mark")
+    parser.add_argument("--exam_time", help="Exam duration (e.g., 3 Hours)")
+    parser.add_argument("--department", help="Department")
+    parser.add_argument("--college_name", help="College name")
+    parser.add_argument("--university_name", help="University name")
+    parser.add_argument("--models", help="Comma-separated list of model IDs (e.g., A,B,C)")
+    parser.add_argument("--output_dir", help="Output directory for bubble sheets")
+    parser.add_argument("--format", choices=SHEET_FORMATS, default="png", help="png (8-bit gray), png-bilevel / tiff-g4 (1-bit, for bulk printing), or svg/pdf vector sheets with the same geometry")
+    parser.add_argument("--batch", help="JSON file listing many exams (each with the options above) to generate in one run")
+    parser.add_argument("--roster", help="CSV of students (seat, and optionally name, room, model) to print pre-filled sheets for, one multi-page file per room (--format tiff-g4 or pdf)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for --batch and --roster (0 = all CPU cores)")
     args = parser.parse_args()
 
-    models_to_generate = args.models.split(',')
-    for model in models_to_generate:
-        output_path = generate_bubble_sheet(
-            title=args.title,
-            course_name=args.course_name,
-            course_code=args.course_code,
-            course_level=args.course_level,
-            term=args.term,
-            num_questions_val=args.num_questions,
-            exam_date=args.exam_date,
-            full_mark=args.full_mark,
-            exam_time=args.exam_time,
-            department=args.department,
-            college_name=args.college_name,
-            university_name=args.university_name,
-            model_no=model.strip(),
-            output_dir=args.output_dir
-        )
\ No newline at end of file
+    if args.batch:
+        exams = load_batch_manifest(args.batch)
+        for exam in exams:
+            exam.setdefault("output_format", args.format)
+        generate_batch(exams, args.workers)
+    else:
+        sheet_options = ["title", "course_name", "course_code", "course_level", "term", "num_questions", "exam_date",
+                         "full_mark", "exam_time", "department", "college_name", "university_name", "models", "output_dir"]
+        # مع --roster يكفي عمود model في القائمة عن --models
+        required = [name for name in sheet_options if not (args.roster and name == "models")]
+        missing = [f"--{name}" for name in required if getattr(args, name) is None]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+
+        if args.roster:
+            if args.format not in ROSTER_FORMATS:
+                parser.error(f"--roster writes multi-page files: use --format {' or --format '.join(ROSTER_FORMATS)}")
+            exam = exam_sheet_args({name: getattr(args, name) for name in sheet_options})
+            # أخطاء القائمة (رقم جلوس غير صالح، طالب بلا نموذج، نموذج غير معروف) تُعرض كخطأ استخدام لا كتتبع
+            try:
+                generate_roster(args.roster, exam.pop("models"), exam.pop("output_dir"), args.format, args.workers, **exam)
+            except ValueError as e:
+                parser.error(str(e))
+        else:
+            generate_batch([exam_sheet_args({name: getattr(args, name) for name in sheet_options + ["format"]})])
@@ -1,591 +1,1777 @@
-﻿import cv2
+﻿import time
+from contextlib import contextmanager
+startup_started = time.perf_counter()
+import cv2
 import numpy as np
 import pandas as pd
 import os
+import json
 import argparse
-from pdf2image import convert_from_path
+import hashlib
+import io
+import csv
+import sys
 import tempfile
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, Color, Alignment, PatternFill, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.drawing.image import Image
-import matplotlib.pyplot as plt
-from scipy.stats import norm
-
-# ========== Part 1: Extract All Correct Answers from Excel ==========
+from concurrent.futures import ProcessPoolExecutor
+
+# ========== Import Timing ==========
+# pdf2image, openpyxl, matplotlib and pyarrow are imported by the stage that needs them,
+# so a mode only pays for the libraries it uses. The first (cold) cost of each group is recorded.
+import_times = {"core": time.perf_counter() - startup_started}
+
+@contextmanager
+def import_timer(group):
+    started = time.perf_counter()
+    yield
+    import_times.setdefault(group, time.perf_counter() - started)
+
+def report_import_times(mode):
+    print(f"Import times ({mode}): " + ", ".join(f"{group} {seconds:.3f}s" for group, seconds in import_times.items()))
+
+# ========== Stage Metrics ==========
+# Every reading carries the timings of its own page stages ("metrics"), so they survive worker
+# pools and checkpoints; whole-run stages (key, grading, workbook, each chart) add up in
+# run_metrics. grade_exam reports both, and --metrics writes them out as JSON.
+run_metrics = {}
+
+@contextmanager
+def stage_timer(timings, stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+def current_rss_mb():
+    # Resident memory of this process where the OS reports it cheaply (Linux), else None
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_mb(children=False):
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+            return None if children else round(psutil.Process().memory_info().peak_wset / 2 ** 20, 1)
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+def page_metrics(timings):
+    metrics = {f"{stage}_ms": round(seconds * 1000, 2) for stage, seconds in timings.items()}
+    metrics.update(rss_mb=current_rss_mb(), pid=os.getpid())
+    return metrics
+
+def metrics_report(page_records, wall_seconds):
+    # Run totals plus p50/p90/max of every page stage, and the per-page records themselves
+    stages = sorted({key for record in page_records for key in record if key.endswith("_ms")})
+    page_stages = {}
+    for stage in stages:
+        values = np.array([record[stage] for record in page_records if stage in record])
+        page_stages[stage] = {"p50": round(float(np.percentile(values, 50)), 2),
+                              "p90": round(float(np.percentile(values, 90)), 2),
+                              "max": round(float(values.max()), 2)}
+    run = {
+        "wall_ms": round(wall_seconds * 1000, 2),
+        "pages": len(page_records),
+        # Reading throughput: the pages read this run over the time spent reading them
+        "pages_per_second": round(len(page_records) / run_metrics["read"], 2) if run_metrics.get("read") else None,
+        "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in run_metrics.items()},
+        "page_stages_ms": page_stages,
+        "peak_rss_mb": peak_rss_mb(),
+        "workers_peak_rss_mb": peak_rss_mb(children=True),
+    }
+    return {"run": run, "pages": page_records}
+
+def run_profiled(profile_path, func, *args, **kwargs):
+    # Runs func under cProfile and dumps the stats (readable with pstats or snakeviz); only this
+    # process is profiled, so pool workers show up as time spent waiting on them
+    if not profile_path:
+        return func(*args, **kwargs)
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+        print(f"Profile saved to: {profile_path}")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+# ========== Answer Keys ==========
+# A model's key is compiled into one string array indexed by question number:
+# key[q] is the correct choice of question q, "" where the key has no such question
+# (index 0 is never used). Keys are read from the 'Exam Details' sheet, or from
+# CSV (model,question,answer rows) or JSON ({"Model 1": {"Question 1": "A", ...}}
+# or {"Model 1": ["A", "B", ...]}) to skip the Excel read entirely.
+def compile_model_key(questions, answers):
+    # questions: labels such as "Question 7" (or plain numbers); answers: letters or 1-based choice numbers
+    numbers = pd.to_numeric(pd.Series(questions, dtype=object).astype(str).str.extract(r"(\d+)", expand=False),
+                            errors="coerce")
+    answers = pd.Series(answers, dtype=object)
+    choice_numbers = pd.to_numeric(answers, errors="coerce").to_numpy()
+    letters = np.char.upper(np.char.strip(answers.astype(str).to_numpy(dtype=str)))
+    numeric = ~np.isnan(choice_numbers)
+    # 1 -> "A", 2 -> "B", ...: the code points viewed as one-character strings
+    numbered = (np.where(numeric, choice_numbers, 0).astype(np.uint32) + 64).view("<U1")
+    letters = np.where(numeric, numbered, letters)
+
+    valid = numbers.notna().to_numpy()
+    numbers = numbers[valid].astype(int).to_numpy()
+    key = np.full(numbers.max() + 1 if len(numbers) else 1, "", dtype=letters.dtype if len(letters) else "<U1")
+    key[numbers] = letters[valid]
+    return key
+
 def extract_all_correct_answers(file_path):
     try:
-        df = pd.read_excel(file_path, sheet_name='Exam Details', header=None)
+        df = pd.read_excel(file_path, sheet_name='Exam Details', header=None, dtype=object)
         exam_models = {}
 
-        for model_start_col in range(0, 16, 3):
-            model_name = df.iloc[2, model_start_col]
-            if pd.isna(model_name):
+        # Every named cell of row 3 starts a model block: questions below it, answers one column right
+        header = df.iloc[2] if len(df) > 2 else pd.Series(dtype=object)
+        for model_start_col in np.flatnonzero(header.notna().to_numpy()):
+            if model_start_col + 1 >= df.shape[1]:
                 continue
+            block = df.iloc[3:, [model_start_col, model_start_col + 1]]
+            questions, answers = block.iloc[:, 0], block.iloc[:, 1]
+            keep = questions.notna() & answers.notna() & (questions != 'Questions') & (answers != 'Correct Answer')
+            # A header cell can be a number; model names are always strings (see Answer Key Cache)
+            exam_models[str(header.iloc[model_start_col])] = compile_model_key(questions[keep], answers[keep])
 
-            questions = []
-            answers = []
-            for i in range(3, len(df)):
-                question = df.iloc[i, model_start_col]
-                answer = df.iloc[i, model_start_col + 1]
-
-                if pd.isna(question) or question == 'Questions' or pd.isna(answer) or answer == 'Correct Answer':
-                    continue
-
-                questions.append(question)
-                try:
-                    if isinstance(answer, (int, float)):
-                        answers.append(chr(64 + int(answer)))
-                    else:
-                        answers.append(str(answer).upper())
-                except:
-                    answers.append(str(answer).upper())
+        return exam_models
+    except Exception as e:
+        print(f"Error extracting correct answers: {e}")
+        return None
 
-            exam_models[model_name] = dict(zip(questions, answers))
+def read_csv_answer_key(file_path):
+    df = pd.read_csv(file_path, dtype=object).dropna()
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return {model: compile_model_key(rows["question"], rows["answer"])
+            for model, rows in df.groupby("model", sort=False)}
+
+def read_json_answer_key(file_path):
+    with open(file_path, encoding="utf-8") as f:
+        models = json.load(f)
+    exam_models = {}
+    for model, answers in models.items():
+        if isinstance(answers, dict):
+            exam_models[model] = compile_model_key(list(answers.keys()), list(answers.values()))
+        else:
+            exam_models[model] = compile_model_key(range(1, len(answers) + 1), answers)
+    return exam_models
 
-        return exam_models
+def read_answer_key(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    try:
+        if extension == ".csv":
+            return read_csv_answer_key(file_path)
+        if extension == ".json":
+            return read_json_answer_key(file_path)
     except Exception as e:
         print(f"Error extracting correct answers: {e}")
         return None
+    return extract_all_correct_answers(file_path)
+
+# ========== Bubble Scoring Engine ==========
+# All bubble windows of a page live in one flat index (centers + half-sizes),
+# so a page is scored with a single integral image and one vectorized gather
+# instead of one slice + np.sum per bubble.
+choices = ['A', 'B', 'C', 'D', 'E', 'F']
+multiple_mark = '*'
+
+def build_roi_index(seat_centers, model_centers, answer_centers, seat_r=20, model_r=20, answer_r=25):
+    groups = [("seat", seat_centers, seat_r), ("model", model_centers, model_r), ("answers", answer_centers, answer_r)]
+    xs, ys, rs, slices = [], [], [], {}
+    for name, centers, r in groups:
+        slices[name] = slice(len(xs), len(xs) + len(centers))
+        xs.extend(x for x, _ in centers)
+        ys.extend(y for _, y in centers)
+        rs.extend([r] * len(centers))
+    return {
+        "x": np.array(xs, dtype=np.intp),
+        "y": np.array(ys, dtype=np.intp),
+        "r": np.array(rs, dtype=np.intp),
+        "slices": slices,
+    }
 
-# ========== Seat and Model Extraction Logic ==========
-seat_cols = [1566, 1630, 1693, 1757, 1820, 1884, 1947, 2011, 2074, 2138]
-seat_rows = [510, 435, 360, 285] 
-seat_centers = [(x, y) for y in seat_rows for x in seat_cols]
-
-def extract_seat_number(thresh, centers):
-    digits = []
-    for i in range(4):
-        group = centers[i*10:(i+1)*10]
-        max_ratio = 0
-        selected_digit = '_'
-        for j, (x, y) in enumerate(group):
-            r = 20
-            if y - r < 0 or y + r >= thresh.shape[0] or x - r < 0 or x + r >= thresh.shape[1]:
-                continue
-            roi = thresh[y - r:y + r, x - r:x + r]
-            if roi.size == 0:
-                continue
-            black_pixels = np.sum(roi == 255)
-            ratio = black_pixels / roi.size
-            if ratio > max_ratio and ratio > 0.3:
-                max_ratio = ratio
-                selected_digit = str(j)
-        digits.append(selected_digit)
+def score_bubbles(binarized, index):
+    # Fill ratio and ink of every bubble window; windows touching the page edge score 0.
+    # binarized holds the page size and the binarized and gray crops around the bubbles (see
+    # binarize_regions); each crop gets its own integral images and scores the windows it was cut for.
+    # Ink is how much darker than the paper a window is on average (0 paper, 1 black).
+    h, w = binarized["shape"]
+    x, y, r = index["x"], index["y"], index["r"]
+    valid = (y - r >= 0) & (y + r < h) & (x - r >= 0) & (x + r < w)
+    ratios = np.zeros(len(x))
+    shade = np.zeros(len(x))
+    for members, left, top, crop, gray in binarized["crops"]:
+        integral = cv2.integral((crop == 255).view(np.uint8))
+        gray_integral = cv2.integral(gray, sdepth=cv2.CV_64F)
+        ch, cw = crop.shape
+        bx, by, br = x[members] - left, y[members] - top, r[members]
+        x0, x1 = np.clip(bx - br, 0, cw), np.clip(bx + br, 0, cw)
+        y0, y1 = np.clip(by - br, 0, ch), np.clip(by + br, 0, ch)
+        filled = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        total = gray_integral[y1, x1] - gray_integral[y0, x1] - gray_integral[y1, x0] + gray_integral[y0, x0]
+        ratios[members] = filled / (2 * br) ** 2
+        shade[members] = total / (2 * br) ** 2
+    ink = np.clip(1 - shade / max(binarized["paper"], 1), 0, 1)
+    ratios[~valid] = 0
+    ink[~valid] = 0
+    return ratios, ink
+
+def extract_seat_number(selected):
+    digits = [str(d) if d >= 0 else '_' for d in selected]
     return ''.join(digits) if any(d != '_' for d in digits) else '____'
 
-model_centers = [(1570 + i*63, 655) for i in range(10)]
+def extract_model_number(selected):
+    return str(selected + 1) if selected >= 0 else '_'
+
+def extract_answers(selected, flags):
+    # A question with more than one mark is read as multiple_mark and never matches the key
+    return [(q + 1, multiple_mark if flag == "multiple" else choices[c] if c >= 0 else '_')
+            for q, (c, flag) in enumerate(zip(selected, flags))]
+
+# ========== Bubble Decisions ==========
+# Every row of bubbles (a question, a seat digit, the model) is decided in two tiers. The fast tier
+# settles all rows at once from the window scores: a row is clear when each of its bubbles is
+# clearly empty or clearly filled (dense and dark, like a pen or firm pencil mark) and at most one
+# is filled. Only the other rows - near-threshold fills, faint, partial or erased marks, several
+# marks - are measured again on the page pixels, inside a circular mask that leaves out the printed
+# outline, against a threshold set from the paper around each bubble, with the page's own clearly
+# empty bubbles as the zero point. Each decision carries a flag:
+#   "clear"     settled by the fast tier
+#   "checked"   ambiguous at first, settled by the detailed analysis
+#   "review"    read as the strongest mark but worth a look (faint or partial mark, likely erasure)
+#   "multiple"  more than one bubble marked
+fill_empty = 0.4      # window fill at or below which a bubble is clearly empty (outline and label ~0.3)
+# ... at 300 DPI: the outline and anti-aliasing keep their pixel width as the page shrinks, so their
+# share of the window grows by about this much per halving of the resolution
+outline_fill_step = 0.1
+ink_empty = 0.26      # ink above which a bubble is never clearly empty (paper ~0.2 at any resolution)
+fill_marked = 0.75    # window fill and ink at or above which a bubble is clearly filled
+ink_marked = 0.6
+mask_ink_step = 0.25  # pixels this much darker than the surrounding paper count as ink
+mask_marked = 0.45    # share of the mask inked (above an empty bubble's) for a mark
+mask_partial = 0.2    # ... and for a partial mark
+erasure_contrast = 1.6  # a mark this much darker than the others makes them look like erasures
+faint_darkness = 0.65   # a mark paler than this (mean darkness in the mask; firm marks ~0.8+) is faint
+erasure_residue = 0.035  # an unmarked bubble this much darker than the empty ones holds an erasure
+blank_samples = 16
+
+# Lowest recognition resolution accepted; the synthetic benchmark still reads every sheet a little
+# below it, while the empty level approaches fill_marked
+MIN_DPI = 100
+
+def empty_fill_level(page_width):
+    # fill_empty at the page's effective resolution (A4 width, as in preprocess_page)
+    dpi = RASTER_DPI * page_width / reference_page_width
+    return fill_empty + outline_fill_step * max(RASTER_DPI / dpi - 1, 0)
+
+def measure_masked(page, index, bubbles):
+    # Inked share and mean darkness inside a circular mask of each bubble's window radius,
+    # thresholded against the paper level around that bubble; the bubbles share one radius
+    r = int(index["r"][bubbles[0]])
+    margin = r // 2
+    offsets = np.arange(-r - margin, r + margin)
+    ys = np.clip(index["y"][bubbles][:, None] + offsets, 0, page.shape[0] - 1)
+    xs = np.clip(index["x"][bubbles][:, None] + offsets, 0, page.shape[1] - 1)
+    patches = page[ys[:, :, None], xs[:, None, :]].astype(np.float32)
+    paper = np.maximum(np.percentile(patches.reshape(len(bubbles), -1), 90, axis=1), 1)[:, None]
+    mask = offsets[:, None] ** 2 + offsets[None, :] ** 2 <= r * r
+    inside = patches[:, mask]
+    coverage = (inside < paper * (1 - mask_ink_step)).mean(axis=1)
+    darkness = np.clip(1 - inside / paper, 0, 1).mean(axis=1)
+    return coverage, darkness
+
+def decide_rows(binarized, index, fill, ink, group, width):
+    # Selected bubble of every row of a group (-1 for none; the darkest mark when there are
+    # several) and the flag of each decision
+    group_slice = index["slices"][group]
+    fill = fill[group_slice].reshape(-1, width)
+    ink = ink[group_slice].reshape(-1, width)
+    filled = (fill >= fill_marked) & (ink >= ink_marked)
+    empty = (fill <= empty_fill_level(binarized["shape"][1])) & (ink <= ink_empty)
+    clear = (filled | empty).all(axis=1) & (filled.sum(axis=1) <= 1)
+    selected = np.where(filled.any(axis=1), filled.argmax(axis=1), -1)
+    flags = np.full(len(fill), "clear", dtype=object)
+    rows = np.flatnonzero(~clear)
+    if not len(rows):
+        return selected, flags
+
+    bubbles = group_slice.start + (rows[:, None] * width + np.arange(width)).ravel()
+    blanks = group_slice.start + np.flatnonzero((empty & clear[:, None]).ravel())[:blank_samples]
+    coverage, darkness = measure_masked(binarized["page"], index, np.concatenate([bubbles, blanks]))
+    base = float(np.median(coverage[len(bubbles):])) if len(blanks) else 0.0
+    excess = ((coverage[:len(bubbles)] - base) / max(1 - base, 0.05)).reshape(len(rows), width)
+    blank_darkness = float(np.median(darkness[len(bubbles):])) if len(blanks) else None
+    darkness = darkness[:len(bubbles)].reshape(len(rows), width)
+    for row, row_excess, row_darkness in zip(rows, excess, darkness):
+        marked = np.flatnonzero(row_excess >= mask_marked)
+        partial = np.flatnonzero((row_excess >= mask_partial) & (row_excess < mask_marked))
+        if len(marked) > 1:
+            order = marked[np.argsort(-row_darkness[marked], kind="stable")]
+            selected[row] = order[0]
+            erased = row_darkness[order[0]] >= erasure_contrast * row_darkness[order[1]]
+            flags[row] = "review" if erased else "multiple"
+        elif len(marked) or len(partial):
+            candidates = marked if len(marked) else partial
+            selected[row] = candidates[np.argmax(row_excess[candidates])]
+            # Without clearly empty bubbles on the page, the row's palest bubble is the empty level
+            empty_level = row_darkness.min() if blank_darkness is None else blank_darkness
+            residue = (np.delete(row_darkness, selected[row]) >= empty_level + erasure_residue).any()
+            faint = row_darkness[selected[row]] < faint_darkness
+            flags[row] = "review" if len(partial) or faint or residue else "checked"
+        else:
+            selected[row] = -1
+            flags[row] = "checked"
+    return selected, flags
+
+# ========== Sheet Layout ==========
+# Bubble positions come from the geometry manifest written by Bubble.generate_bubble_sheet
+# (in sheet pixels). A manifest is compiled once into flat sheet-space arrays; each page
+# then only maps them through its sheet-to-page transform (see Page Registration).
+
+# Placement of the generated sheet on a 300 DPI A4 scan of ExamFilesGenerator's Word page,
+# fitted to the reference scans the original hardcoded coordinates were measured on
+RASTER_DPI = 300
+reference_page_width = 2480
+sheet_to_scan_scale = (1.058, 1.059)
+sheet_to_scan_offset = (48.5, 77.1)
+# Half-size of the square window scored around each bubble, as a fraction of its radius
+roi_radius_fraction = 0.8
+
+layout_cache = {}
+
+def compile_layout(manifest):
+    # Most significant seat digit first, matching how seat numbers are read
+    seat = manifest["seat"]
+    seat_rows = [row for _, row in sorted(zip(seat["place_values"], seat["rows"]), reverse=True)]
+    layout = build_roi_index(
+        [c for row in seat_rows for c in row],
+        manifest["model"]["centers"],
+        [c for question in manifest["answers"]["questions"] for c in question],
+        seat_r=seat["radius"],
+        model_r=manifest["model"]["radius"],
+        answer_r=manifest["answers"]["radius"],
+    )
+    marks = manifest.get("marks")
+    layout["marks"] = np.array(marks["centers"], dtype=np.float64) if marks else None
+    layout["mark_size"] = marks["size"] if marks else 0
+    layout["layout_hash"] = manifest["layout_hash"]
+    layout["seat_digits"] = len(seat_rows)
+    layout["choices"] = manifest["choices"]
+    layout["placements"] = {}
+    return layout
+
+def load_layout(layout_path=None, num_questions=48):
+    # A saved manifest wins; otherwise the layout Bubble.py draws for this question count is used
+    cache_key = layout_path or f"{num_questions}Q"
+    if cache_key not in layout_cache:
+        if layout_path:
+            with open(layout_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        else:
+            from Bubble import build_layout_manifest
+            manifest = build_layout_manifest(num_questions)
+        from Bubble import LAYOUT_VERSION
+        if manifest.get("version") != LAYOUT_VERSION:
+            raise ValueError(f"Unsupported layout manifest version: {manifest.get('version')}")
+        layout = next((l for l in layout_cache.values() if l["layout_hash"] == manifest["layout_hash"]), None)
+        layout_cache[cache_key] = layout or compile_layout(manifest)
+    return layout_cache[cache_key]
+
+def nominal_transform(page_width):
+    # Sheet-to-page transform for an unregistered page, scaled to the page's resolution
+    k = page_width / reference_page_width
+    (sx, sy), (ox, oy) = sheet_to_scan_scale, sheet_to_scan_offset
+    return np.array([[sx * k, 0, ox * k], [0, sy * k, oy * k]])
+
+def place_layout(layout, transform):
+    # ROI index of the layout on one page: bubble centers mapped through the 2x3 transform,
+    # window half-sizes scaled with it
+    points = transform @ np.vstack([layout["x"], layout["y"], np.ones(len(layout["x"]))])
+    scale = np.sqrt(abs(np.linalg.det(transform[:, :2])))
+    return {
+        "x": np.rint(points[0]).astype(np.intp),
+        "y": np.rint(points[1]).astype(np.intp),
+        "r": np.maximum(np.rint(layout["r"] * scale * roi_radius_fraction), 1).astype(np.intp),
+        "slices": layout["slices"],
+        "choices": layout["choices"],
+    }
 
-def extract_model_number(thresh, centers):
-    max_ratio = 0
-    selected_index = '_'
-    for i, (x, y) in enumerate(centers):
-        r = 20
-        if y - r < 0 or y + r >= thresh.shape[0] or x - r < 0 or x + r >= thresh.shape[1]:
+def place_layout_nominal(layout, page_width):
+    if page_width not in layout["placements"]:
+        layout["placements"][page_width] = place_layout(layout, nominal_transform(page_width))
+    return layout["placements"][page_width]
+
+# ========== Page Registration ==========
+# The corner marks drawn by Bubble.py are located on a downscaled copy of the page and an
+# affine sheet-to-page transform is fitted to them, so scanner shift, skew and any
+# rasterization DPI are absorbed before the bubble grid is read.
+registration_width = 620
+
+def find_registration_marks(gray, layout, transform):
+    f = min(1.0, registration_width / gray.shape[1])
+    small = cv2.resize(gray, None, fx=f, fy=f, interpolation=cv2.INTER_AREA) if f < 1 else gray
+    _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    side = layout["mark_size"] * np.sqrt(abs(np.linalg.det(transform[:, :2]))) * f
+    search = max(int(side * 3), 8)
+    expected = (transform @ np.vstack([layout["marks"].T, np.ones(len(layout["marks"]))])).T * f
+
+    found = []
+    for ex, ey in expected:
+        x0, y0 = max(int(ex) - search, 0), max(int(ey) - search, 0)
+        x1, y1 = min(int(ex) + search, binary.shape[1]), min(int(ey) + search, binary.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            found.append(None)
             continue
-        roi = thresh[y - r:y + r, x - r:x + r]
-        if roi.size == 0:
-            continue
-        black_pixels = np.sum(roi == 255)
-        ratio = black_pixels / roi.size
-        if ratio > max_ratio and ratio > 0.3:
-            max_ratio = ratio
-            selected_index = i
-    return str(selected_index + 1) if selected_index != '_' else '_'
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(binary[y0:y1, x0:x1])
+        best = None
+        for i in range(1, count):
+            w, h, area = stats[i, cv2.CC_STAT_WIDTH], stats[i, cv2.CC_STAT_HEIGHT], stats[i, cv2.CC_STAT_AREA]
+            # A solid, roughly square blob of about the expected size
+            if not (0.5 * side <= w <= 1.6 * side and 0.5 * side <= h <= 1.6 * side) or area < 0.6 * w * h:
+                continue
+            cx, cy = centroids[i][0] + x0, centroids[i][1] + y0
+            distance = np.hypot(cx - ex, cy - ey)
+            if best is None or distance < best[0]:
+                best = (distance, (cx / f, cy / f))
+        found.append(best[1] if best else None)
+    return found
+
+def register_page(gray, layout):
+    # Returns (transform, registered); falls back to the nominal placement when marks are missing
+    nominal = nominal_transform(gray.shape[1])
+    if layout["marks"] is None:
+        return nominal, False
+
+    found = find_registration_marks(gray, layout, nominal)
+    matched = [(mark, point) for mark, point in zip(layout["marks"], found) if point is not None]
+    if len(matched) < 3:
+        return nominal, False
+
+    sheet_points = np.array([m for m, _ in matched])
+    page_points = np.array([p for _, p in matched])
+    A = np.hstack([sheet_points, np.ones((len(matched), 1))])
+    transform = np.linalg.lstsq(A, page_points, rcond=None)[0].T
+
+    # Reject fits that are far from a plausible placement (wrong blob picked up as a mark)
+    residual = np.abs(A @ transform.T - page_points).max()
+    linear_ratio = transform[:, :2] / np.diag(nominal[:, :2]).reshape(1, 2)
+    if residual > layout["mark_size"] or np.abs(np.diag(linear_ratio) - 1).max() > 0.15 \
+            or np.abs(linear_ratio[[0, 1], [1, 0]]).max() > 0.1:
+        return nominal, False
+    return transform, True
+
+def count_key_questions(correct_answers):
+    numbers = [len(key) - 1 for key in correct_answers.values() if len(key) > 1]
+    return max(numbers) if numbers else 48
+
+# ========== Load Page Pixels ==========
+def load_gray_page(source):
+    # source may be a file path, the bytes of an encoded image, or page pixels
+    # (an ndarray or anything numpy can wrap, e.g. a grayscale PIL page); color arrays are BGR
+    if isinstance(source, (str, os.PathLike)):
+        img = cv2.imread(os.fspath(source))
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img is not None else None
+    if isinstance(source, (bytes, bytearray)) or (isinstance(source, memoryview) and source.ndim == 1):
+        return cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    pixels = np.asarray(source, dtype=np.uint8)
+    if pixels.ndim == 3 and pixels.shape[2] == 4:
+        return cv2.cvtColor(pixels, cv2.COLOR_BGRA2GRAY)
+    if pixels.ndim == 3:
+        return cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+    return pixels
 
 # ========== Extract Answers from Sheet ==========
-def extract_bubble_sheet(image_path):
-    img = cv2.imread(image_path)
-    if img is None:
-        print(f"Error: Could not load image {image_path}")
+def extract_bubble_sheet(source, layout=None, dpi=None):
+    if layout is None:
+        layout = load_layout()
+    timings = {}
+    with stage_timer(timings, "decode"):
+        gray = load_gray_page(source)
+    if gray is None:
+        label = source if isinstance(source, (str, os.PathLike)) else "in-memory page"
+        print(f"Error: Could not load image {label}")
         return None
-    
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    gray = cv2.equalizeHist(gray)
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    _, thresh = cv2.threshold(blurred, 80, 255, cv2.THRESH_BINARY_INV)
-
-    results = {}
-    results["seat_num"] = extract_seat_number(thresh, seat_centers)
-    results["model_no"] = extract_model_number(thresh, model_centers)
-
-    start_xs = [275, 423, 571, 719, 1389, 1537, 1685, 1833]
-    start_y = 1068
-    step_y = 90
-    num_rows = 24
-    choices = ['A', 'B', 'C', 'D']
-
-    centers = []
-    for col in range(0, len(start_xs), 4):
-        for row in range(num_rows):
-            y = start_y + row * step_y
-            for i in range(4):
-                x = start_xs[col + i]
-                centers.append((x, y))
-
-    results["answers"] = []
-    for i in range(len(centers) // 4):
-        q_number = i + 1
-        options = centers[i*4:(i+1)*4]
-        scores = []
-        for j, (x, y) in enumerate(options):
-            r = 25
-            if y - r < 0 or y + r >= thresh.shape[0] or x - r < 0 or x + r >= thresh.shape[1]:
-                scores.append((choices[j], 0, (x, y)))
-                continue
-            roi = thresh[y - r:y + r, x - r:x + r]
-            if roi.shape[0] == 0 or roi.shape[1] == 0:
-                scores.append((choices[j], 0, (x, y)))
-                continue
-            black_pixels = np.sum(roi == 255)
-            ratio = black_pixels / roi.size
-            scores.append((choices[j], ratio, (x, y)))
-        selected = max(scores, key=lambda x: x[1])
-        answer = selected[0] if selected[1] > 0.3 else '_'
-        results["answers"].append((q_number, answer))
 
+    thresh, roi_index, registered = preprocess_page(gray, layout, dpi, timings)
+    with stage_timer(timings, "score"):
+        results = read_bubbles(thresh, roi_index)
+    with stage_timer(timings, "fingerprint"):
+        results["fingerprint"] = answer_fingerprint(thresh["page"], roi_index)
+    results["registered"] = registered
+    results["metrics"] = page_metrics(timings)
     return results
 
-# ========== Generate Output ==========
-def generate_final_output(bubble_results, correct_answers):
-    model_no = bubble_results["model_no"]
-    model_key = f"Model {model_no}"
-    if model_key not in correct_answers:
-        print(f"Error: Model {model_no} not found in correct answers")
-        return None
+def preprocess_page(gray, layout, dpi=None, timings=None):
+    # Returns the binarized page, the bubble windows placed on it and whether registration succeeded
+    timings = {} if timings is None else timings
+    # Reduced-resolution mode: larger pages are brought down to the recognition DPI first
+    if dpi:
+        target_width = int(round(reference_page_width * dpi / 300))
+        if gray.shape[1] > target_width * 1.1:
+            with stage_timer(timings, "downscale"):
+                f = target_width / gray.shape[1]
+                gray = cv2.resize(gray, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+
+    with stage_timer(timings, "register"):
+        transform, registered = register_page(gray, layout)
+        roi_index = place_layout(layout, transform) if registered else place_layout_nominal(layout, gray.shape[1])
+
+    with stage_timer(timings, "binarize"):
+        binarized = binarize_regions(gray, bubble_regions(roi_index, gray.shape))
+    return binarized, roi_index, registered
+
+# ========== Crop-First Binarization ==========
+# Only the pixels under bubble windows are ever read, so equalization, blur and threshold run on
+# crops around the bubble grids instead of the whole page. The crops are padded by the blur radius
+# and equalized with the whole page's statistics, so every pixel a window reads matches what a
+# full-page equalizeHist -> GaussianBlur -> threshold pass gives (up to the histogram sampling).
+binarize_blur = 5
+binarize_threshold = 80
+
+def bubble_regions(index, page_shape):
+    # Crop boxes for each bubble group, split wherever the windows leave a vertical gap
+    # (answer columns, choice columns): [(member indices, (x0, y0, x1, y1)), ...]
+    h, w = page_shape
+    pad = binarize_blur // 2
+    x0, x1 = index["x"] - index["r"] - pad, index["x"] + index["r"] + pad + 1
+    y0, y1 = index["y"] - index["r"] - pad, index["y"] + index["r"] + pad + 1
+    regions = []
+    for group in index["slices"].values():
+        members = np.arange(group.start, group.stop)
+        if not len(members):
+            continue
+        members = members[np.argsort(x0[members], kind="stable")]
+        reach = np.maximum.accumulate(x1[members])
+        breaks = np.flatnonzero(x0[members][1:] > reach[:-1]) + 1
+        for part in np.split(members, breaks):
+            box = (max(int(x0[part].min()), 0), max(int(y0[part].min()), 0),
+                   min(int(x1[part].max()), w), min(int(y1[part].max()), h))
+            if box[0] < box[2] and box[1] < box[3]:
+                regions.append((part, box))
+    return regions
+
+def page_histogram(gray, stride=2):
+    # Histogram of every stride-th pixel of every stride-th row: the full-page histogram costs
+    # about as much as equalizing the page, a quarter of the pixels estimates it closely
+    sample = np.ascontiguousarray(gray[::stride, ::stride])
+    return cv2.calcHist([sample], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+
+def paper_level(hist):
+    # Median gray level of the page; a sheet is mostly blank paper
+    return int(np.searchsorted(np.cumsum(hist), hist.sum() / 2))
+
+def equalize_lut(hist):
+    # The lookup table cv2.equalizeHist would build for the page (same formula and rounding)
+    first = int(np.flatnonzero(hist)[0])
+    total = int(hist.sum())
+    if hist[first] == total:
+        return np.full(256, first, dtype=np.uint8)
+    scale = np.float32(255) / np.float32(total - hist[first])
+    lut = np.zeros(256, dtype=np.uint8)
+    sums = np.cumsum(hist[first + 1:])
+    lut[first + 1:] = np.clip(np.rint(sums.astype(np.float32) * scale), 0, 255)
+    return lut
+
+def binarize_regions(gray, regions):
+    # The gray crops and page stay along for the ink scores and the detailed bubble decisions
+    hist = page_histogram(gray)
+    lut = equalize_lut(hist)
+    crops = []
+    for members, (x0, y0, x1, y1) in regions:
+        patch = gray[y0:y1, x0:x1]
+        crop = cv2.LUT(patch, lut)
+        crop = cv2.GaussianBlur(crop, (binarize_blur, binarize_blur), 0)
+        _, crop = cv2.threshold(crop, binarize_threshold, 255, cv2.THRESH_BINARY_INV)
+        crops.append((members, x0, y0, crop, patch))
+    return {"shape": gray.shape[:2], "crops": crops, "page": gray, "paper": paper_level(hist)}
+
+def read_bubbles(binarized, roi_index):
+    fill, ink = score_bubbles(binarized, roi_index)
+    slices = roi_index["slices"]
+    model_count = slices["model"].stop - slices["model"].start
+    seat, seat_flags = decide_rows(binarized, roi_index, fill, ink, "seat", 10)
+    model, model_flags = decide_rows(binarized, roi_index, fill, ink, "model", model_count)
+    answers, answer_flags = decide_rows(binarized, roi_index, fill, ink, "answers", roi_index["choices"])
 
-    correct_answers_dict = correct_answers[model_key]
-    valid_questions = set(correct_answers_dict.keys())
-    filtered_answers = [(q, a) for q, a in bubble_results["answers"] if f"Question {q}" in valid_questions]
-    student_answers_str = ' '.join([a for q, a in filtered_answers])
+    results = {}
+    results["seat_num"] = extract_seat_number(seat)
+    results["model_no"] = extract_model_number(model[0])
+    results["answers"] = extract_answers(answers, answer_flags)
+    results["confidence"] = {"seat": list(seat_flags), "model": model_flags[0], "answers": list(answer_flags)}
+    return results
 
-    correct_answers_list = [correct_answers_dict.get(f"Question {q}", '_') for q, a in filtered_answers]
-    correct_answers_str = ' '.join(correct_answers_list)
+# ========== Cohort Scoring ==========
+# A cohort is graded in one pass over a students x questions uint8 response matrix:
+# 0 is a blank, 1.. the choices A.. (see choices), then multiple_code for several marks.
+# Answer keys are compiled into the same codes, one row per model, with 0 for questions the
+# key does not grade and 255 for answers no bubble can produce; a student is scored against
+# the key row of their model.
+multiple_code = len(choices) + 1
+choice_codes = np.zeros(256, dtype=np.uint8)
+choice_codes[[ord(c) for c in choices]] = np.arange(1, len(choices) + 1)
+choice_codes[ord(multiple_mark)] = multiple_code
+choice_letters = np.array(['_'] + choices + [multiple_mark])
+
+def response_matrix(sheets):
+    # Marks are one character each, so every sheet is one row of bytes mapped through choice_codes
+    counts = np.array([len(sheet["answers"]) for sheet in sheets], dtype=int)
+    width = int(counts.max()) if len(sheets) else 0
+    rows = "".join("".join(a for _, a in sheet["answers"]).ljust(width, "_") for sheet in sheets)
+    marks = np.frombuffer(rows.encode("ascii", "replace"), dtype=np.uint8).reshape(len(sheets), width)
+    return choice_codes[marks], counts
+
+def key_matrix(correct_answers, width):
+    models = list(correct_answers)
+    codes = np.zeros((len(models), width), dtype=np.uint8)
+    for row, model in enumerate(models):
+        key = correct_answers[model][1:width + 1]
+        single = np.char.str_len(key) == 1
+        letters = np.where(single, key, "_").astype("<U1").view(np.uint32)
+        row_codes = choice_codes[np.minimum(letters, 255)]
+        keyable = single & (row_codes > 0) & (row_codes < multiple_code)
+        codes[row, :len(key)] = np.where(key == "", 0, np.where(keyable, row_codes, 255))
+    return models, codes
+
+def compile_keys(correct_answers):
+    # The key matrices as wide as the longest key; a run compiles them once and passes them to
+    # every score_cohort call (see Streaming Results)
+    return key_matrix(correct_answers, max([len(key) - 1 for key in correct_answers.values()], default=0))
+
+def joined_marks(responses, mask):
+    # ' '.join of each row's masked marks, built as "X " byte pairs with the unmasked pairs zeroed out
+    pairs = np.zeros(responses.shape + (2,), dtype=np.uint8)
+    pairs[..., 0] = np.where(mask, choice_letters.view(np.uint32).astype(np.uint8)[responses], 0)
+    pairs[..., 1] = np.where(mask, ord(' '), 0)
+    return [row.tobytes().replace(b"\0", b"").decode("ascii").rstrip() for row in pairs]
+
+def score_cohort(sheets, correct_answers, compiled_keys=None):
+    # Returns the per-student outputs (sheets of unknown models are reported once per model and
+    # left out) and the cohort matrices that item_analysis works from; compiled_keys is
+    # compile_keys(correct_answers) when the caller already has it
+    model_rows = {model: row for row, model in enumerate(correct_answers)}
+    kept, unknown = [], {}
+    for sheet in sheets:
+        if f"Model {sheet['model_no']}" in model_rows:
+            kept.append(sheet)
+        else:
+            unknown[sheet["model_no"]] = unknown.get(sheet["model_no"], 0) + 1
+    for model_no, count in unknown.items():
+        print(f"Error: Model {model_no} not found in correct answers ({count} sheet(s) left out)")
+
+    responses, counts = response_matrix(kept)
+    models, keys = compiled_keys or compile_keys(correct_answers)
+    # Past the end of a key nothing is graded, so both matrices are padded with zeros
+    width = max(responses.shape[1], keys.shape[1])
+    responses = np.pad(responses, ((0, 0), (0, width - responses.shape[1])))
+    keys = np.pad(keys, ((0, 0), (0, width - keys.shape[1])))
+    student_models = np.array([model_rows[f"Model {sheet['model_no']}"] for sheet in kept], dtype=int)
+
+    student_keys = keys[student_models]
+    # Only questions that are both on the student's sheet and in their model's key are graded
+    graded = (student_keys != 0) & (np.arange(width) < counts[:, None])
+    correct = graded & (responses == student_keys)
+    grades = correct.sum(axis=1)
+    totals = graded.sum(axis=1)
+    scores = np.divide(grades * 100, totals, out=np.zeros(len(kept)), where=totals > 0)
+
+    marked_strings = joined_marks(responses, graded)
+    # Students of one model with the same sheet length share the same key string
+    key_strings = {}
+    all_outputs = []
+    for i, sheet in enumerate(kept):
+        model_key = (student_models[i], counts[i])
+        if model_key not in key_strings:
+            key = correct_answers[models[student_models[i]]]
+            key_strings[model_key] = ' '.join(key[np.flatnonzero(graded[i]) + 1])
+        all_outputs.append({
+            "Seat Number": sheet["seat_num"],
+            "Grade": int(grades[i]),
+            "Score (%)": f"{round(float(scores[i]), 2)}%",
+            "Model": sheet["model_no"],
+            "Total": int(totals[i]),
+            "Marked Answers": marked_strings[i],
+            "Correct Answers": key_strings[model_key],
+            "Review": review_notes(sheet.get("confidence")),
+        })
 
-    total_questions = len(filtered_answers)
-    correct_count = sum(1 for q, a in filtered_answers if correct_answers_dict.get(f"Question {q}", '_').upper() == a.upper())
+    cohort = {"models": models, "keys": keys, "student_models": student_models,
+              "responses": responses, "graded": graded, "correct": correct}
+    return all_outputs, cohort
+
+def review_notes(confidence):
+    # "Q5 multiple, Q9 review" for the bubble decisions a person should check (see Bubble Decisions)
+    if not confidence:
+        return ""
+    decisions = [(f"Seat digit {d + 1}", flag) for d, flag in enumerate(confidence["seat"])]
+    decisions.append(("Model", confidence["model"]))
+    decisions += [(f"Q{q + 1}", flag) for q, flag in enumerate(confidence["answers"])]
+    return ", ".join(f"{label} {flag}" for label, flag in decisions if flag in ("review", "multiple"))
+
+def item_analysis(cohort):
+    # Per model and question: difficulty (share answering correctly), point-biserial
+    # discrimination (correlation of the item with the rest of the score) and how often
+    # each choice was marked
+    num_codes = len(choice_letters)
+    # Choice columns run up to the highest choice anyone marked or keyed (at least A-D)
+    used = np.concatenate([cohort["responses"].ravel(), cohort["keys"][cohort["keys"] < num_codes]])
+    used = used[used < multiple_code]
+    shown_choices = max(4, int(used.max()) if len(used) else 0)
+    rows = []
+    for m, model in enumerate(cohort["models"]):
+        students = cohort["student_models"] == m
+        items = np.flatnonzero(cohort["keys"][m])
+        if not students.any() or not len(items):
+            continue
+        graded = cohort["graded"][students][:, items]
+        correct = cohort["correct"][students][:, items].astype(float)
+        responses = cohort["responses"][students][:, items]
+
+        answered = graded.sum(axis=0)
+        difficulty = np.divide(correct.sum(axis=0), answered, out=np.full(len(items), np.nan), where=answered > 0)
+        rest = correct.sum(axis=1, keepdims=True) - correct
+        item_dev = correct - correct.mean(axis=0)
+        rest_dev = rest - rest.mean(axis=0)
+        spread = np.sqrt((item_dev ** 2).sum(axis=0) * (rest_dev ** 2).sum(axis=0))
+        discrimination = np.divide((item_dev * rest_dev).sum(axis=0), spread,
+                                   out=np.full(len(items), np.nan), where=spread > 0)
+        # choice_counts[c, i]: students who marked code c on item i
+        choice_counts = np.stack([(responses == code).sum(axis=0) for code in range(num_codes)])
+        choice_share = choice_counts / students.sum()
+
+        key_codes = cohort["keys"][m][items]
+        for i, question in enumerate(items + 1):
+            row = {"Model": model, "Question": int(question),
+                   "Key": choice_letters[key_codes[i]] if key_codes[i] < num_codes else "?",
+                   "Students": int(answered[i]),
+                   "Difficulty": round(float(difficulty[i]), 3),
+                   "Discrimination": round(float(discrimination[i]), 3)}
+            row.update({choice_letters[code]: f"{choice_share[code, i] * 100:.1f}%"
+                        for code in range(1, shown_choices + 1)})
+            row["Blank"] = f"{choice_share[0, i] * 100:.1f}%"
+            row["Multiple"] = f"{choice_share[multiple_code, i] * 100:.1f}%"
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+# ========== PDF Rasterization ==========
+def pages_per_chunk(pdf_info, dpi=RASTER_DPI, max_memory_mb=512):
+    # Grayscale pages cost one byte per pixel; "Page size" is reported in points (1/72 inch)
+    try:
+        width_pt, height_pt = [float(v) for v in pdf_info["Page size"].split(" pts")[0].split(" x ")]
+    except (KeyError, ValueError):
+        width_pt, height_pt = 595.0, 842.0  # A4
+    page_bytes = (width_pt / 72 * dpi) * (height_pt / 72 * dpi)
+    return max(1, int(max_memory_mb * 1024 * 1024 // page_bytes))
+
+def iter_pdf_pages(pdf_path, dpi=RASTER_DPI, max_memory_mb=512, skip_pages=(), pdf_info=None):
+    # Yields (page_number, page_count, page) while holding at most one chunk of pages in memory;
+    # pages in skip_pages (already graded) are never rasterized. If a chunk fails its pages are
+    # retried one by one, and a page that still fails is reported and yielded as None.
+    # pdf_info is pdfinfo_from_path's result when the caller already has it.
+    with import_timer("pdf"):
+        from pdf2image import convert_from_path, pdfinfo_from_path
+    info = pdf_info or pdfinfo_from_path(pdf_path)
+    page_count = info["Pages"]
+    chunk_size = pages_per_chunk(info, dpi, max_memory_mb)
+    pending = [n for n in range(1, page_count + 1) if n not in skip_pages]
+    start = 0
+    while start < len(pending):
+        # A chunk is a run of consecutive pending pages, at most chunk_size long
+        end = start + 1
+        while end < len(pending) and end - start < chunk_size and pending[end] == pending[end - 1] + 1:
+            end += 1
+        first_page, last_page = pending[start], pending[end - 1]
+        try:
+            chunk = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page, grayscale=True)
+        except Exception as e:
+            print(f"Error rasterizing pages {first_page}-{last_page}: {e}")
+            chunk = None
+        if chunk is None:
+            for page_number in range(first_page, last_page + 1):
+                try:
+                    page = rasterize_pdf_page(pdf_path, page_number, dpi)
+                except Exception as e:
+                    print(f"Error rasterizing page {page_number}/{page_count}: {e}")
+                    page = None
+                yield page_number, page_count, page
+        else:
+            for offset, page in enumerate(chunk):
+                yield first_page + offset, page_count, page
+        del chunk
+        start = end
+
+def rasterize_pdf_page(pdf_path, page_number, dpi=RASTER_DPI):
+    with import_timer("pdf"):
+        from pdf2image import convert_from_path
+    return convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number, grayscale=True)[0]
+
+# ========== Page Grading Workers ==========
+def init_worker():
+    # The pool provides the parallelism, so each worker keeps OpenCV on one thread
+    cv2.setNumThreads(1)
+
+def resolve_workers(workers):
+    return (os.cpu_count() or 1) if workers <= 0 else workers
+
+# A batch keeps one pool open across its exams (see grade_batch); otherwise every stage that
+# fans out starts a pool of its own
+shared_pool = {"executor": None}
+
+@contextmanager
+def grading_pool(workers):
+    if resolve_workers(workers) <= 1 or shared_pool["executor"]:
+        yield
+        return
+    with ProcessPoolExecutor(max_workers=resolve_workers(workers), initializer=init_worker) as executor:
+        shared_pool["executor"] = executor
+        try:
+            yield
+        finally:
+            shared_pool["executor"] = None
+
+# Workers only read sheets; the whole cohort is scored at once afterwards (see Cohort Scoring)
+def read_pdf_page(pdf_path, page_number, layout=None, dpi=RASTER_DPI):
+    started = time.perf_counter()
+    page = np.asarray(rasterize_pdf_page(pdf_path, page_number, dpi))
+    rasterize_seconds = time.perf_counter() - started
+    bubble_results = extract_bubble_sheet(page, layout, dpi)
+    if bubble_results:
+        bubble_results["metrics"]["rasterize_ms"] = round(rasterize_seconds * 1000, 2)
+    return bubble_results
+
+def run_grading_task(task):
+    # A failing page is reported and skipped so it never takes the batch down with it;
+    # returns (succeeded, result)
+    func, args, label = task
+    try:
+        result = func(*args)
+        print(f"Done {label}")
+        return True, result
+    except Exception as e:
+        print(f"Error grading {label}: {e}")
+        return False, None
+
+def run_grading_tasks(tasks, workers=1, on_result=None):
+    # Results come back in task order whatever the number of workers; on_result(index, result)
+    # is called as each successful task arrives (failed ones are left for a rerun)
+    workers = min(resolve_workers(workers), len(tasks))
+    if workers <= 1:
+        outcomes = (run_grading_task(task) for task in tasks)
+        return collect_results(outcomes, on_result)
+    if shared_pool["executor"]:
+        return collect_results(shared_pool["executor"].map(run_grading_task, tasks), on_result)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        return collect_results(executor.map(run_grading_task, tasks), on_result)
+
+def collect_results(outcomes, on_result=None):
+    results = []
+    for index, (succeeded, result) in enumerate(outcomes):
+        if succeeded and on_result:
+            on_result(index, result)
+        results.append(result)
+    return results
 
-    score = (correct_count / total_questions) * 100 if total_questions > 0 else 0
+# ========== Grading Checkpoints ==========
+# One append-only JSON lines file per run, named after the input's content hash and everything
+# else that changes a reading (layout, dpi). Each page or image is recorded as soon as it has been
+# read, so a rerun after a crash only reads what is left, plus any page that could not be read; the
+# answer key is applied afterwards, so a corrected key reuses the readings too. The file is removed
+# once the results are written.
+def file_digest(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest
+
+def input_digest(input_path):
+    if os.path.isdir(input_path):
+        digest = hashlib.sha256()
+        for filename in list_input_images(input_path):
+            digest.update(filename.encode("utf-8"))
+            file_digest(os.path.join(input_path, filename), digest)
+        return digest.hexdigest()
+    return file_digest(input_path).hexdigest()
+
+def open_checkpoint(checkpoint_dir, input_path, layout, dpi):
+    run_key = f"{input_digest(input_path)}:{layout['layout_hash']}:{dpi}"
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, hashlib.sha256(run_key.encode()).hexdigest()[:32] + ".jsonl")
+
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by the crash
+                done[entry["page"]] = entry["result"]
+    return {"path": path, "done": done}
+
+def save_checkpoint(checkpoint, page, result):
+    # A page that could not be read (None) is not recorded, so a rerun tries it again
+    if checkpoint is None or result is None:
+        return
+    checkpoint["done"][page] = result
+    with open(checkpoint["path"], "a", encoding="utf-8") as f:
+        f.write(json.dumps({"page": page, "result": result}, ensure_ascii=False) + "\n")
+
+def close_checkpoint(checkpoint):
+    if checkpoint and os.path.exists(checkpoint["path"]):
+        os.remove(checkpoint["path"])
+
+# ========== Duplicate Scans ==========
+# Sheets are indexed as they are read, so a page fed through the scanner twice is caught in O(1)
+# and left out before scoring and export. Each reading carries a 64-bit perceptual hash of its
+# answer area (the low frequencies of a 32x32 thumbnail's DCT): rescans of one sheet differ in up
+# to about 12 bits (a 2 degree turn with blur and noise), different sheets in 20 or more, and the
+# threshold sits in that gap. The index files every readable seat
+# number under the page that claimed it, and every hash under each of its four 16-bit bands (a
+# rescan usually shares one, which catches duplicates whose seat could not be read). A sheet is
+# only skipped as a duplicate when its hash is close and both seats were read in full and agree;
+# when a seat has unread digits and the digits that were read agree, the sheet is kept and
+# reported as a possible duplicate for someone to check. A sheet claiming a taken seat without
+# looking like that page is a seat conflict. All of these go into the results as a Conflicts
+# sheet (or record).
+duplicate_distance = 13
+fingerprint_bands = 4
+
+def answer_fingerprint(page, index):
+    # Hex pHash of the area around the answer bubbles (every 4th pixel is plenty for a 32x32 thumbnail)
+    answers = index["slices"]["answers"]
+    x, y, r = index["x"][answers], index["y"][answers], index["r"][answers]
+    if not len(x):
+        return None
+    x0, y0 = max(int((x - r).min()), 0), max(int((y - r).min()), 0)
+    x1, y1 = min(int((x + r).max()), page.shape[1]), min(int((y + r).max()), page.shape[0])
+    if x1 - x0 < 32 or y1 - y0 < 32:
+        return None
+    area = page[y0:y1:4, x0:x1:4] if min(x1 - x0, y1 - y0) >= 128 else page[y0:y1, x0:x1]
+    thumbnail = cv2.resize(area, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(thumbnail)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return np.packbits(bits).tobytes().hex()
+
+def open_scan_index():
+    return {"bands": {}, "seats": {}, "fingerprints": {}, "duplicates": [], "conflicts": []}
+
+def fingerprint_keys(value):
+    width = 64 // fingerprint_bands
+    return [(band, (value >> (band * width)) & ((1 << width) - 1)) for band in range(fingerprint_bands)]
+
+def seat_readable(seat):
+    return '_' not in seat and multiple_mark not in seat
+
+def seats_agree(seat, other):
+    # Every digit read on both sheets is the same
+    return all(a == b for a, b in zip(seat, other) if a.isdigit() and b.isdigit())
+
+def index_scan(scan_index, page, sheet):
+    # Returns the page this sheet duplicates, or None once the sheet is indexed
+    seat = sheet["seat_num"]
+    readable_seat = seat_readable(seat)
+    fingerprint = int(sheet["fingerprint"], 16) if sheet.get("fingerprint") else None
+
+    if fingerprint is not None:
+        candidates = {first for key in fingerprint_keys(fingerprint) for first in scan_index["bands"].get(key, ())}
+        if readable_seat and seat in scan_index["seats"]:
+            candidates.add(scan_index["seats"][seat])
+        possible = None
+        for first in sorted(candidates & scan_index["fingerprints"].keys(), key=str):
+            first_seat = scan_index["fingerprints"][first][1]
+            if bin(fingerprint ^ scan_index["fingerprints"][first][0]).count("1") > duplicate_distance:
+                continue
+            if readable_seat and seat == first_seat:
+                scan_index["duplicates"].append({"Issue": "Duplicate scan (skipped)", "Page": page,
+                                                 "Seat Number": seat, "Matches Page": first})
+                return first
+            if possible is None and seats_agree(seat, first_seat) and not (readable_seat and seat_readable(first_seat)):
+                possible = first
+        if possible is not None:
+            scan_index["conflicts"].append({"Issue": "Possible duplicate", "Page": page,
+                                            "Seat Number": seat, "Matches Page": possible})
+        scan_index["fingerprints"][page] = (fingerprint, seat)
+        for key in fingerprint_keys(fingerprint):
+            scan_index["bands"].setdefault(key, []).append(page)
+
+    if readable_seat:
+        if seat in scan_index["seats"]:
+            scan_index["conflicts"].append({"Issue": "Seat number conflict", "Page": page,
+                                            "Seat Number": seat, "Matches Page": scan_index["seats"][seat]})
+        else:
+            scan_index["seats"][seat] = page
+    return None
+
+def scan_issues(scan_index):
+    return scan_index["duplicates"] + scan_index["conflicts"]
+
+# ========== Streaming Results ==========
+# Each sheet can be scored and appended to a results file as soon as it is read (JSON lines, CSV
+# or Parquet, chosen by extension), so a caller can use partial results long before the workbook
+# is written. Parquet needs pyarrow; its rows go out in row groups and the file is complete once
+# the stream is closed.
+stream_columns = ["Page", "Seat Number", "Grade", "Score (%)", "Model", "Total", "Marked Answers", "Correct Answers",
+                  "Review"]
+stream_formats = {".jsonl": "jsonl", ".csv": "csv", ".parquet": "parquet"}
+parquet_row_group = 256
+
+def open_results_stream(path):
+    stream_format = stream_formats.get(os.path.splitext(path)[1].lower())
+    if stream_format is None:
+        raise ValueError(f"Unsupported results stream {path} (use .jsonl, .csv or .parquet)")
+    stream = {"format": stream_format, "rows": 0, "file": None, "writer": None, "pending": []}
+    if stream_format == "parquet":
+        try:
+            with import_timer("parquet"):
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet results need pyarrow (pip install pyarrow)")
+        schema = pa.schema([(column, pa.int64() if column in ("Grade", "Total") else pa.string())
+                            for column in stream_columns])
+        stream["writer"] = pq.ParquetWriter(path, schema)
+        return stream
+
+    stream["file"] = open(path, "w", encoding="utf-8", newline="")
+    if stream_format == "csv":
+        stream["writer"] = csv.DictWriter(stream["file"], fieldnames=stream_columns)
+        stream["writer"].writeheader()
+        stream["file"].flush()
+    return stream
+
+def flush_parquet_rows(stream):
+    import pyarrow as pa
+    if stream["pending"]:
+        stream["writer"].write_table(pa.Table.from_pylist(stream["pending"], schema=stream["writer"].schema))
+        stream["pending"] = []
+
+def append_results_stream(stream, page, sheet, correct_answers, compiled_keys):
+    # Sheets of a model missing from the key are left out here and reported once when the
+    # whole cohort is scored
+    if f"Model {sheet['model_no']}" not in correct_answers:
+        return
+    outputs, _ = score_cohort([sheet], correct_answers, compiled_keys)
+    for row in outputs:
+        record = {"Page": str(page), **row} if stream["format"] == "parquet" else {"Page": page, **row}
+        if stream["format"] == "jsonl":
+            stream["file"].write(json.dumps(record, ensure_ascii=False) + "\n")
+            stream["file"].flush()
+        elif stream["format"] == "csv":
+            stream["writer"].writerow(record)
+            stream["file"].flush()
+        else:
+            stream["pending"].append(record)
+            if len(stream["pending"]) >= parquet_row_group:
+                flush_parquet_rows(stream)
+        stream["rows"] += 1
+
+def close_results_stream(stream):
+    if stream["format"] == "parquet":
+        flush_parquet_rows(stream)
+        stream["writer"].close()
+    else:
+        stream["file"].close()
 
-    return {
-        "Seat Number": bubble_results["seat_num"],
-        "Grade": correct_count,
-        "Score (%)": f"{round(score, 2)}%",
-        "Model": model_no,
-        "Total": total_questions,
-        "Marked Answers": student_answers_str,
-        "Correct Answers": correct_answers_str
-    }
+# ========== Progress Events ==========
+# Machine-readable progress goes to a channel of its own (stderr on the command line, the
+# protocol channel in server.py), never mixed with the human-readable log on stdout:
+#   {"event": "progress", "stage": "read", "page": 3, "done": 3, "total": 40}
+#   {"event": "progress", "stage": "write", "students": 40}
+def print_progress(event):
+    sys.stderr.write(json.dumps(event) + "\n")
+    sys.stderr.flush()
 
 # ========== Process PDF File ==========
-def process_pdf_file(pdf_path, correct_answers):
+def process_pdf_file(pdf_path, workers=1, max_memory_mb=512, layout=None, dpi=RASTER_DPI, done=None, on_sheet=None):
+    # Returns the readings of the pages in order; pages already in done (e.g. from a checkpoint)
+    # are never rasterized again. on_sheet(page_number, reading, pages_read, page_count) is
+    # called as each new page is read.
+    results = dict(done or {})
+    on_sheet = on_sheet or ignore_sheet
     try:
-        pages = convert_from_path(pdf_path, dpi=300)
-        all_results = []
-        print(f"Found {len(pages)} pages")
-        for idx, page in enumerate(pages):
-            print(f"Processing page {idx + 1}/{len(pages)}...")
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-                image_path = tmp.name
-                page.save(image_path, "JPEG")
-            try:
-                bubble_results = extract_bubble_sheet(image_path)
+        with import_timer("pdf"):
+            from pdf2image import pdfinfo_from_path
+        info = pdfinfo_from_path(pdf_path)
+        page_count = info["Pages"]
+        print(f"Found {page_count} pages")
+        if results:
+            print(f"Resuming: {len(results)} pages already read")
+
+        if resolve_workers(workers) > 1:
+            pending = [n for n in range(1, page_count + 1) if n not in results]
+            # Every worker holds the page it is reading, so pages are handed out a chunk at a
+            # time to keep the pages in flight under max_memory_mb whatever the pool size
+            chunk_size = pages_per_chunk(info, dpi, max_memory_mb)
+            for start in range(0, len(pending), chunk_size):
+                chunk = pending[start:start + chunk_size]
+                tasks = [(read_pdf_page, (pdf_path, n, layout, dpi), f"page {n}/{page_count}")
+                         for n in chunk]
+
+                def record(index, result):
+                    results[chunk[index]] = result
+                    on_sheet(chunk[index], result, len(results), page_count)
+
+                run_grading_tasks(tasks, workers, record)
+        else:
+            # Pages are rasterized a chunk at a time, so a chunk's whole rasterize time is
+            # charged to its first page
+            waited = time.perf_counter()
+            for page_number, page_count, page in iter_pdf_pages(pdf_path, dpi, max_memory_mb, results, info):
+                rasterize_seconds = time.perf_counter() - waited
+                print(f"Processing page {page_number}/{page_count}...")
+                # As in run_grading_task, a failing page is reported and skipped; it is not
+                # checkpointed, so a rerun tries it again
+                try:
+                    if page is None:
+                        raise ValueError("page could not be rasterized")
+                    bubble_results = extract_bubble_sheet(np.asarray(page), layout, dpi)
+                except Exception as e:
+                    print(f"Error grading page {page_number}/{page_count}: {e}")
+                    results[page_number] = None
+                    waited = time.perf_counter()
+                    continue
                 if bubble_results:
-                    final_output = generate_final_output(bubble_results, correct_answers)
-                    if final_output:
-                        all_results.append(final_output)
-            finally:
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-            print(f"Done page {idx + 1}")
-        return all_results
+                    bubble_results["metrics"]["rasterize_ms"] = round(rasterize_seconds * 1000, 2)
+                results[page_number] = bubble_results
+                on_sheet(page_number, bubble_results, len(results), page_count)
+                print(f"Done page {page_number}")
+                waited = time.perf_counter()
+        return [results[n] for n in sorted(results) if results[n]]
     except Exception as e:
         print(f"Error processing PDF file: {e}")
         return []
 
 # ========== Apply Styling to Worksheet ==========
-def apply_worksheet_styling(ws, include_score=True):
-    table_fill = PatternFill(start_color="ECEFF1", end_color="ECEFF1", fill_type="solid")
-    header_fill = PatternFill(start_color="1976D2", end_color="1976D2", fill_type="solid")
-    header_font = Font(name="Arial", size=12, color="FFFFFF", bold=True)
-    cell_font = Font(name="Arial", size=11)
+# Score bands colored on the "Score (%)" column: minimum score -> (style name, fill color)
+score_styles = {85: ("score_excellent", "90CAF9"), 75: ("score_good", "A5D6A7"),
+                65: ("score_fair", "FFF59D"), 0: ("score_low", "FFAB91")}
+
+def register_sheet_styles(wb):
+    # Every results cell uses one of these named styles, so the file carries a handful of
+    # shared style records instead of a fill/font/border per cell
+    with import_timer("excel"):
+        from openpyxl.styles import NamedStyle, Font, Alignment, PatternFill, Border, Side
     thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    cell_font = Font(name="Arial", size=11)
 
-    # Header Row Styling
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-
-    # Data Rows Styling
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row, max_col=ws.max_column):
-        for cell in row:
-            col_letter = cell.column_letter
-            header = ws[f"{col_letter}1"].value
-
-            if col_letter == "A":
-                cell.fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-            elif header == "Total":
-                cell.fill = table_fill
-            else:
-                cell.fill = table_fill
-
-            cell.font = cell_font
-            if header in ['Marked Answers', 'Correct Answers']:
-                cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=False)
-            else:
-                cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=False)
-            cell.border = thin_border
-
-    # Auto Column Width
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                cell_length = len(str(cell.value))
-                if cell_length > max_length:
-                    max_length = cell_length
-            except:
-                pass
-        adjusted_width = (max_length + 2) * 1.1
-        ws.column_dimensions[column].width = min(adjusted_width, 80)
-
-    # Score coloring
-    if include_score:
-        for row in ws.iter_rows(min_row=2):
-            score_cell = row[3]  # "Score (%)"
-            score = score_cell.value
-            if score is not None:
-                try:
-                    numeric_score = float(str(score).replace('%', ''))
-                except:
-                    continue
-                if numeric_score >= 85:
-                    score_cell.fill = PatternFill(start_color="90CAF9", end_color="90CAF9", fill_type="solid")
-                elif numeric_score >= 75:
-                    score_cell.fill = PatternFill(start_color="A5D6A7", end_color="A5D6A7", fill_type="solid")
-                elif numeric_score >= 65:
-                    score_cell.fill = PatternFill(start_color="FFF59D", end_color="FFF59D", fill_type="solid")
-                else:
-                    score_cell.fill = PatternFill(start_color="FFAB91", end_color="FFAB91", fill_type="solid")
+    def solid(color):
+        return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+    styles = [
+        ("results_header", solid("1976D2"), Font(name="Arial", size=12, color="FFFFFF", bold=True), "center"),
+        ("results_first", solid("FFFFFF"), cell_font, "center"),
+        ("results_cell", solid("ECEFF1"), cell_font, "center"),
+        ("results_text", solid("ECEFF1"), cell_font, "left"),
+    ]
+    styles += [(name, solid(color), cell_font, "center") for name, color in score_styles.values()]
+    for name, fill, font, horizontal in styles:
+        wb.add_named_style(NamedStyle(name=name, fill=fill, font=font, border=thin_border,
+                                      alignment=Alignment(horizontal=horizontal, vertical='center', wrap_text=False)))
+
+def score_style(score):
+    try:
+        numeric_score = float(str(score).replace('%', ''))
+    except ValueError:
+        return "results_cell"
+    return next((name for minimum, (name, _) in score_styles.items() if numeric_score >= minimum), "score_low")
+
+def write_styled_sheet(wb, title, df, include_score=True):
+    # Streams one results sheet through a write-only worksheet; column widths are taken from the
+    # frame up front because a write-only sheet emits its column settings before the first row
+    with import_timer("excel"):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.utils import get_column_letter
+    ws = wb.create_sheet(title=title)
+    headers = list(df.columns)
+    values = df.astype(object).where(df.notna(), None)
+
+    for idx, header in enumerate(headers, start=1):
+        max_length = max([len(str(header))] + ([int(values[header].astype(str).str.len().max())] if len(df) else []))
+        ws.column_dimensions[get_column_letter(idx)].width = min((max_length + 2) * 1.1, 80)
+
+    column_styles = ["results_first" if idx == 0 else
+                     "results_text" if header in ['Marked Answers', 'Correct Answers', 'Review'] else "results_cell"
+                     for idx, header in enumerate(headers)]
+    score_column = headers.index("Score (%)") if include_score and "Score (%)" in headers else None
+
+    def styled(value, style):
+        cell = WriteOnlyCell(ws, value)
+        cell.style = style
+        return cell
+
+    ws.append([styled(header, "results_header") for header in headers])
+    for row in values.itertuples(index=False, name=None):
+        cells = [styled(value, style) for value, style in zip(row, column_styles)]
+        if score_column is not None and row[score_column] is not None:
+            cells[score_column].style = score_style(row[score_column])
+        ws.append(cells)
+    return ws
 
 # ========== Create Analysis Sheet ==========
-from openpyxl import load_workbook
-from openpyxl.drawing.image import Image
-from openpyxl.styles import Font
-import matplotlib.pyplot as plt
-from scipy.stats import norm
-import numpy as np
-import pandas as pd
-import os
-from openpyxl.utils.dataframe import dataframe_to_rows
-
-def create_analysis_sheet(output_path):
+# Charts are drawn on standalone matplotlib Figures (no pyplot state) into in-memory PNGs, so
+# concurrent grading jobs never share figures or temp files; with workers > 1 they render in a pool.
+CHART_DPI = 150
+
+def result_scores(results_df):
+    return pd.to_numeric(results_df["Score (%)"].str.replace('%', ''))
+
+def new_chart(figsize):
+    with import_timer("dashboard"):
+        from matplotlib.figure import Figure
+    fig = Figure(figsize=figsize)
+    return fig, fig.add_subplot()
+
+def chart_png(fig, dpi):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches='tight', dpi=dpi)
+    return buffer.getvalue()
+
+def label_seats(ax, results_df, max_labels=25):
+    # One category per student; large cohorts label every n-th seat instead of drawing
+    # thousands of overlapping tick labels (which dominated the render time)
+    seats = results_df["Seat Number"].astype(str).to_numpy()
+    positions = np.arange(len(seats))
+    step = max(1, -(-len(seats) // max_labels))
+    ax.set_xticks(positions[::step], seats[::step])
+    return positions
+
+def bar_chart(results_df, dpi):
+    from matplotlib.collections import PolyCollection
+    fig, ax = new_chart((6, 4))
+    positions = label_seats(ax, results_df)
+    # All bars as one PolyCollection: the same rectangles ax.bar draws (width 0.8), without one
+    # Rectangle artist per student
+    scores = result_scores(results_df).to_numpy(dtype=float)
+    left, right, base = positions - 0.4, positions + 0.4, np.zeros(len(positions))
+    bars = np.stack([np.column_stack(corner) for corner in
+                     [(left, base), (left, scores), (right, scores), (right, base)]], axis=1)
+    ax.add_collection(PolyCollection(bars, facecolors='#3498DB', edgecolors='none'))
+    ax.autoscale_view()
+    ax.set_ylim(bottom=0)
+    ax.set_title('Student Grades Distribution', fontsize=12)
+    ax.set_xlabel('Seat Number', fontsize=10)
+    ax.set_ylabel('Score (%)', fontsize=10)
+    ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    return chart_png(fig, dpi)
+
+def histogram_chart(results_df, dpi):
+    fig, ax = new_chart((6, 4))
+    ax.hist(result_scores(results_df), bins=10, color='#2ECC71', edgecolor='black')
+    ax.set_title('Histogram of Grades', fontsize=12)
+    ax.set_xlabel('Score (%)', fontsize=10)
+    ax.set_ylabel('Number of Students', fontsize=10)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    return chart_png(fig, dpi)
+
+def box_chart(results_df, dpi):
+    fig, ax = new_chart((5, 3))
+    ax.boxplot(result_scores(results_df), vert=False, patch_artist=True,
+               boxprops=dict(facecolor='#F39C12'))
+    ax.set_title('Box Plot of Grades', fontsize=12)
+    ax.set_xlabel('Score (%)', fontsize=10)
+    ax.grid(axis='x', linestyle='--', alpha=0.7)
+    return chart_png(fig, dpi)
+
+def model_pie_chart(results_df, dpi):
+    fig, ax = new_chart((5, 5))
+    model_counts = results_df["Model"].value_counts()
+    ax.pie(model_counts, labels=model_counts.index, autopct='%1.1f%%',
+           colors=['#E74C3C', '#9B59B6', '#3498DB', '#F1C40F'])
+    ax.set_title('Distribution of Students by Model', fontsize=12)
+    return chart_png(fig, dpi)
+
+def model_bar_chart(values, title, ylabel, color, dpi):
+    fig, ax = new_chart((6, 4))
+    ax.bar(values.index.astype(str), values.values, width=0.5, color=color)
+    ax.set_title(title, fontsize=12)
+    ax.set_xlabel('Model', fontsize=10)
+    ax.set_ylabel(ylabel, fontsize=10)
+    ax.tick_params(axis='x', labelrotation=0, labelsize=8)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    return chart_png(fig, dpi)
+
+def average_by_model_chart(results_df, dpi):
+    avg_scores = result_scores(results_df).groupby(results_df["Model"]).mean()
+    return model_bar_chart(avg_scores, 'Average Score by Model', 'Average Score (%)', '#16A085', dpi)
+
+def pass_rate_chart(results_df, dpi):
+    pass_rates = (result_scores(results_df) >= 50).groupby(results_df["Model"]).mean() * 100
+    return model_bar_chart(pass_rates, 'Pass Rate by Model (%)', 'Pass Rate (%)', '#D35400', dpi)
+
+def gaussian_chart(results_df, dpi):
+    fig, ax = new_chart((6, 4))
+    scores = result_scores(results_df)
+    # Maximum-likelihood normal fit (population std), as scipy's norm.fit gives
+    mu, std = scores.mean(), scores.std(ddof=0)
+    x = np.linspace(0, 100, 100)
+
+    if std == 0:
+        p = np.zeros_like(x)
+    else:
+        p = np.exp(-0.5 * ((x - mu) / std) ** 2) / (std * np.sqrt(2 * np.pi))
+    ax.plot(x, p, linewidth=2, color='#8E44AD')
+    ax.hist(scores, density=True, alpha=0.6, color='#7FB3D5')
+    ax.set_title(r'Normal Distribution of Grades$\mu=%.1f$, $\sigma=%.1f$' % (mu, std), fontsize=12)
+    ax.set_xlabel('Score (%)', fontsize=10)
+    ax.set_ylabel('Density', fontsize=10)
+    ax.grid(linestyle='--', alpha=0.7)
+    return chart_png(fig, dpi)
+
+def scatter_chart(results_df, dpi):
+    fig, ax = new_chart((6, 4))
+    positions = label_seats(ax, results_df)
+    ax.scatter(positions, result_scores(results_df), color='#C0392B')
+    ax.set_title('Seat Number vs Score', fontsize=12)
+    ax.set_xlabel('Seat Number', fontsize=10)
+    ax.set_ylabel('Score (%)', fontsize=10)
+    ax.grid(linestyle='--', alpha=0.7)
+    return chart_png(fig, dpi)
+
+# (chart, caption, column, displayed width, displayed height); charts alternate between columns A and I
+dashboard_charts = [
+    (bar_chart, "1. Student Grades Bar Chart", "A", 700, 500),
+    (histogram_chart, "2. Grades Histogram", "I", 700, 500),
+    (box_chart, "3. Grades Box Plot", "A", 500, 500),
+    (model_pie_chart, "4. Models Distribution Pie Chart", "I", 500, 500),
+    (average_by_model_chart, "5. Average Score by Model", "A", 700, 500),
+    (pass_rate_chart, "6. Pass Rate by Model", "I", 700, 500),
+    (gaussian_chart, "7. Normal Distribution of Grades", "A", 700, 500),
+    (scatter_chart, "8. Seat Number vs Score", "I", 700, 500),
+]
+
+def render_chart(task):
+    # Returns the chart's PNG, the seconds it took to render and, from the first chart a process
+    # draws, the cold matplotlib import (None otherwise) so pool workers can report it back
+    chart, results_df, dpi = task
+    cold = "dashboard" not in import_times
+    started = time.perf_counter()
+    png = chart(results_df, dpi)
+    return png, time.perf_counter() - started, import_times["dashboard"] if cold else None
+
+def render_dashboard_charts(results_df, dpi=CHART_DPI, workers=1):
+    tasks = [(chart, results_df, dpi) for chart, *_ in dashboard_charts]
+    if workers > 1 and shared_pool["executor"]:
+        rendered = list(shared_pool["executor"].map(render_chart, tasks))
+    elif workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            rendered = list(pool.map(render_chart, tasks))
+    else:
+        rendered = [render_chart(task) for task in tasks]
+    for (chart, *_), (_, seconds, _) in zip(dashboard_charts, rendered):
+        run_metrics[f"chart_{chart.__name__}"] = seconds
+    # Charts drawn in a pool import matplotlib there: the slowest worker's import is the cost
+    worker_imports = [seconds for _, _, seconds in rendered if seconds is not None]
+    if worker_imports:
+        import_times.setdefault("dashboard", max(worker_imports))
+    return [png for png, _, _ in rendered]
+
+def write_analysis_sheet(wb, results_df, chart_dpi=CHART_DPI, workers=1):
+    # Appends the dashboard to a write-only workbook: captions and statistics are streamed row by
+    # row and the chart images are anchored next to them
+    with import_timer("excel"):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.drawing.image import Image
+        from openpyxl.styles import Font
+
+    charts = render_dashboard_charts(results_df, chart_dpi, workers)
+    ws = wb.create_sheet("Analysis")
+    ws.column_dimensions['A'].width = 25
+    ws.column_dimensions['B'].width = 20
+    ws.column_dimensions['I'].width = 25
+
+    def styled(value, font):
+        cell = WriteOnlyCell(ws, value)
+        cell.font = font
+        return cell
+
+    rows = {1: {"A": styled("Student Grades Analysis Dashboard", Font(size=24, bold=True, color="2E86C1"))}}
+    next_row = {"A": 4, "I": 4}
+    step = 30
+    for (chart, caption, column, width, height), png in zip(dashboard_charts, charts):
+        row = next_row[column]
+        rows.setdefault(row - 1, {})[column] = caption
+        img = Image(io.BytesIO(png))
+        img.width, img.height = width, height
+        ws.add_image(img, f'{column}{row}')
+        next_row[column] += step
+
+    # Summary Stats
+    scores = result_scores(results_df)
+    summary_row = max(next_row.values()) + 1
+    rows[summary_row] = {"A": styled("Summary Statistics", Font(size=14, bold=True, color="2E86C1"))}
+    stats = [
+        ('Metric', 'Value'),
+        ('Total Students', len(results_df)),
+        ('Average Score', f"{scores.mean():.1f}%"),
+        ('Minimum Score', f"{scores.min():.1f}%"),
+        ('Maximum Score', f"{scores.max():.1f}%"),
+        ('Standard Deviation', f"{scores.std():.1f}"),
+        ('Pass Rate', f"{(scores >= 50).mean() * 100:.1f}%"),
+    ]
+    for offset, (metric, value) in enumerate(stats, start=1):
+        rows[summary_row + offset] = {"A": metric, "B": value}
+
+    for row in range(1, max(rows) + 1):
+        cells = rows.get(row, {})
+        if not cells:
+            ws.append([])
+            continue
+        last_column = max(ord(column) - ord('A') for column in cells)
+        ws.append([cells.get(chr(ord('A') + i)) for i in range(last_column + 1)])
+    return ws
+
+# ========== Answer Key Cache ==========
+# Keyed by file content rather than path: the backend saves every upload under a new temp name.
+# Compiled keys are also kept on disk as .npz, so a new process skips parsing a key it has seen.
+KEY_CACHE_DIR = os.path.join(tempfile.gettempdir(), "smart_exam_keys")
+KEY_FORMAT_VERSION = 1
+answer_key_cache = {}
+
+def load_cached_key(path):
     try:
-        # Load the existing Excel file
-        wb = load_workbook(output_path)
-        results_df = pd.read_excel(output_path, sheet_name="Results")
-
-        if "Analysis" in wb.sheetnames:
-            wb.remove(wb["Analysis"])
-        ws = wb.create_sheet("Analysis")
-
-        ws['A1'] = "Student Grades Analysis Dashboard"
-        ws['A1'].font = Font(size=24, bold=True, color="2E86C1")
-
-        temp_files = []
-        row_left = 4
-        row_right = 4
-        step = 30
-
-        # 1. Bar Chart for Student Grades
-        plt.figure(figsize=(6, 4))
-        bars = plt.bar(results_df["Seat Number"].astype(str),
-                       pd.to_numeric(results_df["Score (%)"].str.replace('%', '')),
-                       color='#3498DB')
-        plt.title('Student Grades Distribution', fontsize=12)
-        plt.xlabel('Seat Number', fontsize=10)
-        plt.ylabel('Score (%)', fontsize=10)
-        plt.xticks(rotation=45, fontsize=8)
-        plt.grid(axis='y', linestyle='--', alpha=0.7)
-
-        bar_chart_path = "bar_chart.png"
-        plt.savefig(bar_chart_path, bbox_inches='tight', dpi=300)
-        plt.close()
-        temp_files.append(bar_chart_path)
-
-        ws[f'A{row_left - 1}'] = "1. Student Grades Bar Chart"
-        img = Image(bar_chart_path)
-        img.width, img.height = 700, 500
-        ws.add_image(img, f'A{row_left}')
-        row_left += step
-
-        # 2. Histogram of Grades
-        plt.figure(figsize=(6, 4))
-        scores = pd.to_numeric(results_df["Score (%)"].str.replace('%', ''))
-        plt.hist(scores, bins=10, color='#2ECC71', edgecolor='black')
-        plt.title('Histogram of Grades', fontsize=12)
-        plt.xlabel('Score (%)', fontsize=10)
-        plt.ylabel('Number of Students', fontsize=10)
-        plt.grid(axis='y', linestyle='--', alpha=0.7)
-
-        hist_path = "histogram.png"
-        plt.savefig(hist_path, bbox_inches='tight', dpi=300)
-        plt.close()
-        temp_files.append(hist_path)
-
-        ws[f'I{row_right - 1}'] = "2. Grades Histogram"
-        img = Image(hist_path)
-        img.width, img.height = 700, 500
-        ws.add_image(img, f'I{row_right}')
-        row_right += step
-
-        # 3. Box Plot
-        plt.figure(figsize=(5, 3))
-        plt.boxplot(scores, vert=False, patch_artist=True,
-                    boxprops=dict(facecolor='#F39C12'))
-        plt.title('Box Plot of Grades', fontsize=12)
-        plt.xlabel('Score (%)', fontsize=10)
-        plt.grid(axis='x', linestyle='--', alpha=0.7)
-
-        boxplot_path = "boxplot.png"
-        plt.savefig(boxplot_path, bbox_inches='tight', dpi=300)
-        plt.close()
-        temp_files.append(boxplot_path)
-
-        ws[f'A{row_left - 1}'] = "3. Grades Box Plot"
-        img = Image(boxplot_path)
-        img.width, img.height = 500, 500
-        ws.add_image(img, f'A{row_left}')
-        row_left += step
-
-        # 4. Pie Chart
-        plt.figure(figsize=(5, 5))
-        model_counts = results_df["Model"].value_counts()
-        plt.pie(model_counts, labels=model_counts.index, autopct='%1.1f%%',
-                colors=['#E74C3C', '#9B59B6', '#3498DB', '#F1C40F'])
-        plt.title('Distribution of Students by Model', fontsize=12)
-
-        pie_path = "pie_chart.png"
-        plt.savefig(pie_path, bbox_inches='tight', dpi=300)
-        plt.close()
-        temp_files.append(pie_path)
-
-        ws[f'I{row_right - 1}'] = "4. Models Distribution Pie Chart"
-        img = Image(pie_path)
-        img.width, img.height = 500, 500
-        ws.add_image(img, f'I{row_right}')
-        row_right += step
-
-        # 5. Average Score by Model
-        plt.figure(figsize=(6, 4))
-        avg_scores = results_df.groupby("Model")["Score (%)"]\
-            .apply(lambda x: pd.to_numeric(x.str.replace('%', '')).mean())
-        avg_scores.plot(kind='bar', color='#16A085')
-        plt.title('Average Score by Model', fontsize=12)
-        plt.xlabel('Model', fontsize=10)
-        plt.ylabel('Average Score (%)', fontsize=10)
-        plt.xticks(rotation=0, fontsize=8)
-        plt.grid(axis='y', linestyle='--', alpha=0.7)
-
-        avg_model_path = "avg_model.png"
-        plt.savefig(avg_model_path, bbox_inches='tight', dpi=300)
-        plt.close()
-        temp_files.append(avg_model_path)
-
-        ws[f'A{row_left - 1}'] = "5. Average Score by Model"
-        img = Image(avg_model_path)
-        img.width, img.height = 700, 500
-        ws.add_image(img, f'A{row_left}')
-        row_left += step
-
-        # 6. Pass Rate by Model
-        plt.figure(figsize=(6, 4))
-        pass_rates = results_df.groupby("Model")["Score (%)"]\
-            .apply(lambda x: (pd.to_numeric(x.str.replace('%', '')) >= 50).mean() * 100)
-        pass_rates.plot(kind='bar', color='#D35400')
-        plt.title('Pass Rate by Model (%)', fontsize=12)
-        plt.xlabel('Model', fontsize=10)
-        plt.ylabel('Pass Rate (%)', fontsize=10)
-        plt.xticks(rotation=0, fontsize=8)
-        plt.grid(axis='y', linestyle='--', alpha=0.7)
-
-        pass_rate_path = "pass_rate.png"
-        plt.savefig(pass_rate_path, bbox_inches='tight', dpi=300)
-        plt.close()
-        temp_files.append(pass_rate_path)
-
-        ws[f'I{row_right - 1}'] = "6. Pass Rate by Model"
-        img = Image(pass_rate_path)
-        img.width, img.height = 700, 500
-        ws.add_image(img, f'I{row_right}')
-        row_right += step
-
-        # 7. Gaussian Distribution
-        plt.figure(figsize=(6, 4))
-        mu, std = norm.fit(scores)
-        x = np.linspace(0, 100, 100)
-
-        if std == 0:
-            p = np.zeros_like(x)
-        else:
-            p = norm.pdf(x, mu, std)
-        plt.plot(x, p, linewidth=2, color='#8E44AD')
-        plt.hist(scores, density=True, alpha=0.6, color='#7FB3D5')
-        plt.title(r'Normal Distribution of Grades$\mu=%.1f$, $\sigma=%.1f$' % (mu, std), fontsize=12)
-        plt.xlabel('Score (%)', fontsize=10)
-        plt.ylabel('Density', fontsize=10)
-        plt.grid(linestyle='--', alpha=0.7)
-
-        gaussian_path = "gaussian.png"
-        plt.savefig(gaussian_path, bbox_inches='tight', dpi=300)
-        plt.close()
-        temp_files.append(gaussian_path)
-
-        ws[f'A{row_left - 1}'] = "7. Normal Distribution of Grades"
-        img = Image(gaussian_path)
-        img.width, img.height = 700, 500
-        ws.add_image(img, f'A{row_left}')
-        row_left += step
-
-        # 8. Scatter Plot: Seat Number vs Score
-        plt.figure(figsize=(6, 4))
-        plt.scatter(results_df["Seat Number"], scores, color='#C0392B')
-        plt.title('Seat Number vs Score', fontsize=12)
-        plt.xlabel('Seat Number', fontsize=10)
-        plt.ylabel('Score (%)', fontsize=10)
-        plt.grid(linestyle='--', alpha=0.7)
-
-        scatter_path = "scatter.png"
-        plt.savefig(scatter_path, bbox_inches='tight', dpi=300)
-        plt.close()
-        temp_files.append(scatter_path)
-
-        ws[f'I{row_right - 1}'] = "8. Seat Number vs Score"
-        img = Image(scatter_path)
-        img.width, img.height = 700, 500
-        ws.add_image(img, f'I{row_right}')
-        row_right += step
-
-        # Summary Stats
-        summary_row = max(row_left, row_right) + 1
-        ws[f'A{summary_row}'] = "Summary Statistics"
-        ws[f'A{summary_row}'].font = Font(size=14, bold=True, color="2E86C1")
-
-        stats_df = pd.DataFrame({
-            'Metric': ['Total Students', 'Average Score', 'Minimum Score',
-                       'Maximum Score', 'Standard Deviation', 'Pass Rate'],
-            'Value': [
-                len(results_df),
-                f"{scores.mean():.1f}%",
-                f"{scores.min():.1f}%",
-                f"{scores.max():.1f}%",
-                f"{scores.std():.1f}",
-                f"{(scores >= 50).mean() * 100:.1f}%"
-            ]
-        })
-
-        for r in dataframe_to_rows(stats_df, index=False, header=True):
-            ws.append(r)
-
-        ws.column_dimensions['A'].width = 25
-        ws.column_dimensions['B'].width = 20
-        ws.column_dimensions['I'].width = 25
-
-        wb.save(output_path)
-        # تنسيق الخط داخل جدول Summary Statistics
-        for row in ws.iter_rows(min_row=summary_row + 1, max_row=summary_row + 6, min_col=1, max_col=2):
-            for cell in row:
-                cell.font = Font(name='Arial', size=24) 
-
-
-    finally:
-        for img_path in temp_files:
-            if os.path.exists(img_path):
-                os.remove(img_path)
-
-# ========== Entry Point ==========
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Correct bubble sheets")
-    parser.add_argument("--input", required=True, help="Input path (image, folder, or PDF)")
-    parser.add_argument("--excel", required=True, help="Path to Excel file with correct answers")
-    parser.add_argument("--output", required=True, help="Path to save the output Excel file")
-    args = parser.parse_args()
-
-    input_path = args.input
-    correct_answers_path = args.excel
-    output_path = args.output
-
-    print("Extracting correct answers from Excel...")
-    all_correct_answers = extract_all_correct_answers(correct_answers_path)
-    if not all_correct_answers:
-        print("Error processing correct answers file.")
-        exit(1)
+        with np.load(path, allow_pickle=False) as data:
+            return {model: data[model] for model in data.files}
+    except (OSError, ValueError):
+        return None
 
-    all_outputs = []
+def save_cached_key(path, correct_answers):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(temp_path, **{str(model): key for model, key in correct_answers.items()})
+    os.replace(temp_path, path)
+
+def load_correct_answers(file_path, cache_dir=KEY_CACHE_DIR):
+    digest = file_digest(file_path).hexdigest()
+    if digest not in answer_key_cache:
+        cache_path = os.path.join(cache_dir, f"{digest}.v{KEY_FORMAT_VERSION}.npz") if cache_dir else None
+        correct_answers = load_cached_key(cache_path) if cache_path and os.path.exists(cache_path) else None
+        if not correct_answers:
+            correct_answers = read_answer_key(file_path)
+            if not correct_answers:
+                return correct_answers
+            if cache_path:
+                try:
+                    save_cached_key(cache_path, correct_answers)
+                except (OSError, TypeError, ValueError) as e:
+                    # The cache only saves parsing time, so a key that cannot be written is still used
+                    print(f"Warning: could not cache answer key: {e}")
+        answer_key_cache[digest] = correct_answers
+    return answer_key_cache[digest]
+
+# ========== Grade Exam ==========
+def list_input_images(folder):
+    return sorted(f for f in os.listdir(folder) if f.lower().endswith((".jpg", ".jpeg", ".png")))
+
+def ignore_sheet(key, sheet, sheets_read, sheet_count):
+    pass
+
+def read_input(input_path, workers=1, max_memory_mb=512, layout=None, dpi=RASTER_DPI, done=None, on_sheet=None):
+    # Reads every sheet of the input (image, folder, or PDF) in order; unreadable pages are left out.
+    # Sheets are keyed by page number (PDF) or file name; see process_pdf_file for done and on_sheet.
+    sheets = []
+    on_sheet = on_sheet or ignore_sheet
 
     if input_path.lower().endswith(".pdf"):
         print("Processing PDF file...")
-        all_outputs = process_pdf_file(input_path, all_correct_answers)
+        sheets = process_pdf_file(input_path, workers, max_memory_mb, layout, dpi, done, on_sheet)
 
     elif os.path.isdir(input_path):
         print("Processing all images in folder...")
-        for filename in os.listdir(input_path):
-            if filename.lower().endswith((".jpg", ".jpeg", ".png")):
-                image_path = os.path.join(input_path, filename)
-                bubble_results = extract_bubble_sheet(image_path)
-                if bubble_results:
-                    final_output = generate_final_output(bubble_results, all_correct_answers)
-                    if final_output:
-                        all_outputs.append(final_output)
+        results = dict(done or {})
+        if results:
+            print(f"Resuming: {len(results)} images already read")
+        filenames = [f for f in list_input_images(input_path) if f not in results]
+        image_count = len(results) + len(filenames)
+        tasks = [(extract_bubble_sheet, (os.path.join(input_path, filename), layout, dpi), filename)
+                 for filename in filenames]
+
+        def record(index, result):
+            results[filenames[index]] = result
+            on_sheet(filenames[index], result, len(results), image_count)
+
+        run_grading_tasks(tasks, workers, record)
+        sheets = [results[f] for f in sorted(results) if results[f]]
     else:
         print("Processing image file...")
-        bubble_results = extract_bubble_sheet(input_path)
+        bubble_results = extract_bubble_sheet(input_path, layout, dpi)
+        on_sheet(os.path.basename(input_path), bubble_results, 1, 1)
         if bubble_results:
-            final_output = generate_final_output(bubble_results, all_correct_answers)
-            if final_output:
-                all_outputs.append(final_output)
+            sheets.append(bubble_results)
+
+    return sheets
+
+def write_results_json(all_outputs, output_path):
+    all_outputs = sorted(all_outputs, key=lambda r: r["Seat Number"])
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(all_outputs, f, ensure_ascii=False, indent=2)
+    print(f"\nFinal results saved to: {output_path}")
 
-    if all_outputs:
-        output_df = pd.DataFrame(all_outputs)
-        output_df = output_df.sort_values(by="Seat Number", ascending=True)
+def write_results_workbook(all_outputs, output_path, analysis=True, chart_dpi=CHART_DPI, workers=1, items_df=None, issues_df=None):
+    with import_timer("excel"):
+        from openpyxl import Workbook
 
-        # Create workbook with THREE sheets
-        wb = Workbook()
-        
+    output_df = pd.DataFrame(all_outputs)
+    output_df = output_df.sort_values(by="Seat Number", ascending=True)
+
+    # Create workbook with the results sheets (written in streaming mode with shared named styles)
+    wb = Workbook(write_only=True)
+    register_sheet_styles(wb)
+    
+    with stage_timer(run_metrics, "results_sheets"):
         # Sheet 1: Results (With Score %)
-        ws1 = wb.active
-        ws1.title = "Results"
         sheet1_df = output_df[["Seat Number", "Model", "Grade", "Score (%)", "Total"]]
-        for r in dataframe_to_rows(sheet1_df, index=False, header=True):
-            ws1.append(r)
-        apply_worksheet_styling(ws1, include_score=True)
-        
+        write_styled_sheet(wb, "Results", sheet1_df, include_score=True)
+
         # Sheet 2: Details (Full Answers)
-        ws2 = wb.create_sheet(title="Details")
-        sheet2_df = output_df[["Seat Number", "Model", "Grade", "Total", "Marked Answers", "Correct Answers"]]
-        for r in dataframe_to_rows(sheet2_df, index=False, header=True):
-            ws2.append(r)
-        apply_worksheet_styling(ws2, include_score=False)
+        sheet2_df = output_df[["Seat Number", "Model", "Grade", "Total", "Marked Answers", "Correct Answers", "Review"]]
+        write_styled_sheet(wb, "Details", sheet2_df, include_score=False)
 
-        # Save initial workbook first (required for analysis)
-        wb.save(output_path)
-        
-        # Sheet 3: Analysis Dashboard
+        # Item Analysis: difficulty, discrimination and choice shares per question
+        if items_df is not None and len(items_df):
+            write_styled_sheet(wb, "Item Analysis", items_df, include_score=False)
+
+        # Conflicts: duplicate scans that were skipped and seat numbers claimed by two sheets
+        if issues_df is not None and len(issues_df):
+            write_styled_sheet(wb, "Conflicts", issues_df, include_score=False)
+
+    # Sheet 3: Analysis Dashboard (built from the in-memory results; the workbook is saved once)
+    if analysis:
         print("Creating Analysis Dashboard...")
         try:
-            create_analysis_sheet(output_path)
+            with stage_timer(run_metrics, "dashboard"):
+                write_analysis_sheet(wb, sheet1_df, chart_dpi, workers)
             print("Analysis dashboard created successfully!")
         except Exception as e:
             print(f"Error creating analysis sheet: {e}")
 
-        print(f"\nFinal results saved to: {output_path}")
-        print("Sheets created:")
-        print("- Results: Summary with scores")
-        print("- Details: Full answers data")
+    with stage_timer(run_metrics, "save_workbook"):
+        wb.save(output_path)
+
+    print(f"\nFinal results saved to: {output_path}")
+    print("Sheets created:")
+    print("- Results: Summary with scores")
+    print("- Details: Full answers data")
+    if items_df is not None and len(items_df):
+        print("- Item Analysis: Per-question statistics")
+    if issues_df is not None and len(issues_df):
+        print("- Conflicts: Duplicate scans, possible duplicates and seat number conflicts")
+    if analysis:
         print("- Analysis: Visual dashboard")
-    else:
+
+def grade_exam(input_path, excel_path, output_path, workers=1, max_memory_mb=512, analysis=True, output_format="xlsx", layout_path=None, dpi=RASTER_DPI, chart_dpi=CHART_DPI, checkpoint_dir=None, stream_path=None, progress=None, metrics_path=None):
+    started = time.perf_counter()
+    run_metrics.clear()
+    if dpi < MIN_DPI:
+        print(f"Error: recognition needs at least {MIN_DPI} DPI, got {dpi}")
+        return {"success": False, "message": f"Recognition needs at least {MIN_DPI} DPI, got {dpi}."}
+    print("Extracting correct answers from Excel...")
+    with stage_timer(run_metrics, "load_key"):
+        all_correct_answers = load_correct_answers(excel_path)
+    if not all_correct_answers:
+        print("Error processing correct answers file.")
+        return {"success": False, "message": "Error processing correct answers file."}
+    compiled_keys = compile_keys(all_correct_answers)
+
+    layout = load_layout(layout_path, count_key_questions(all_correct_answers))
+    print(f"Using sheet layout {layout['layout_hash']}")
+    checkpoint = None
+    if checkpoint_dir and (input_path.lower().endswith(".pdf") or os.path.isdir(input_path)):
+        checkpoint = open_checkpoint(checkpoint_dir, input_path, layout, dpi)
+    stream = None
+    if stream_path:
+        try:
+            stream = open_results_stream(stream_path)
+        except (ValueError, OSError) as e:
+            print(f"Error opening results stream: {e}")
+            return {"success": False, "message": f"Error opening results stream: {e}"}
+
+    page_records = []
+    scan_index = open_scan_index()
+
+    def index_sheet(page, sheet):
+        # False for a duplicate scan, which is marked and left out of the stream and the results
+        first = index_scan(scan_index, page, sheet)
+        if first is not None:
+            print(f"Page {page} duplicates page {first}; skipped")
+            sheet["duplicate_of"] = first
+        return first is None
+
+    def on_sheet(page, sheet, sheets_read, sheet_count):
+        if sheet and "metrics" in sheet:
+            page_records.append({"page": page, **sheet["metrics"]})
+        if checkpoint:
+            save_checkpoint(checkpoint, page, sheet)
+        if sheet and index_sheet(page, sheet) and stream:
+            append_results_stream(stream, page, sheet, all_correct_answers, compiled_keys)
+        if progress:
+            progress({"event": "progress", "stage": "read", "page": page, "done": sheets_read, "total": sheet_count})
+
+    try:
+        done = dict(checkpoint["done"]) if checkpoint else {}
+        # Sheets read before an interruption are indexed (and streamed) first
+        for page in sorted(done):
+            if done[page] and index_sheet(page, done[page]) and stream:
+                append_results_stream(stream, page, done[page], all_correct_answers, compiled_keys)
+        with stage_timer(run_metrics, "read"):
+            sheets = read_input(input_path, workers, max_memory_mb, layout, dpi, done, on_sheet)
+    finally:
+        if stream:
+            close_results_stream(stream)
+    sheets = [sheet for sheet in sheets if "duplicate_of" not in sheet]
+    issues = scan_issues(scan_index)
+    if issues:
+        print(f"{len(scan_index['duplicates'])} duplicate scan(s) skipped, "
+              f"{len(scan_index['conflicts'])} seat number conflict(s) or possible duplicate(s)")
+    with stage_timer(run_metrics, "grade"):
+        all_outputs, cohort = score_cohort(sheets, all_correct_answers, compiled_keys)
+    if not all_outputs:
         print("No valid results extracted.")
-        exit(1)
\ No newline at end of file
+        return {"success": False, "message": "No valid results extracted."}
+
+    flagged = sum(bool(row["Review"]) for row in all_outputs)
+    if flagged:
+        print(f"{flagged} sheet(s) have bubbles to review (see the Review column)")
+    if progress:
+        progress({"event": "progress", "stage": "write", "students": len(all_outputs)})
+
+    if output_format == "json":
+        with stage_timer(run_metrics, "write_json"):
+            write_results_json(all_outputs, output_path)
+    else:
+        with stage_timer(run_metrics, "item_analysis"):
+            items_df = item_analysis(cohort)
+        write_results_workbook(all_outputs, output_path, analysis, chart_dpi, resolve_workers(workers), items_df,
+                               pd.DataFrame(issues))
+    close_checkpoint(checkpoint)
+
+    metrics = metrics_report(page_records, time.perf_counter() - started)
+    if metrics_path:
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, indent=2)
+        print(f"Metrics saved to: {metrics_path}")
+
+    mode = "json" if output_format == "json" else "xlsx" if analysis else "xlsx, no analysis"
+    report_import_times(mode)
+    summary = {
+        "success": True,
+        "output": output_path,
+        "students": len(all_outputs),
+        "flagged": flagged,
+        "duplicates": len(scan_index["duplicates"]),
+        "conflicts": issues,
+        "import_seconds": {group: round(seconds, 3) for group, seconds in import_times.items()},
+        "metrics": metrics["run"],
+    }
+    if stream:
+        summary["stream"] = stream_path
+        summary["streamed"] = stream["rows"]
+    return summary
+
+# ========== Batch Grading ==========
+# A batch file is a JSON list of exams to grade in one process, each with the command-line options:
+#   [{"input": "exam1.pdf", "excel": "key1.xlsx", "output": "exam1.xlsx"}, {"input": ..., "format": "json"}, ...]
+# The exams share the loaded libraries, one worker pool and the compiled answer keys; a failing
+# exam is reported and the batch goes on.
+batch_options = {"input": "input_path", "excel": "excel_path", "output": "output_path", "format": "output_format",
+                 "layout": "layout_path", "stream": "stream_path", "metrics": "metrics_path"}
+
+def load_batch_jobs(batch_path):
+    with open(batch_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def grade_exam_args(job):
+    args = {batch_options.get(name, name): value for name, value in job.items()}
+    if "no_analysis" in args:
+        args["analysis"] = not args.pop("no_analysis")
+    return args
+
+def grade_batch(jobs, workers=1, progress=None):
+    started = time.perf_counter()
+    results = []
+    with grading_pool(workers):
+        for number, job in enumerate(jobs, start=1):
+            print(f"\n===== Exam {number}/{len(jobs)}: {job.get('input')} =====")
+            job_started = time.perf_counter()
+            try:
+                summary = grade_exam(**{"workers": workers, "progress": progress, **grade_exam_args(job)})
+            except Exception as e:
+                print(f"Error grading {job.get('input')}: {e}")
+                summary = {"success": False, "message": str(e)}
+            seconds = time.perf_counter() - job_started
+            pages = summary.get("metrics", {}).get("pages", 0)
+            results.append({"input": job.get("input"), "output": job.get("output"), "success": summary["success"],
+                            "message": summary.get("message"), "students": summary.get("students", 0),
+                            "pages": pages, "seconds": round(seconds, 3),
+                            "pages_per_second": round(pages / seconds, 2) if seconds > 0 else None})
+            if progress:
+                progress({"event": "progress", "stage": "batch", "done": number, "total": len(jobs)})
+
+    seconds = time.perf_counter() - started
+    pages = sum(result["pages"] for result in results)
+    total = {"exams": len(results), "failed": sum(not result["success"] for result in results),
+             "students": sum(result["students"] for result in results), "pages": pages,
+             "seconds": round(seconds, 3), "pages_per_second": round(pages / seconds, 2) if seconds > 0 else None}
+
+    print(f"\n===== Batch: {total['exams']} exams, {total['failed']} failed =====")
+    for result in results:
+        status = f"{result['students']} students" if result["success"] else f"FAILED ({result['message']})"
+        print(f"{result['input']}: {status}, {result['pages']} pages in {result['seconds']:.2f}s "
+              f"({result['pages_per_second'] or 0:.2f} pages/s)")
+    print(f"Total: {total['students']} students, {pages} pages in {seconds:.2f}s ({total['pages_per_second'] or 0:.2f} pages/s)")
+    return {"success": total["failed"] == 0, "jobs": results, "total": total}
+
+# ========== Entry Point ==========
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Correct bubble sheets")
+    parser.add_argument("--input", help="Input path (image, folder, or PDF)")
+    parser.add_argument("--excel", help="Answer key: Excel (Exam Details sheet), CSV (model,question,answer) or JSON")
+    parser.add_argument("--output", help="Path to save the output Excel file")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for PDF pages and folder images (0 = all cores)")
+    parser.add_argument("--max_memory_mb", type=int, default=512, help="Memory ceiling for rasterized PDF pages held at once")
+    parser.add_argument("--format", choices=["xlsx", "json"], default="xlsx", help="Output format (json skips the workbook and dashboard)")
+    parser.add_argument("--no_analysis", action="store_true", help="Skip the Analysis dashboard sheet")
+    parser.add_argument("--layout", help="Layout manifest written by Bubble.py (default: derived from the question count)")
+    parser.add_argument("--dpi", type=int, default=RASTER_DPI, help=f"Recognition resolution; PDFs are rasterized and larger images downscaled to it (e.g. 150, at least {MIN_DPI})")
+    parser.add_argument("--chart_dpi", type=int, default=CHART_DPI, help="Resolution of the Analysis dashboard charts")
+    parser.add_argument("--checkpoint_dir", help="Record each graded page here so an interrupted run resumes where it stopped")
+    parser.add_argument("--stream", help="Also append each graded sheet to this file as soon as it is read (.jsonl, .csv or .parquet)")
+    parser.add_argument("--progress", action="store_true", help="Write JSON progress events to stderr")
+    parser.add_argument("--metrics", help="Write per-page and per-run stage timings and memory as JSON (with --batch: the per-exam and total throughput)")
+    parser.add_argument("--profile", help="Run under cProfile and save the stats to this file")
+    parser.add_argument("--batch", help="JSON file listing many exams (each with the options above) to grade in one run")
+    args = parser.parse_args()
+    if args.dpi < MIN_DPI:
+        parser.error(f"--dpi must be at least {MIN_DPI}")
+    progress = print_progress if args.progress else None
+
+    if args.batch:
+        # Options given on the command line apply to every exam that does not set its own
+        jobs = load_batch_jobs(args.batch)
+        for job in jobs:
+            for name in ["max_memory_mb", "format", "no_analysis", "dpi", "chart_dpi", "checkpoint_dir"]:
+                job.setdefault(name, getattr(args, name))
+        summary = run_profiled(args.profile, grade_batch, jobs, args.workers, progress)
+        if args.metrics:
+            with open(args.metrics, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2)
+    else:
+        missing = [f"--{name}" for name in ["input", "excel", "output"] if getattr(args, name) is None]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+        summary = run_profiled(args.profile, grade_exam, args.input, args.excel, args.output, args.workers, args.max_memory_mb,
+                               analysis=not args.no_analysis, output_format=args.format, layout_path=args.layout, dpi=args.dpi,
+                               chart_dpi=args.chart_dpi, checkpoint_dir=args.checkpoint_dir, stream_path=args.stream,
+                               progress=progress, metrics_path=args.metrics)
+    if not summary["success"]:
+        exit(1)
@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import pandas as pd
+
+import Bubble
+import Correct
+
+# ========== Benchmark ==========
+# Renders sheets with Bubble.py, fills random bubbles (the ground truth), degrades the pages like a
+# scanner would (rotation, blur, noise, JPEG artifacts) and runs them through the Correct.py stages
+# one by one, reporting throughput, per-stage latency percentiles, peak memory and recognition
+# accuracy. Reports can be saved as a baseline and later runs compared against it:
+#   python benchmark.py --sheets 100 --save_baseline baseline.json
+#   python benchmark.py --sheets 100 --baseline baseline.json   (exit code 1 on a regression)
+
+sheet_fields = dict(title="Benchmark", course_name="Benchmark", course_code="BM101", course_level="1",
+                    term="First", exam_date="2025-01-01", full_mark="100", exam_time="2h",
+                    department="Computer Science", college_name="Engineering", university_name="University")
+
+# ========== Synthetic Sheets ==========
+def model_number(model):
+    # Bubble.py shades model bubble A, B, ... which Correct.py reads back as model 1, 2, ...
+    return str(ord(model.upper()) - ord('A') + 1)
+
+def blank_sheets(models, num_questions):
+    # One rendered template per model; the model bubble is already filled in by Bubble.py
+    return {model: Bubble.render_bubble_sheet(num_questions_val=num_questions, model_no=model, **sheet_fields)
+            for model in models}
+
+def fill_sheet(sheet, manifest, model, rng, blank_rate=0.1):
+    # Marks a random seat number and random answers (some left blank) and returns the ground truth
+    sheet = sheet.copy()
+    seat = manifest["seat"]
+    digits = {}
+    for place, row in zip(seat["place_values"], seat["rows"]):
+        digit = int(rng.integers(10))
+        digits[place] = digit
+        cv2.circle(sheet, tuple(row[digit]), seat["radius"] - 3, int(rng.integers(0, 60)), -1)
+
+    answers = manifest["answers"]
+    marked = []
+    for question in answers["questions"]:
+        if rng.random() < blank_rate:
+            marked.append('_')
+            continue
+        choice = int(rng.integers(len(question)))
+        cv2.circle(sheet, tuple(question[choice]), answers["radius"] - 3, int(rng.integers(0, 60)), -1)
+        marked.append(Correct.choices[choice])
+
+    truth = {"seat_num": ''.join(str(digits[place]) for place in sorted(digits, reverse=True)),
+             "model_no": model_number(model), "answers": marked}
+    return sheet, truth
+
+def scan_page(sheet, rng, rotation=0.0, blur=0, noise=0.0):
+    # Places the sheet on a 300 DPI A4 page the way ExamFilesGenerator's Word page prints it,
+    # turned by a random angle within +-rotation degrees, then blurs and adds sensor noise
+    (sx, sy), (ox, oy) = Correct.sheet_to_scan_scale, Correct.sheet_to_scan_offset
+    placement = np.array([[sx, 0, ox], [0, sy, oy], [0, 0, 1]])
+    page_size = (Correct.reference_page_width, 3508)
+    angle = rng.uniform(-rotation, rotation) if rotation else 0.0
+    turn = np.vstack([cv2.getRotationMatrix2D((page_size[0] / 2, page_size[1] / 2), angle, 1.0), [0, 0, 1]])
+    page = cv2.warpAffine(sheet, (turn @ placement)[:2], page_size, flags=cv2.INTER_LINEAR, borderValue=255)
+    if blur:
+        page = cv2.GaussianBlur(page, (blur | 1, blur | 1), 0)
+    if noise:
+        page = np.clip(page + rng.normal(0, noise, page.shape), 0, 255).astype(np.uint8)
+    return page
+
+def encode_page(page, jpeg_quality=0):
+    if jpeg_quality:
+        return cv2.imencode(".jpg", page, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1].tobytes()
+    return cv2.imencode(".png", page, [cv2.IMWRITE_PNG_COMPRESSION, 1])[1].tobytes()
+
+def synthetic_pages(count, num_questions, models, rng, rotation, blur, noise, jpeg_quality):
+    templates = blank_sheets(models, num_questions)
+    pages, truths = [], []
+    for _ in range(count):
+        model = models[int(rng.integers(len(models)))]
+        sheet, manifest = templates[model]
+        filled, truth = fill_sheet(sheet, manifest, model, rng)
+        pages.append(encode_page(scan_page(filled, rng, rotation, blur, noise), jpeg_quality))
+        truths.append(truth)
+    return pages, truths
+
+def write_answer_key(models, num_questions, rng, path):
+    key = {f"Model {model_number(model)}": [Correct.choices[int(c)] for c in rng.integers(4, size=num_questions)]
+           for model in models}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(key, f)
+    return path
+
+def write_pdf(pages, path, dpi=Correct.RASTER_DPI):
+    from PIL import Image
+    images = [Image.fromarray(Correct.load_gray_page(page)) for page in pages]
+    images[0].save(path, "PDF", save_all=True, append_images=images[1:], resolution=dpi)
+    return path
+
+# ========== Measurements ==========
+def percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {"p50": round(float(np.percentile(ms, 50)), 2), "p90": round(float(np.percentile(ms, 90)), 2),
+            "p99": round(float(np.percentile(ms, 99)), 2), "max": round(float(ms.max()), 2)}
+
+def accuracy(readings, truths):
+    seat = model = bubbles = questions = sheets = 0
+    for reading, truth in zip(readings, truths):
+        marked = [a for _, a in reading["answers"]] if reading else []
+        seat += bool(reading) and reading["seat_num"] == truth["seat_num"]
+        model += bool(reading) and reading["model_no"] == truth["model_no"]
+        bubbles += sum(a == b for a, b in zip(marked, truth["answers"]))
+        questions += len(truth["answers"])
+        sheets += bool(reading) and marked == truth["answers"] and reading["seat_num"] == truth["seat_num"] \
+            and reading["model_no"] == truth["model_no"]
+    count = max(len(truths), 1)
+    return {"seat": round(seat / count, 4), "model": round(model / count, 4),
+            "answers": round(bubbles / max(questions, 1), 4), "sheets": round(sheets / count, 4)}
+
+# ========== Pipeline Stages ==========
+def run_pipeline(pages, truths, key_path, work_dir, dpi=Correct.RASTER_DPI, chart_dpi=Correct.CHART_DPI, pdf=False):
+    stage_times = {"rasterize": [], "decode": [], "preprocess": [], "score": []}
+    key = Correct.load_correct_answers(key_path, cache_dir=None)
+    layout = Correct.load_layout(num_questions=Correct.count_key_questions(key))
+
+    sources = pages
+    if pdf:
+        pdf_path = write_pdf(pages, os.path.join(work_dir, "pages.pdf"))
+        try:
+            sources = []
+            for page_number in range(1, len(pages) + 1):
+                started = time.perf_counter()
+                sources.append(np.asarray(Correct.rasterize_pdf_page(pdf_path, page_number, dpi)))
+                stage_times["rasterize"].append(time.perf_counter() - started)
+        except Exception as e:
+            print(f"Rasterize stage skipped ({e}); reading the encoded images instead")
+            sources, stage_times["rasterize"] = pages, []
+
+    readings = []
+    loop_started = time.perf_counter()
+    for source in sources:
+        started = time.perf_counter()
+        gray = Correct.load_gray_page(source)
+        decoded = time.perf_counter()
+        thresh, roi_index, registered = Correct.preprocess_page(gray, layout, dpi)
+        preprocessed = time.perf_counter()
+        reading = Correct.read_bubbles(thresh, roi_index)
+        reading["registered"] = registered
+        scored = time.perf_counter()
+        stage_times["decode"].append(decoded - started)
+        stage_times["preprocess"].append(preprocessed - decoded)
+        stage_times["score"].append(scored - preprocessed)
+        readings.append(reading)
+    loop_seconds = time.perf_counter() - loop_started + sum(stage_times["rasterize"])
+
+    started = time.perf_counter()
+    all_outputs, cohort = Correct.score_cohort(readings, key)
+    items_df = Correct.item_analysis(cohort)
+    grade_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    Correct.write_results_workbook(all_outputs, os.path.join(work_dir, "results.xlsx"), analysis=False,
+                                   items_df=items_df)
+    export_seconds = time.perf_counter() - started
+
+    from openpyxl import Workbook
+    results_df = pd.DataFrame(all_outputs).sort_values(by="Seat Number")[["Seat Number", "Model", "Grade", "Score (%)", "Total"]]
+    started = time.perf_counter()
+    wb = Workbook(write_only=True)
+    Correct.register_sheet_styles(wb)
+    Correct.write_analysis_sheet(wb, results_df, chart_dpi)
+    wb.save(os.path.join(work_dir, "dashboard.xlsx"))
+    dashboard_seconds = time.perf_counter() - started
+
+    stages = {stage: percentiles(times) for stage, times in stage_times.items() if times}
+    cohort_stages = {"grade": round(grade_seconds * 1000, 2), "export": round(export_seconds * 1000, 2),
+                     "dashboard": round(dashboard_seconds * 1000, 2)}
+    return {
+        "pages_per_second": round(len(sources) / loop_seconds, 2),
+        "stages_ms": stages,
+        "cohort_ms": cohort_stages,
+        "accuracy": accuracy(readings, truths),
+        "unregistered": sum(not r["registered"] for r in readings),
+    }
+
+# ========== Baselines ==========
+def compare_to_baseline(report, baseline, tolerance=0.2, accuracy_tolerance=0.005):
+    # Returns the regressions: accuracy that dropped, throughput that fell or memory that grew
+    # by more than the tolerance
+    regressions = []
+    if baseline.get("config") != report["config"]:
+        print("Warning: baseline was recorded with a different configuration")
+    for metric, value in report["accuracy"].items():
+        previous = baseline.get("accuracy", {}).get(metric)
+        if previous is not None and value < previous - accuracy_tolerance:
+            regressions.append(f"accuracy.{metric}: {previous} -> {value}")
+    previous = baseline.get("pages_per_second")
+    if previous and report["pages_per_second"] < previous * (1 - tolerance):
+        regressions.append(f"pages_per_second: {previous} -> {report['pages_per_second']}")
+    previous = baseline.get("peak_rss_mb")
+    if previous and report["peak_rss_mb"] and report["peak_rss_mb"] > previous * (1 + tolerance):
+        regressions.append(f"peak_rss_mb: {previous} -> {report['peak_rss_mb']}")
+    return regressions
+
+def print_report(report):
+    print(f"\n{report['config']['sheets']} sheets, {report['config']['questions']} questions: "
+          f"{report['pages_per_second']} pages/s, peak RSS {report['peak_rss_mb']} MB")
+    for stage, stats in report["stages_ms"].items():
+        print(f"  {stage:<11} " + "  ".join(f"{name} {value:8.2f} ms" for name, value in stats.items()))
+    for stage, ms in report["cohort_ms"].items():
+        print(f"  {stage:<11} {ms:.2f} ms (whole cohort)")
+    print("  accuracy    " + "  ".join(f"{name} {value:.2%}" for name, value in report["accuracy"].items()))
+    if report["unregistered"]:
+        print(f"  {report['unregistered']} pages fell back to the nominal layout")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bubble sheet recognition on synthetic scans")
+    parser.add_argument("--sheets", type=int, default=50, help="Number of synthetic sheets")
+    parser.add_argument("--questions", type=int, default=48, help="Questions per sheet")
+    parser.add_argument("--models", default="A,B,C", help="Comma-separated exam models")
+    parser.add_argument("--rotation", type=float, default=1.0, help="Maximum page rotation in degrees")
+    parser.add_argument("--blur", type=int, default=0, help="Gaussian blur kernel size (0 = none)")
+    parser.add_argument("--noise", type=float, default=4.0, help="Standard deviation of the pixel noise")
+    parser.add_argument("--jpeg", type=int, default=85, help="JPEG quality of the scans (0 = lossless PNG)")
+    parser.add_argument("--pdf", action="store_true", help="Bundle the scans in a PDF to include the rasterize stage")
+    parser.add_argument("--dpi", type=int, default=Correct.RASTER_DPI, help="Recognition resolution")
+    parser.add_argument("--chart_dpi", type=int, default=Correct.CHART_DPI, help="Resolution of the dashboard charts")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic sheets")
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--baseline", help="Compare against a saved report; exits with 1 on a regression")
+    parser.add_argument("--save_baseline", help="Save this report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative throughput/memory regression")
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in ("sheets", "questions", "models", "rotation", "blur", "noise",
+                                                  "jpeg", "pdf", "dpi", "chart_dpi", "seed")}
+    rng = np.random.default_rng(args.seed)
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+    work_dir = tempfile.mkdtemp(prefix="bubble_benchmark_")
+    try:
+        print(f"Rendering {args.sheets} synthetic sheets...")
+        pages, truths = synthetic_pages(args.sheets, args.questions, models, rng,
+                                        args.rotation, args.blur, args.noise, args.jpeg)
+        key_path = write_answer_key(models, args.questions, rng, os.path.join(work_dir, "key.json"))
+        report = run_pipeline(pages, truths, key_path, work_dir, args.dpi, args.chart_dpi, args.pdf)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    report = {"config": config, **report, "peak_rss_mb": Correct.peak_rss_mb()}
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to: {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            exit(1)
+        print("No regressions against the baseline")
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+
+import Correct
+import Bubble
+
+# ========== Persistent Worker ==========
+# Reads one JSON job per line on stdin and answers with one JSON line on stdout:
+#   {"id": "1", "type": "grade", "args": {"input": ..., "excel": ..., "output": ..., "workers": 4}}
+#   {"id": "2", "type": "generate", "args": {"models": "A,B", "title": ..., "output_dir": ..., ...}}
+#   {"id": "3", "type": "generate_batch", "args": {"exams": [{...Bubble.py options...}, ...], "workers": 4}}
+#   {"id": "4", "type": "generate_roster", "args": {"roster": "students.csv", "models": "A,B", "format": "pdf", ...Bubble.py options...}}
+#   {"id": "5", "type": "grade_batch", "args": {"jobs": [{"input": ..., "excel": ..., "output": ...}, ...], "workers": 4}}
+# Before its response a job may send progress events tagged with its id (see Correct.py):
+#   {"job": "1", "event": "progress", "stage": "read", "page": 3, "done": 3, "total": 40}
+# Libraries and answer keys stay loaded between jobs, so a job only pays for its own work.
+
+def run_grade(args, progress):
+    return Correct.run_profiled(args.get("profile"), Correct.grade_exam, args["input"], args["excel"], args["output"],
+                                args.get("workers", 1), args.get("max_memory_mb", 512),
+                                args.get("analysis", True), args.get("format", "xlsx"), args.get("layout"),
+                                args.get("dpi", Correct.RASTER_DPI), args.get("chart_dpi", Correct.CHART_DPI),
+                                args.get("checkpoint_dir"), args.get("stream"), progress, args.get("metrics"))
+
+def run_grade_batch(args, progress):
+    return Correct.run_profiled(args.get("profile"), Correct.grade_batch, args["jobs"], args.get("workers", 1), progress)
+
+def run_generate(args, progress):
+    args = Bubble.exam_sheet_args(args)
+    models = args.pop("models")
+    return {"success": True, "paths": Bubble.generate_bubble_sheets(models, **args)}
+
+def run_generate_batch(args, progress):
+    exams = [Bubble.exam_sheet_args(exam) for exam in args["exams"]]
+    return {"success": True, "sheets": Bubble.generate_batch(exams, args.get("workers", 1))}
+
+def run_generate_roster(args, progress):
+    args = Bubble.exam_sheet_args(args)
+    rooms = Bubble.generate_roster(args.pop("roster"), args.pop("models", None), args.pop("output_dir"),
+                                   args.pop("output_format", "tiff-g4"), args.pop("workers", 1), **args)
+    return {"success": True, "rooms": rooms}
+
+job_handlers = {
+    "grade": run_grade,
+    "grade_batch": run_grade_batch,
+    "generate": run_generate,
+    "generate_batch": run_generate_batch,
+    "generate_roster": run_generate_roster,
+}
+
+def handle_request(request, channel):
+    started = time.perf_counter()
+    response = {"id": request.get("id")}
+
+    def progress(event):
+        write_message(channel, {"job": request.get("id"), **event})
+
+    handler = job_handlers.get(request.get("type"))
+    if handler is None:
+        response.update(success=False, message=f"Unknown job type: {request.get('type')}")
+    else:
+        try:
+            response.update(handler(dict(request.get("args") or {}), progress))
+        except Exception as e:
+            traceback.print_exc()
+            response.update(success=False, message=str(e))
+    response["seconds"] = round(time.perf_counter() - started, 3)
+    return response
+
+def write_message(channel, message):
+    channel.write(json.dumps(message) + "\n")
+    channel.flush()
+
+def serve(channel):
+    write_message(channel, {"id": None, "event": "ready"})
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            write_message(channel, {"id": None, "success": False, "message": f"Invalid request: {e}"})
+            continue
+        if request.get("type") == "shutdown":
+            write_message(channel, {"id": request.get("id"), "success": True})
+            break
+        write_message(channel, handle_request(request, channel))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve grading and sheet generation jobs over stdin/stdout")
+    parser.parse_args()
+
+    # Keep a private handle on the real stdout for responses and point fd 1 at stderr,
+    # so progress prints (including those of pool workers) never mix with the protocol
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    serve(channel)
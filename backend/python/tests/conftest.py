@@ -0,0 +1,10 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SHEET_ARGS = {
+    "title": "Midterm", "course_name": "Physics", "course_code": "PHY101", "course_level": "1",
+    "term": "First Term", "num_questions_val": 60, "exam_date": "01/01/2026", "full_mark": "60",
+    "exam_time": "2 Hours", "department": "Physics", "college_name": "Science", "university_name": "University",
+}
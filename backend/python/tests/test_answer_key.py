@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+import Correct
+
+
+def write_key_workbook(path, models):
+    # The "Exam Details" layout: model names on row 3, each over a question and an answer column
+    rows = [[None] * (2 * len(models)) for _ in range(3)]
+    for i, (model, answers) in enumerate(models.items()):
+        rows[2][2 * i] = model
+    for q in range(max(len(answers) for answers in models.values())):
+        row = []
+        for answers in models.values():
+            row += [f"Question {q + 1}", answers[q]] if q < len(answers) else [None, None]
+        rows.append(row)
+    pd.DataFrame(rows).to_excel(path, sheet_name="Exam Details", header=False, index=False)
+
+
+def test_numeric_model_names_are_cached_as_strings(tmp_path, monkeypatch):
+    key_path = tmp_path / "key.xlsx"
+    write_key_workbook(key_path, {1: "ABC", "Model 2": "DCB"})
+    monkeypatch.setattr(Correct, "answer_key_cache", {})
+
+    parsed = Correct.load_correct_answers(str(key_path), cache_dir=str(tmp_path / "cache"))
+    monkeypatch.setattr(Correct, "answer_key_cache", {})
+    cached = Correct.load_correct_answers(str(key_path), cache_dir=str(tmp_path / "cache"))
+
+    assert list(parsed) == list(cached) == ["1", "Model 2"]
+    assert all(np.array_equal(parsed[model], cached[model]) for model in parsed)
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+
+def test_cache_write_failure_is_not_fatal(tmp_path, monkeypatch, capsys):
+    key_path = tmp_path / "key.xlsx"
+    write_key_workbook(key_path, {"Model 1": "ABC"})
+    monkeypatch.setattr(Correct, "answer_key_cache", {})
+
+    def fail(*args, **kwargs):
+        raise ValueError("cannot store this key")
+
+    monkeypatch.setattr(Correct.np, "savez", fail)
+    correct_answers = Correct.load_correct_answers(str(key_path), cache_dir=str(tmp_path / "cache"))
+
+    assert list(correct_answers["Model 1"][1:]) == ["A", "B", "C"]
+    assert "could not cache answer key: cannot store this key" in capsys.readouterr().out
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+import benchmark
+import Correct
+
+
+@pytest.mark.parametrize("dpi", [Correct.RASTER_DPI, 150, Correct.MIN_DPI])
+def test_synthetic_scans_read_correctly_down_to_min_dpi(tmp_path, dpi):
+    rng = np.random.default_rng(0)
+    pages, truths = benchmark.synthetic_pages(8, 48, ["A", "B"], rng, rotation=1.0, blur=0, noise=4.0, jpeg_quality=85)
+    key_path = benchmark.write_answer_key(["A", "B"], 48, rng, str(tmp_path / "key.json"))
+    report = benchmark.run_pipeline(pages, truths, key_path, str(tmp_path), dpi=dpi)
+
+    assert report["accuracy"] == {"seat": 1.0, "model": 1.0, "answers": 1.0, "sheets": 1.0}
+    assert report["unregistered"] == 0
+
+
+def test_grading_below_min_dpi_is_refused(tmp_path):
+    summary = Correct.grade_exam(str(tmp_path), str(tmp_path / "key.json"), str(tmp_path / "out.xlsx"),
+                                 dpi=Correct.MIN_DPI - 1)
+    assert not summary["success"]
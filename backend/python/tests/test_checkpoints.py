@@ -0,0 +1,46 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import benchmark
+import Correct
+
+
+def write_scans(folder, count):
+    rng = np.random.default_rng(0)
+    pages, _ = benchmark.synthetic_pages(count, 60, ["A"], rng, rotation=0.5, blur=1, noise=2.0, jpeg_quality=0)
+    folder.mkdir()
+    for number, page in enumerate(pages, start=1):
+        (folder / f"scan_{number}.png").write_bytes(page)
+    return benchmark.write_answer_key(["A"], 60, rng, str(folder.parent / "key.json"))
+
+
+def test_resume_rereads_only_unread_pages(tmp_path, monkeypatch):
+    key_path = write_scans(tmp_path / "scans", 4)
+    args = (str(tmp_path / "scans"), key_path, str(tmp_path / "results.json"))
+    options = {"output_format": "json", "checkpoint_dir": str(tmp_path / "checkpoints")}
+    extract_bubble_sheet = Correct.extract_bubble_sheet
+    reads = []
+
+    def interrupted_read(path, layout, dpi):
+        # scan 2 cannot be read and the run dies on scan 3
+        name = os.path.basename(path)
+        reads.append(name)
+        if name == "scan_3.png":
+            raise KeyboardInterrupt
+        return None if name == "scan_2.png" else extract_bubble_sheet(path, layout, dpi)
+
+    monkeypatch.setattr(Correct, "extract_bubble_sheet", interrupted_read)
+    with pytest.raises(KeyboardInterrupt):
+        Correct.grade_exam(*args, **options)
+    assert reads == ["scan_1.png", "scan_2.png", "scan_3.png"]
+
+    reads.clear()
+    monkeypatch.setattr(Correct, "extract_bubble_sheet",
+                        lambda path, layout, dpi: reads.append(os.path.basename(path)) or extract_bubble_sheet(path, layout, dpi))
+    assert Correct.grade_exam(*args, **options)["success"]
+    assert reads == ["scan_2.png", "scan_3.png", "scan_4.png"]
+    with open(tmp_path / "results.json", encoding="utf-8") as f:
+        assert len(json.load(f)) == 4
@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+import Bubble
+import Correct
+
+# question -> (bubbles to shade with their gray level, expected answer, expected flag)
+CASES = {
+    1: ({}, "_", "clear"),
+    2: ({"A": 20}, "A", "clear"),
+    3: ({"B": 170}, "B", "review"),                # faint pencil
+    4: ({"C": 220, "D": 20}, "D", "review"),      # C erased, D marked
+    5: ({"A": 20, "C": 30}, "*", "multiple"),
+}
+
+
+def marked_sheet():
+    sheet, manifest = benchmark.blank_sheets(["A"], 48)["A"]
+    ink = np.full(sheet.shape, 255, np.uint8)
+    radius = manifest["answers"]["radius"] - 3
+    for question, (marks, _, _) in CASES.items():
+        for choice, gray in marks.items():
+            center = tuple(manifest["answers"]["questions"][question - 1][Correct.choices.index(choice)])
+            cv2.circle(ink, center, radius, gray, -1)
+    return np.minimum(sheet, ink)
+
+
+@pytest.mark.parametrize("scan, dpi", [(False, None), (True, Correct.RASTER_DPI), (True, Correct.MIN_DPI)])
+def test_each_kind_of_mark_gets_its_answer_and_flag(scan, dpi):
+    sheet = marked_sheet()
+    if scan:
+        page = benchmark.scan_page(sheet, np.random.default_rng(0), rotation=1.0, noise=4.0)
+        reading = Correct.extract_bubble_sheet(page, Correct.load_layout(num_questions=48), dpi)
+    else:
+        reading = Correct.extract_bubble_sheet(sheet, Correct.load_layout(num_questions=48), Bubble.SHEET_DPI)
+
+    answers = dict(reading["answers"])
+    flags = reading["confidence"]["answers"]
+    for question, (_, answer, flag) in CASES.items():
+        assert (answers[question], flags[question - 1]) == (answer, flag), f"Q{question}"
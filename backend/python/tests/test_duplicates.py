@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+import benchmark
+import Bubble
+import Correct
+from conftest import SHEET_ARGS
+
+ANSWERS = [i % 4 for i in range(60)]
+
+
+def fill_page(seat, answers=ANSWERS):
+    # A filled-in sheet; "_" leaves that seat digit blank
+    manifest = Bubble.build_layout_manifest(60)
+    page = Bubble.render_bubble_sheet(model_no="A", **SHEET_ARGS)[0].copy()
+    for digit_pos, row in enumerate(manifest["seat"]["rows"]):
+        digit = seat[-1 - digit_pos]
+        if digit != "_":
+            cv2.circle(page, tuple(row[int(digit)]), manifest["seat"]["radius"] - 3, 0, -1)
+    for question, choice in zip(manifest["answers"]["questions"], answers):
+        cv2.circle(page, tuple(question[choice]), manifest["answers"]["radius"] - 3, 0, -1)
+    return page
+
+
+def read_sheet(seat, answers=ANSWERS):
+    # The filled-in sheet as the grader reads it
+    sheet = Correct.extract_bubble_sheet(fill_page(seat, answers), Correct.load_layout(num_questions=60), Bubble.SHEET_DPI)
+    assert sheet["seat_num"] == seat
+    return sheet
+
+
+def scan_sheet(page, seed, **degradation):
+    return Correct.extract_bubble_sheet(benchmark.scan_page(page, np.random.default_rng(seed), **degradation),
+                                        Correct.load_layout(num_questions=60))
+
+
+def test_rescan_with_the_same_seat_is_skipped():
+    scan_index = Correct.open_scan_index()
+    assert Correct.index_scan(scan_index, 1, read_sheet("1234")) is None
+    assert Correct.index_scan(scan_index, 2, read_sheet("1234")) == 1
+    assert [issue["Issue"] for issue in Correct.scan_issues(scan_index)] == ["Duplicate scan (skipped)"]
+
+
+def test_same_answers_with_an_unreadable_seat_digit_are_kept():
+    # Two students who gave the same answers; the second one's seat is missing a digit
+    scan_index = Correct.open_scan_index()
+    assert Correct.index_scan(scan_index, 1, read_sheet("1234")) is None
+    assert Correct.index_scan(scan_index, 2, read_sheet("5_78")) is None
+    assert Correct.scan_issues(scan_index) == []
+
+
+def test_partial_seat_that_agrees_is_kept_as_possible_duplicate():
+    scan_index = Correct.open_scan_index()
+    assert Correct.index_scan(scan_index, 1, read_sheet("1234")) is None
+    assert Correct.index_scan(scan_index, 2, read_sheet("1_34")) is None
+    assert Correct.scan_issues(scan_index) == [
+        {"Issue": "Possible duplicate", "Page": 2, "Seat Number": "1_34", "Matches Page": 1}]
+
+
+def test_turned_and_noisy_rescan_is_still_matched():
+    page = fill_page("1234")
+    first = scan_sheet(page, 0)
+    rescan = scan_sheet(page, 4, rotation=2.0, blur=3, noise=8.0)
+    # Further apart than an ordinary rescan, still closer than two different sheets
+    assert 10 < bin(int(first["fingerprint"], 16) ^ int(rescan["fingerprint"], 16)).count("1") <= Correct.duplicate_distance
+
+    scan_index = Correct.open_scan_index()
+    assert Correct.index_scan(scan_index, 1, first) is None
+    assert Correct.index_scan(scan_index, 2, rescan) == 1
@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_dashboard_import_time_covers_matplotlib(workers):
+    # A fresh interpreter, so matplotlib is imported cold by the dashboard itself
+    script = textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+        import pandas as pd
+        from openpyxl import Workbook
+        import Correct
+        results = pd.DataFrame({{"Seat Number": ["1", "2", "3"], "Score (%)": ["50%", "70%", "90%"],
+                                 "Model": ["1", "1", "2"], "Grade": [1, 2, 3]}})
+        Correct.write_analysis_sheet(Workbook(write_only=True), results, 72, {workers})
+        print(Correct.import_times["dashboard"])
+    """)
+    output = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True).stdout
+    assert float(output.split()[-1]) > 0.05
@@ -0,0 +1,25 @@
+import pytest
+
+import Correct
+
+
+def make_sheet(seat, marks):
+    return {"seat_num": seat, "model_no": "1", "answers": list(enumerate(marks, start=1)), "confidence": None}
+
+
+def test_item_statistics_match_hand_computed_values():
+    # Key A B C; the scores are 3, 2, 2, 1 and 0
+    correct_answers = {"Model 1": Correct.compile_model_key(["Q1", "Q2", "Q3"], ["A", "B", "C"])}
+    sheets = [make_sheet(f"000{i}", marks) for i, marks in enumerate(["ABC", "ABD", "ACC", "BB*", "_DA"], start=1)]
+    _, cohort = Correct.score_cohort(sheets, correct_answers)
+    items = Correct.item_analysis(cohort).set_index("Question")
+
+    assert list(items["Key"]) == ["A", "B", "C"]
+    assert list(items["Students"]) == [5, 5, 5]
+    assert list(items["Difficulty"]) == [0.6, 0.6, 0.4]
+    # Point-biserial against the rest of the score, e.g. Q1: item 1 1 1 0 0, rest 2 1 1 1 0,
+    # r = 1 / sqrt(1.2 * 2); Q2: item 1 1 0 1 0, rest 2 1 2 0 0, r = 0
+    assert items["Discrimination"].tolist() == pytest.approx([0.645, 0.0, 0.327])
+    assert items.loc[1, ["A", "B", "C", "D", "Blank", "Multiple"]].tolist() == ["60.0%", "20.0%", "0.0%", "0.0%", "20.0%", "0.0%"]
+    assert items.loc[2, ["A", "B", "C", "D", "Blank", "Multiple"]].tolist() == ["0.0%", "60.0%", "20.0%", "20.0%", "0.0%", "0.0%"]
+    assert items.loc[3, ["A", "B", "C", "D", "Blank", "Multiple"]].tolist() == ["20.0%", "0.0%", "40.0%", "20.0%", "0.0%", "20.0%"]
@@ -0,0 +1,76 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import Bubble
+import Correct
+from conftest import SHEET_ARGS
+
+SEATS = ["1111", "2222", "3333", "4444"]
+
+
+def scanned_pages():
+    geometry = Bubble.header_geometry(Bubble.SHEET_PAPER_SIZE, with_model=True)
+    base = Bubble.render_bubble_sheet(model_no="A", **SHEET_ARGS)[0]
+    pages = []
+    for seat in SEATS:
+        page = base.copy()
+        Bubble.draw_student(page, {"seat": seat, "name": ""}, geometry)
+        pages.append(Image.fromarray(page))
+    return pages
+
+
+def fake_pdf2image(pages, corrupt_page, failure):
+    # Stands in for poppler: page corrupt_page either fails to rasterize (taking its whole
+    # chunk with it) or rasterizes to an empty image that cannot be read
+    def convert_from_path(pdf_path, dpi, first_page, last_page, grayscale):
+        if failure == "rasterize" and first_page <= corrupt_page <= last_page:
+            raise RuntimeError("Syntax Error: bad content stream")
+        return [Image.new("L", (0, 0)) if n == corrupt_page else pages[n - 1]
+                for n in range(first_page, last_page + 1)]
+
+    def pdfinfo_from_path(pdf_path):
+        fake.info_calls += 1
+        return {"Pages": len(pages), "Page size": "595 x 842 pts (A4)"}
+
+    fake = types.SimpleNamespace(convert_from_path=convert_from_path, pdfinfo_from_path=pdfinfo_from_path, info_calls=0)
+    return fake
+
+
+@pytest.mark.parametrize("failure", ["rasterize", "read"])
+def test_corrupt_page_does_not_lose_the_other_pages(monkeypatch, capsys, failure):
+    pdf2image = fake_pdf2image(scanned_pages(), 2, failure)
+    monkeypatch.setitem(sys.modules, "pdf2image", pdf2image)
+    sheets = []
+    results = Correct.process_pdf_file("exam.pdf", workers=1, layout=Correct.load_layout(num_questions=60),
+                                       dpi=Bubble.SHEET_DPI, on_sheet=lambda page, *_: sheets.append(page))
+
+    assert [sheet["seat_num"] for sheet in results] == ["1111", "3333", "4444"]
+    assert sheets == [1, 3, 4]
+    assert "Error grading page 2/4" in capsys.readouterr().out
+    assert pdf2image.info_calls == 1
+
+
+def test_parallel_reading_hands_out_pages_within_the_memory_ceiling(monkeypatch):
+    pdf2image = fake_pdf2image(scanned_pages(), None, None)
+    monkeypatch.setitem(sys.modules, "pdf2image", pdf2image)
+    # Two A4 pages fit in 20 MB at this resolution
+    assert Correct.pages_per_chunk(pdf2image.pdfinfo_from_path("exam.pdf"), Bubble.SHEET_DPI, 20) == 2
+    pdf2image.info_calls = 0
+    handed_out = []
+    run_grading_tasks = Correct.run_grading_tasks
+
+    def run_in_process(tasks, workers, on_result):
+        handed_out.append([args[1] for _, args, _ in tasks])
+        return run_grading_tasks(tasks, 1, on_result)
+
+    monkeypatch.setattr(Correct, "run_grading_tasks", run_in_process)
+    results = Correct.process_pdf_file("exam.pdf", workers=4, max_memory_mb=20,
+                                       layout=Correct.load_layout(num_questions=60), dpi=Bubble.SHEET_DPI)
+
+    assert handed_out == [[1, 2], [3, 4]]
+    assert [sheet["seat_num"] for sheet in results] == SEATS
+    assert pdf2image.info_calls == 1
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+from PIL import Image
+
+import Bubble
+from conftest import SHEET_ARGS
+
+
+def write_roster(path, count, rooms=1):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("seat,name,room,model\n")
+        for i in range(count):
+            f.write(f"{1000 + i},Student {i},Hall {i % rooms},{'AB'[i % 2]}\n")
+
+
+def test_roster_tiff_pages_match_rendered_sheets(tmp_path):
+    roster = tmp_path / "roster.csv"
+    write_roster(roster, 5)
+    [result] = Bubble.generate_roster(str(roster), "", str(tmp_path), **SHEET_ARGS)
+
+    students = Bubble.read_roster(str(roster))
+    geometry = Bubble.header_geometry(Bubble.SHEET_PAPER_SIZE, with_model=True)
+    bases = {model: Bubble.render_bubble_sheet(model_no=model, **SHEET_ARGS)[0] for model in "AB"}
+    with Image.open(result["path"]) as tiff:
+        assert tiff.n_frames == len(students)
+        for index, student in enumerate(students):
+            tiff.seek(index)
+            page = bases[student["model"]].copy()
+            Bubble.draw_student(page, student, geometry)
+            assert tiff.info["compression"] == "group4"
+            assert np.array_equal(np.asarray(tiff), page >= 128)
+
+
+def test_large_room_memory_stays_bounded(tmp_path):
+    roster = tmp_path / "roster.csv"
+    write_roster(roster, 600)
+    script = textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {os.path.dirname(os.path.abspath(Bubble.__file__))!r})
+        sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+        import Bubble
+        from conftest import SHEET_ARGS
+        Bubble.generate_roster({str(roster)!r}, "", {str(tmp_path)!r}, **SHEET_ARGS)
+        # VmHWM is this process's own peak; ru_maxrss would carry over pytest's peak through fork
+        print(open("/proc/self/status").read().split("VmHWM:")[1].split()[0])
+    """)
+    output = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True).stdout
+    peak_mb = int(output.split()[-1]) / 1024
+
+    with Image.open(tmp_path / "roster_Hall_0_60_Q.tif") as tiff:
+        assert tiff.n_frames == 600
+    assert peak_mb < 400, f"peak RSS {peak_mb:.0f} MB"
+
+
+def test_cli_reports_missing_models_as_usage_error(tmp_path):
+    roster = tmp_path / "roster.csv"
+    roster.write_text("seat,name,room\n1001,Student 1,Hall 1\n", encoding="utf-8")
+    options = [f"--{name}={value}" for name, value in SHEET_ARGS.items() if name != "num_questions_val"]
+    run = subprocess.run([sys.executable, Bubble.__file__, *options, "--num_questions=60", f"--output_dir={tmp_path}",
+                          f"--roster={roster}", "--format=tiff-g4"], capture_output=True, text=True)
+
+    assert run.returncode == 2
+    assert "error: Seat 1001 has no model and no --models were given" in run.stderr
+    assert "Traceback" not in run.stderr
+
+
+def test_names_the_sheet_font_cannot_draw_are_reported(tmp_path, capsys):
+    roster = tmp_path / "roster.csv"
+    roster.write_text("seat,name,room,model\n1001,José Müller,Hall 1,A\n1002,أحمد علي,Hall 1,A\n",
+                      encoding="utf-8")
+    Bubble.generate_roster(str(roster), "", str(tmp_path), "pdf", **SHEET_ARGS)
+
+    assert "Warning: 1 name(s) have characters pdf sheets cannot draw and will print as '?' (seats 1002)" in capsys.readouterr().out
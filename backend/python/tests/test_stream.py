@@ -0,0 +1,38 @@
+import json
+
+import Correct
+
+
+def make_sheet(seat, model, marks):
+    return {"seat_num": seat, "model_no": model, "answers": list(enumerate(marks, start=1)), "confidence": None}
+
+
+def test_stream_compiles_keys_once_and_reports_unknown_models_once(tmp_path, monkeypatch, capsys):
+    correct_answers = {"Model 1": Correct.compile_model_key(["Q1", "Q2", "Q3"], ["A", "B", "C"])}
+    sheets = [make_sheet(f"{i:04d}", "1" if i % 2 else "4", "ABD") for i in range(10)]
+    key_builds = []
+    key_matrix = Correct.key_matrix
+    monkeypatch.setattr(Correct, "key_matrix", lambda *args: key_builds.append(args) or key_matrix(*args))
+
+    # As grade_exam does: compile once, stream each sheet as it is read, then score the cohort
+    compiled_keys = Correct.compile_keys(correct_answers)
+    stream = Correct.open_results_stream(str(tmp_path / "results.jsonl"))
+    for page, sheet in enumerate(sheets, start=1):
+        Correct.append_results_stream(stream, page, sheet, correct_answers, compiled_keys)
+    Correct.close_results_stream(stream)
+    outputs, _ = Correct.score_cohort(sheets, correct_answers, compiled_keys)
+
+    assert len(key_builds) == 1
+    assert capsys.readouterr().out.count("Model 4 not found") == 1
+    with open(tmp_path / "results.jsonl", encoding="utf-8") as f:
+        streamed = [json.loads(line) for line in f]
+    assert [{k: v for k, v in row.items() if k != "Page"} for row in streamed] == outputs
+    assert [row["Grade"] for row in outputs] == [2] * 5
+
+
+def test_compiled_keys_grade_like_per_call_keys():
+    correct_answers = {"Model 1": Correct.compile_model_key(["Q1", "Q2"], ["A", "B"]),
+                       "Model 2": Correct.compile_model_key(["Q1", "Q2", "Q3", "Q4"], ["D", "C", "B", "A"])}
+    sheets = [make_sheet("0001", "1", "ABCD"), make_sheet("0002", "2", "DCB"), make_sheet("0003", "2", "DC*A_")]
+    assert (Correct.score_cohort(sheets, correct_answers, Correct.compile_keys(correct_answers))[0]
+            == Correct.score_cohort(sheets, correct_answers)[0])